@@ -2,41 +2,84 @@
 import os
 import sqlite3
 import hashlib
+import hmac
 import logging
 from logging.handlers import RotatingFileHandler
 import threading
+import queue
+import json
 import time
 from datetime import datetime
 import configparser
+import argparse
+import tempfile
+import shutil
 import psutil
 from watchdog.observers.polling import PollingObserver as Observer
 from watchdog.events import FileSystemEventHandler
-from flask import Flask, jsonify, render_template
+from flask import Flask, jsonify, render_template, request, Response, g
 from flask_httpauth import HTTPBasicAuth
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_cors import CORS
 import sys
 from pathlib import Path
 import platform
+import ipaddress
+import socket
+import struct
+import select
+import bisect
+import ctypes
+import ctypes.util
+import errno
+import stat
+import glob
+import fnmatch
+import re
+import concurrent.futures
+import random
+import mmap
+import signal
+import multiprocessing
+from collections import namedtuple, OrderedDict, deque
+from itertools import repeat
+from array import array
+try:
+    import pwd # تحويل uid إلى اسم مستخدم (غير متاح على ويندوز)
+except ImportError:
+    pwd = None
 try:
     import logging as scapy_logging
     scapy_logging.getLogger("scapy.runtime").setLevel(scapy_logging.ERROR)
     scapy_logging.getLogger("scapy.loading").setLevel(scapy_logging.ERROR)
-    from scapy.all import sniff, IP, TCP, UDP, ICMP, get_if_list, get_if_addr
+    from scapy.all import sniff, IP, IPv6, TCP, UDP, ICMP, ICMPv6EchoRequest, ICMPv6EchoReply, get_if_list, get_if_addr, conf as scapy_conf
+    from scapy.error import Scapy_Exception
+    try:
+        # ربط مرشح BPF بمقبس مفتوح (متاح على Linux فقط) لإعادة بناء المرشح دون إعادة فتح المقبس
+        from scapy.arch.linux import attach_filter
+    except ImportError:
+        attach_filter = None
     SCAPY_AVAILABLE = True
     # تأكد من أن كل الطبقات الضرورية تم استيرادها
     if not all([IP, TCP, UDP, ICMP]): SCAPY_AVAILABLE = False
 except ImportError:
     SCAPY_AVAILABLE = False
-    IP, TCP, UDP, ICMP = None, None, None, None # تعريف متغيرات وهمية
+    IP, IPv6, TCP, UDP, ICMP = None, None, None, None, None # تعريف متغيرات وهمية
+    ICMPv6EchoRequest, ICMPv6EchoReply = None, None
+    attach_filter = None
     # رسالة تحذير للمستخدم في حالة عدم توفر Scapy
     print("="*60)
     print("تحذير: مكتبة scapy غير مثبتة أو لا يمكن استيرادها.")
-    print("سيتم تعطيل ميزات مراقبة الشبكة (NIDS).")
+    print("سيتم تعطيل ميزات مراقبة الشبكة (NIDS) ما لم يتم اختيار محرك الالتقاط الخام (ENGINE = raw).")
     print("لتثبيتها على كالي/أوبونتو: sudo apt install python3-scapy")
     print("(على ويندوز، تأكد من تثبيت Npcap أولاً ثم pip install scapy)")
     print("="*60)
-    
+
+# محرك الالتقاط الخام (AF_PACKET) متاح على Linux فقط
+RAW_CAPTURE_AVAILABLE = hasattr(socket, 'AF_PACKET')
+# توزيع الحزم على عمليات عاملة يحتاج fork (ترث العمليات الحلقات المشتركة دون تسلسل)
+PACKET_WORKERS_AVAILABLE = 'fork' in multiprocessing.get_all_start_methods()
+
 class Colors:
     RESET = '\033[0m'       # رمز إعادة الضبط
     BOLD = '\033[1m'         # رمز الخط العريض
@@ -167,10 +210,270 @@ if not config_ok:
 class AppConfig:
     # قائمة بمسارات الملفات الحساسة التي سيتم مراقبتها بواسطة HIDS (تحويلها إلى مسارات مطلقة ومسارات Path)
     SENSITIVE_FILES = [str(Path(f.strip()).resolve()) for f in config.get('HIDS', 'SENSITIVE_FILES', fallback='').split(',') if f.strip()]
+    # ملفات السجلات (من ضمن SENSITIVE_FILES) التي تراقب بوضع الإضافة فقط: تجزئة البايتات المضافة فقط
+    APPEND_ONLY_FILES = [str(Path(f.strip()).resolve()) for f in config.get('HIDS', 'APPEND_ONLY_FILES', fallback='').split(',') if f.strip()]
+
+
+# --- مقاييس الأداء الداخلية (تعرض بصيغة Prometheus على /metrics) ---
+class _ThreadCells:
+    """أساس العداد والمدرج: خلية (قائمة) لكل خيط يكتب فيها دون قفل، وتجمع الخلايا عند القراءة فقط."""
+
+    def __init__(self, size):
+        self._size = size
+        self._local = threading.local()
+        self._cells = []
+        self._lock = threading.Lock() # يستخدم فقط عند أول تسجيل من خيط جديد وعند القراءة
+
+    def _cell(self):
+        try:
+            return self._local.cell
+        except AttributeError: # أول استخدام من هذا الخيط
+            cell = [0] * self._size
+            with self._lock:
+                self._cells.append(cell)
+            self._local.cell = cell
+            return cell
+
+    def _totals(self):
+        with self._lock:
+            cells = list(self._cells)
+        totals = [0] * self._size
+        for cell in cells:
+            for index, value in enumerate(cell):
+                totals[index] += value
+        return totals
+
+    def _reset(self):
+        """يبدأ من الصفر بعد fork (خلايا وقفل العملية الأم لا تخص العملية الجديدة)."""
+        self._local = threading.local()
+        self._cells = []
+        self._lock = threading.Lock()
+
+
+class Counter(_ThreadCells):
+    kind = 'counter'
+
+    def __init__(self):
+        super().__init__(1)
+
+    def inc(self, amount=1):
+        try:
+            self._local.cell[0] += amount
+        except AttributeError:
+            self._cell()[0] += amount
+
+    def value(self):
+        return self._totals()[0]
+
+
+class Histogram(_ThreadCells):
+    """مدرج بحدود ثابتة (بالثواني): خانة لكل حد + خانة +Inf + المجموع."""
+    kind = 'histogram'
+    LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    PACKET_BUCKETS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 1e-3, 1e-2)
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.bounds = tuple(buckets)
+        super().__init__(len(self.bounds) + 2)
+
+    def observe(self, value):
+        try:
+            cell = self._local.cell
+        except AttributeError:
+            cell = self._cell()
+        cell[bisect.bisect_left(self.bounds, value)] += 1
+        cell[-1] += value
+
+    def snapshot(self, totals=None):
+        """يعيد (العدد التراكمي لكل حد بما فيه +Inf، المجموع). totals: مجاميع الخانات إن حسبت مسبقاً."""
+        totals = self._totals() if totals is None else totals
+        cumulative, running = [], 0
+        for count in totals[:-1]:
+            running += count
+            cumulative.append(running)
+        return cumulative, totals[-1]
+
+
+class MetricFamily:
+    """مجموعة مقاييس بنفس الاسم مميزة بقيم التسميات (labels). الأبناء تنشأ عند أول استخدام."""
+
+    def __init__(self, name, help_text, factory, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.factory = factory
+        self.labelnames = tuple(labelnames)
+        self.kind = factory().kind
+        self.children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            with self._lock:
+                child = self.children.setdefault(values, self.factory())
+        return child
+
+
+class MetricsRegistry:
+    """سجل المقاييس: عدادات ومدرجات بخلايا لكل خيط، ومقاييس تقرأ من دالة عند الطلب (مثل عمق الطابور)."""
+
+    def __init__(self):
+        self._families = OrderedDict() # الاسم -> MetricFamily أو (النوع، الوصف، الدالة)
+        self._lock = threading.Lock()
+        # مجاميع عمليات أخرى (العمليات العاملة لمعالجة الحزم): المصدر -> آخر export()، وما تبقى من عمليات انتهت
+        self._remote = {}
+        self._retired = {}
+
+    def _family(self, name, help_text, factory, labelnames):
+        family = MetricFamily(name, help_text, factory, labelnames)
+        with self._lock:
+            self._families[name] = family
+        return family if labelnames else family.labels()
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._family(name, help_text, Counter, labelnames)
+
+    def histogram(self, name, help_text, labelnames=(), buckets=Histogram.LATENCY_BUCKETS):
+        return self._family(name, help_text, lambda: Histogram(buckets), labelnames)
+
+    def register_callback(self, name, help_text, kind, func):
+        """مقياس تحسب قيمته عند الطلب فقط: func() تعيد رقماً (kind: 'gauge' أو 'counter')."""
+        with self._lock:
+            self._families[name] = (kind, help_text, func)
+
+    def reset_after_fork(self):
+        """يصفر كل المقاييس في عملية ناتجة عن fork، فترسل العملية مجاميعها هي فقط (export) دون قيم العملية الأم."""
+        self._lock = threading.Lock()
+        self._remote, self._retired = {}, {}
+        for family in self._families.values():
+            if isinstance(family, MetricFamily):
+                family._lock = threading.Lock()
+                for child in family.children.values():
+                    child._reset()
+
+    def export(self):
+        """يعيد مجاميع الخانات لكل مقياس: {(الاسم، قيم التسميات): قائمة المجاميع} (تنقل بين العمليات)."""
+        with self._lock:
+            families = [f for f in self._families.values() if isinstance(f, MetricFamily)]
+        snapshot = {}
+        for family in families:
+            with family._lock:
+                children = list(family.children.items())
+            for values, child in children:
+                snapshot[(family.name, values)] = child._totals()
+        return snapshot
+
+    def update_remote(self, source, snapshot):
+        """يحفظ آخر مجاميع عملية أخرى (تستبدل السابقة من نفس المصدر) لتضاف عند العرض."""
+        with self._lock:
+            self._remote[source] = snapshot
+
+    def retire_remote(self, source):
+        """عند انتهاء العملية: تضم مجاميعها الأخيرة إلى الثابت، فتبقى العدادات متزايدة بعد إعادة تشغيل العمليات."""
+        with self._lock:
+            snapshot = self._remote.pop(source, None)
+            for key, totals in (snapshot or {}).items():
+                base = self._retired.get(key)
+                self._retired[key] = list(totals) if base is None else [a + b for a, b in zip(base, totals)]
+
+    @staticmethod
+    def _escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    @classmethod
+    def _labels(cls, names, values, extra=()):
+        parts = [f'{n}="{cls._escape(v)}"' for n, v in list(zip(names, values)) + list(extra)]
+        return '{' + ','.join(parts) + '}' if parts else ''
+
+    def render(self):
+        """يعيد كل المقاييس بصيغة Prometheus النصية (الإصدار 0.0.4)."""
+        with self._lock:
+            families = list(self._families.items())
+            sources = list(self._remote.values()) + [self._retired]
+        remote = {} # الاسم -> {قيم التسميات: المجاميع} من العمليات الأخرى
+        for snapshot in sources:
+            for (name, values), totals in snapshot.items():
+                merged = remote.setdefault(name, {})
+                base = merged.get(values)
+                merged[values] = list(totals) if base is None else [a + b for a, b in zip(base, totals)]
+        lines = []
+        for name, family in families:
+            if isinstance(family, tuple):
+                kind, help_text, func = family
+                try:
+                    value = func()
+                except Exception:
+                    continue # المكون غير مهيأ (مثلاً لم يبدأ مراقب الشبكة)
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}", f"{name} {value}"]
+                continue
+            lines += [f"# HELP {name} {family.help_text}", f"# TYPE {name} {family.kind}"]
+            extra = remote.get(name, {})
+            for values in extra:
+                family.labels(*values) # تسميات ظهرت في عملية عاملة فقط
+            with family._lock: # الأبناء قد تضاف من خيوط أخرى أثناء العرض
+                children = sorted(family.children.items())
+            for values, child in children:
+                totals = child._totals()
+                if values in extra:
+                    totals = [a + b for a, b in zip(totals, extra[values])]
+                if family.kind == 'counter':
+                    lines.append(f"{name}{self._labels(family.labelnames, values)} {totals[0]}")
+                    continue
+                cumulative, total = child.snapshot(totals)
+                for bound, count in zip(child.bounds + (float('inf'),), cumulative):
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f"{name}_bucket{self._labels(family.labelnames, values, [('le', le)])} {count}")
+                lines.append(f"{name}_sum{self._labels(family.labelnames, values)} {total}")
+                lines.append(f"{name}_count{self._labels(family.labelnames, values)} {cumulative[-1]}")
+        return '\n'.join(lines) + '\n'
+
+
+metrics = MetricsRegistry()
+# NIDS
+METRIC_NIDS_PACKETS = metrics.counter('ids_nids_packets_total', "الحزم التي وصلت إلى معالج الحزم")
+METRIC_NIDS_PACKET_ERRORS = metrics.counter('ids_nids_packet_errors_total', "الأخطاء أثناء معالجة الحزم")
+METRIC_NIDS_ALERTS = metrics.counter('ids_nids_alerts_total', "تنبيهات الشبكة المطلقة من خيط الالتقاط")
+METRIC_NIDS_PACKET_SECONDS = metrics.histogram('ids_nids_packet_duration_seconds', "زمن معالجة الحزمة الواحدة",
+                                               buckets=Histogram.PACKET_BUCKETS)
+# ProcessMonitor
+METRIC_PROCESS_SCAN_SECONDS = metrics.histogram('ids_process_scan_duration_seconds', "مدة دورة فحص العمليات")
+METRIC_PROCESS_SCANNED = metrics.counter('ids_process_scanned_total', "العمليات التي مرت بها دورات الفحص")
+METRIC_PROCESS_CHECKED = metrics.counter('ids_process_checked_total', "العمليات التي قيمت مقابل المؤشرات")
+# FileMonitor
+METRIC_FILE_HASH_BYTES = metrics.counter('ids_file_hash_bytes_total', "البايتات التي تمت تجزئتها")
+METRIC_FILE_HASH_SECONDS = metrics.histogram('ids_file_hash_duration_seconds', "مدة تجزئة ملف كامل")
+# IDSLogger
+METRIC_ALERTS = metrics.counter('ids_alerts_total', "التنبيهات المضافة إلى طابور الكتابة", ('type',))
+METRIC_ALERT_WRITE_SECONDS = metrics.histogram('ids_alert_write_latency_seconds', "الزمن من log_alert حتى commit في قاعدة البيانات")
+METRIC_DB_BATCH_SECONDS = metrics.histogram('ids_db_batch_duration_seconds', "مدة معاملة كتابة الدفعة الواحدة")
+# واجهة الويب
+METRIC_HTTP_REQUESTS = metrics.counter('ids_http_requests_total', "طلبات واجهة الويب", ('endpoint', 'status'))
+METRIC_HTTP_SECONDS = metrics.histogram('ids_http_request_duration_seconds', "زمن معالجة طلبات الويب (حتى بداية الاستجابة)", ('endpoint',))
 
 
 # --- فئة لإدارة التسجيل (Logs) وقاعدة البيانات (Database) ---
 class IDSLogger:
+    # علامة إيقاف خيط الكتابة (توضع في الطابور عند الإغلاق)
+    _STOP = object()
+    # أنواع العناصر في طابور الكتابة: (النوع، البيانات، وقت الإضافة perf_counter)
+    _KIND_ALERT = 0 # صف تنبيه واحد لجدول alerts
+    _KIND_ROLLUP = 1 # قائمة صفوف تجميع لجدول alert_rollups
+    _KIND_BASELINE = 2 # قائمة صفوف خط أساس لجدول file_baselines (إضافة أو استبدال)
+    _KIND_BASELINE_DELETE = 3 # قائمة مسارات تحذف من جدول file_baselines
+    DROPPED_WARNING_INTERVAL = 5.0 # أقل فاصل (بالثواني) بين تحذيرات التنبيهات المهملة في السجل
+    # فهارس جدول التنبيهات (لاستعلامات لوحة التحكم حسب الوقت والنوع والمصدر والبروتوكول)
+    ALERT_INDEXES = {
+        'idx_alerts_timestamp': 'timestamp',
+        'idx_alerts_type': 'type',
+        'idx_alerts_source': 'source',
+        'idx_alerts_proto': 'proto',
+    }
+    # حجم ذاكرة التخزين المؤقت لصفحات SQLite لكل اتصال (بالكيلوبايت)
+    CACHE_SIZE_KB = 16384
+    # دقة عدادات الإحصائيات في جدول alert_stats (بالثواني): دقيقة، ساعة، يوم
+    # الفترات محاذاة على epoch بتوقيت UTC (بداية الفترة = epoch - epoch % الدقة)، ففترة اليوم تبدأ 00:00 UTC
+    STATS_RESOLUTIONS = {'minute': 60, 'hour': 3600, 'day': 86400}
+
     def __init__(self):
         # قراءة مسارات قاعدة البيانات وملف السجل من الإعدادات
         self.db_path_str = config.get('DATABASE', 'PATH')
@@ -196,17 +499,63 @@ class IDSLogger:
              sys.exit(1)
 
 
+        # اتصالات القراءة فقط لكل خيط (لوحة التحكم) حتى لا تتنافس مع اتصال الكتابة
+        self._read_local = threading.local()
+        self._read_conns = []
+        self._read_conns_lock = threading.Lock()
+
+        # مدة الاحتفاظ بعدادات الدقيقة والساعة (عدادات اليوم تحفظ دائماً)
+        try:
+            self.stats_retention = {
+                60: config.getfloat('DATABASE', 'STATS_MINUTE_RETENTION_HOURS', fallback=48) * 3600,
+                3600: config.getfloat('DATABASE', 'STATS_HOUR_RETENTION_DAYS', fallback=90) * 86400,
+            }
+        except ValueError:
+            print("خطأ: قيم STATS_*_RETENTION في [DATABASE] يجب أن تكون أرقاماً. استخدام القيم الافتراضية.")
+            self.stats_retention = {60: 48 * 3600, 3600: 90 * 86400}
+        self._bucket_cache = {} # بادئة الدقيقة في الطابع الزمني -> بداية الدقيقة (epoch)
+        self._stats_pruned_at = 0.0
+
         # تهيئة قاعدة البيانات
         self._init_db()
         # إعداد نظام التسجيل النصي
         self._setup_logging()
 
+        # إعدادات طابور التنبيهات وخيط الكتابة المجمعة (log_alert لا تنتظر قاعدة البيانات)
+        try:
+            self.queue_size = config.getint('DATABASE', 'QUEUE_SIZE', fallback=10000)
+            self.batch_size = config.getint('DATABASE', 'BATCH_SIZE', fallback=500)
+            self.flush_interval = config.getfloat('DATABASE', 'FLUSH_INTERVAL', fallback=0.5)
+        except ValueError:
+            self.logger.error("IDSLogger: قيم QUEUE_SIZE/BATCH_SIZE/FLUSH_INTERVAL في [DATABASE] يجب أن تكون أرقاماً موجبة. استخدام القيم الافتراضية.")
+            self.queue_size, self.batch_size, self.flush_interval = 10000, 500, 0.5
+        if self.queue_size <= 0: self.queue_size = 10000
+        if self.batch_size <= 0: self.batch_size = 500
+        if self.flush_interval <= 0: self.flush_interval = 0.5
+
+        self.alert_queue = queue.Queue(maxsize=self.queue_size) # طابور محدود للتنبيهات بانتظار الكتابة
+        self._stats_lock = threading.Lock() # قفل لحماية عدادات الإحصائيات
+        self.dropped_alerts = 0 # عدد التنبيهات المهملة بسبب امتلاء الطابور
+        self.written_alerts = 0 # عدد التنبيهات المكتوبة في قاعدة البيانات
+        self.written_batches = 0 # عدد المعاملات (transactions) المنفذة
+        self._reported_dropped = 0 # آخر عدد مهمل تم الإبلاغ عنه في السجل
+        # True: log_alert ينتظر عند امتلاء الطابور بدلاً من الإهمال (إعادة تشغيل pcap حيث يجب ألا يضيع أي تنبيه)
+        self.block_when_full = False
+        self._dropped_reported_at = 0.0 # وقت آخر تحذير عن التنبيهات المهملة (monotonic)
+        self._closed = False
+        self.broadcaster = None # AlertBroadcaster: يستقبل التنبيهات بعد كتابتها (مع معرفاتها) لبثها مباشرة
+        # خيط الكتابة الوحيد لقاعدة البيانات
+        self._writer_thread = threading.Thread(target=self._writer_loop, name="AlertWriterThread", daemon=True)
+        self._writer_thread.start()
+
     # تهيئة جدول قاعدة البيانات
     def _init_db(self):
         try:
             # الاتصال بقاعدة البيانات (سيتم إنشاؤها إذا لم تكن موجودة)
             # check_same_thread=False للسماح بالوصول من خيوط متعددة (خاصة خادم الويب)
             self.conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+            # وضع WAL: القراءة من لوحة التحكم لا تحجب الكتابة والعكس
+            self.apply_pragmas(self.conn)
             cursor = self.conn.cursor()
 
             # إنشاء جدول التنبيهات إذا لم يكن موجوداً
@@ -230,6 +579,57 @@ class IDSLogger:
                 # استخدام print هنا لأنه قد يتم استدعاء init قبل إعداد logging بالكامل
                 print("تم إضافة عمود 'proto' إلى جدول التنبيهات.")
 
+            # إنشاء الفهارس إذا لم تكن موجودة (بعد التأكد من وجود عمود proto)
+            self.create_indexes(cursor)
+
+            # جدول التجميع: سجل واحد لكل مفتاح تنبيه في كل نافذة زمنية مع عدد مرات حدوثه
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS alert_rollups (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    window_start DATETIME NOT NULL,
+                    window_end DATETIME NOT NULL,
+                    type TEXT NOT NULL,
+                    source TEXT,
+                    proto TEXT,
+                    alert_key TEXT NOT NULL, -- مفتاح التنبيه (مثل TCP|src|sport|dst|dport)
+                    message TEXT, -- رسالة أول تنبيه في النافذة إن وجدت
+                    first_seen DATETIME NOT NULL,
+                    last_seen DATETIME NOT NULL,
+                    count INTEGER NOT NULL -- عدد مرات الحدوث بما فيها المكررة المحذوفة
+                )
+            ''')
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_alert_rollups_window ON alert_rollups(window_start)")
+
+            # خط الأساس لسلامة الملفات الحساسة: يسمح بتخطي إعادة التجزئة عند البدء واكتشاف التعديل أثناء توقف النظام
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS file_baselines (
+                    path TEXT PRIMARY KEY,
+                    inode INTEGER NOT NULL,
+                    size INTEGER NOT NULL, -- لملفات وضع الإضافة فقط: عدد البايتات التي تمت تجزئتها
+                    mtime_ns INTEGER NOT NULL,
+                    ctime_ns INTEGER NOT NULL,
+                    mode INTEGER NOT NULL,
+                    sha256 TEXT NOT NULL,
+                    updated_at DATETIME NOT NULL
+                )
+            ''')
+
+            # عدادات التنبيهات لكل (دقة، بداية فترة، نوع، مصدر، بروتوكول) تحدث مع كل دفعة إدراج،
+            # فتجيب /api/stats من عدد الفترات وليس من عدد التنبيهات
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS alert_stats (
+                    resolution INTEGER NOT NULL, -- 60 أو 3600 أو 86400
+                    bucket INTEGER NOT NULL, -- بداية الفترة (epoch، محاذاة على UTC)
+                    type TEXT NOT NULL,
+                    source TEXT NOT NULL DEFAULT '',
+                    proto TEXT NOT NULL DEFAULT '',
+                    count INTEGER NOT NULL,
+                    PRIMARY KEY (resolution, bucket, type, source, proto)
+                ) WITHOUT ROWID
+            ''')
+            if cursor.execute("SELECT 1 FROM alert_stats LIMIT 1").fetchone() is None and \
+                    cursor.execute("SELECT 1 FROM alerts LIMIT 1").fetchone() is not None:
+                self._backfill_stats(cursor)
 
             self.conn.commit()
         except sqlite3.Error as e:
@@ -240,6 +640,81 @@ class IDSLogger:
             sys.exit(1)
 
 
+    # بناء عدادات الإحصائيات من التنبيهات الموجودة (مرة واحدة لقاعدة بيانات أنشئت قبل جدول alert_stats)
+    def _backfill_stats(self, cursor):
+        print("بناء جدول إحصائيات التنبيهات (alert_stats) من التنبيهات الموجودة...")
+        now = time.time()
+        for resolution in self.STATS_RESOLUTIONS.values():
+            retention = self.stats_retention.get(resolution)
+            # 'utc' يحول الوقت المحلي المخزن إلى UTC قبل حساب epoch، ثم المحاذاة على الدقة
+            cursor.execute(f'''
+                INSERT INTO alert_stats (resolution, bucket, type, source, proto, count)
+                SELECT ?, CAST(strftime('%s', substr(timestamp, 1, 16) || ':00', 'utc') AS INTEGER) / ? * ? AS b,
+                       type, COALESCE(source, ''), COALESCE(proto, ''), COUNT(*)
+                FROM alerts {'WHERE timestamp >= ?' if retention else ''}
+                GROUP BY b, type, COALESCE(source, ''), COALESCE(proto, '')
+            ''', (resolution, resolution, resolution) + ((datetime.fromtimestamp(now - retention).strftime('%Y-%m-%d %H:%M:%S'),) if retention else ()))
+
+    # بداية الدقيقة (epoch) للطابع الزمني المحلي، مع ذاكرة مؤقتة (تنبيهات الدفعة تتشارك نفس الدقائق)
+    def _stats_minute(self, timestamp):
+        prefix = timestamp[:16]
+        minute = self._bucket_cache.get(prefix)
+        if minute is None:
+            minute = int(datetime.strptime(prefix, '%Y-%m-%d %H:%M').timestamp())
+            if len(self._bucket_cache) > 10000:
+                self._bucket_cache.clear()
+            self._bucket_cache[prefix] = minute
+        return minute
+
+    # عدادات الدفعة لجدول alert_stats
+    def _stats_rows(self, alert_rows):
+        counts = {}
+        for alert_type, source, _message, timestamp, proto in alert_rows:
+            minute = self._stats_minute(timestamp)
+            for resolution in self.STATS_RESOLUTIONS.values():
+                key = (resolution, minute - minute % resolution, alert_type, source or '', proto or '')
+                counts[key] = counts.get(key, 0) + 1
+        return [key + (count,) for key, count in counts.items()]
+
+    # إعدادات أداء اتصال الكتابة
+    @classmethod
+    def apply_pragmas(cls, conn):
+        """يفعل وضع WAL ويضبط synchronous وذاكرة التخزين المؤقت لاتصال الكتابة."""
+        conn.execute("PRAGMA journal_mode=WAL")
+        # NORMAL آمن مع WAL (لا يفسد قاعدة البيانات) ويتجنب fsync لكل commit
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size=-{cls.CACHE_SIZE_KB}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA busy_timeout=5000")
+
+    # إنشاء فهارس جدول التنبيهات
+    @classmethod
+    def create_indexes(cls, cursor):
+        for index_name, column in cls.ALERT_INDEXES.items():
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON alerts({column})")
+
+    # فتح اتصال قراءة فقط
+    @classmethod
+    def open_read_connection(cls, db_path):
+        """يفتح اتصال SQLite للقراءة فقط (لا يمكنه الكتابة ولا يحجب خيط الكتابة في وضع WAL)."""
+        # check_same_thread=False فقط للسماح بإغلاقه عند الإيقاف، كل اتصال يستخدمه خيط واحد
+        conn = sqlite3.connect(f"{Path(db_path).resolve().as_uri()}?mode=ro", uri=True, check_same_thread=False)
+        conn.row_factory = sqlite3.Row # لتمكين الوصول إلى الصفوف كقاموس
+        conn.execute(f"PRAGMA cache_size=-{cls.CACHE_SIZE_KB}")
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+
+    # الحصول على اتصال القراءة الخاص بالخيط الحالي (مثل خيوط Waitress)
+    def get_read_connection(self):
+        """يعيد اتصال قراءة خاصاً بالخيط الحالي، وينشئه عند أول استخدام."""
+        conn = getattr(self._read_local, 'conn', None)
+        if conn is None:
+            conn = self.open_read_connection(self.db_path)
+            self._read_local.conn = conn
+            with self._read_conns_lock:
+                self._read_conns.append(conn)
+        return conn
+
     # إعداد نظام التسجيل النصي الدوار
     def _setup_logging(self):
         try:
@@ -264,31 +739,986 @@ class IDSLogger:
 
     # دالة لتسجيل التنبيهات في قاعدة البيانات وملف السجل
     def log_alert(self, alert_type, message, source="System", proto=None):
-        """يسجل تنبيهاً في قاعدة البيانات وملف السجل."""
+        """يضيف تنبيهاً إلى طابور الكتابة دون انتظار. يتم تسجيله في ملف السجل وقاعدة البيانات بواسطة خيط الكتابة."""
         timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        # بناء رسالة السجل النصي
-        log_message = f"[{alert_type}] {message} (Source: {source})"
-        if proto:
-             log_message += f" (Proto: {proto})" # إضافة البروتوكول إذا كان موجوداً
-
-        # تسجيل الرسالة في ملف السجل بناءً على نوع التنبيه
-        if "ALERT" in alert_type.upper() or "WARNING" in alert_type.upper():
-            self.logger.warning(log_message)
-        else:
-            self.logger.info(log_message)
+        if self._closed:
+            with self._stats_lock:
+                self.dropped_alerts += 1
+            return
+        try:
+            item = (self._KIND_ALERT, (alert_type, source, message, timestamp, proto), time.perf_counter())
+            if self.block_when_full:
+                self.alert_queue.put(item)
+            else:
+                self.alert_queue.put_nowait(item)
+            METRIC_ALERTS.labels(alert_type).inc()
+        except queue.Full:
+            # لا نوقف الخيط المستدعي (مثل خيط التقاط الحزم)، نهمل التنبيه ونحسبه
+            with self._stats_lock:
+                self.dropped_alerts += 1
+
+    # تسجيل صفوف التجميع (من AlertAggregator) عبر نفس خيط الكتابة
+    def log_rollups(self, rows, timeout=5.0):
+        """يضيف صفوف التجميع إلى طابور الكتابة. ينتظر حتى timeout إذا كان الطابور ممتلئاً لأن العدادات لا يجب أن تضيع."""
+        if not rows or self._closed:
+            return False
+        try:
+            self.alert_queue.put((self._KIND_ROLLUP, rows, time.perf_counter()), timeout=timeout)
+            return True
+        except queue.Full:
+            self.logger.warning(f"IDSLogger: تعذر إضافة {len(rows)} صف(وف) تجميع إلى طابور الكتابة (ممتلئ).")
+            return False
+
+    # تسجيل خطوط أساس الملفات (من FileMonitor) عبر نفس خيط الكتابة
+    def log_baselines(self, rows=(), deleted_paths=(), timeout=5.0):
+        """يضيف صفوف file_baselines المحدثة و/أو المسارات المحذوفة إلى طابور الكتابة."""
+        if self._closed:
+            return False
+        try:
+            if rows:
+                self.alert_queue.put((self._KIND_BASELINE, list(rows), time.perf_counter()), timeout=timeout)
+            if deleted_paths:
+                self.alert_queue.put((self._KIND_BASELINE_DELETE, list(deleted_paths), time.perf_counter()), timeout=timeout)
+            return True
+        except queue.Full:
+            self.logger.warning("IDSLogger: تعذر إضافة خط أساس ملف إلى طابور الكتابة (ممتلئ).")
+            return False
+
+    # قراءة خطوط أساس الملفات المحفوظة
+    def load_baselines(self):
+        """يعيد قاموس المسار -> (inode, size, mtime_ns, ctime_ns, mode, sha256) من جدول file_baselines."""
+        try:
+            cursor = self.get_read_connection().execute(
+                "SELECT path, inode, size, mtime_ns, ctime_ns, mode, sha256 FROM file_baselines")
+            return {row[0]: tuple(row[1:]) for row in cursor}
+        except sqlite3.Error as e:
+            self.logger.error(f"IDSLogger: فشل قراءة خطوط أساس الملفات: {e}")
+            return {}
+
+    # حلقة خيط الكتابة: تجميع التنبيهات في دفعات محدودة بالحجم والوقت
+    def _writer_loop(self):
+        """يسحب التنبيهات من الطابور ويكتبها في دفعات (معاملة واحدة لكل دفعة)."""
+        stop = False
+        while not stop:
+            try:
+                # انتظار أول تنبيه في الدفعة، مع الاستيقاظ دورياً للإبلاغ عن المهمل حتى بدون تنبيهات جديدة
+                item = self.alert_queue.get(timeout=self.DROPPED_WARNING_INTERVAL)
+            except queue.Empty:
+                self._report_dropped()
+                continue
+            if item is self._STOP:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            # جمع المزيد حتى امتلاء الدفعة أو انتهاء مهلة التجميع
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self.alert_queue.get(timeout=remaining) if remaining > 0 else self.alert_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is self._STOP:
+                    stop = True
+                    break
+                batch.append(item)
+            self._write_batch(batch)
+        self._report_dropped(force=True)
+        self.logger.info("IDSLogger: توقف خيط كتابة التنبيهات.")
+
+    # كتابة دفعة من التنبيهات في ملف السجل وقاعدة البيانات
+    def _write_batch(self, batch):
+        """يسجل الدفعة في ملف السجل ثم يدرجها في قاعدة البيانات بمعاملة واحدة."""
+        alert_rows = []
+        rollup_rows = []
+        baseline_rows = {} # المسار -> آخر صف (يكفي آخر تحديث لكل ملف في الدفعة)
+        queued_at = [] # وقت إضافة كل تنبيه إلى الطابور (لقياس زمن الكتابة)
+        for kind, payload, enqueued in batch:
+            if kind == self._KIND_ALERT:
+                alert_rows.append(payload)
+                queued_at.append(enqueued)
+            elif kind == self._KIND_ROLLUP:
+                rollup_rows.extend(payload)
+            elif kind == self._KIND_BASELINE:
+                for row in payload:
+                    baseline_rows[row[0]] = row
+            else:
+                for path in payload:
+                    baseline_rows[path] = None # None = حذف
+
+        for alert_type, source, message, timestamp, proto in alert_rows:
+            # بناء رسالة السجل النصي
+            log_message = f"[{alert_type}] {message} (Source: {source})"
+            if proto:
+                 log_message += f" (Proto: {proto})" # إضافة البروتوكول إذا كان موجوداً
+            # تسجيل الرسالة في ملف السجل بناءً على نوع التنبيه
+            if "ALERT" in alert_type.upper() or "WARNING" in alert_type.upper():
+                self.logger.warning(log_message)
+            else:
+                self.logger.info(log_message)
 
-        # حفظ التنبيه في قاعدة البيانات
+        # حفظ الدفعة في قاعدة البيانات
         try:
-            # استخدام 'with self.conn:' يضمن commit() أو rollback() تلقائياً
+            # استخدام 'with self.conn:' يضمن commit() أو rollback() تلقائياً (commit واحد للدفعة كاملة)
+            last_id = None
+            batch_start = time.perf_counter()
             with self.conn:
-                 self.conn.execute(
-                     "INSERT INTO alerts (type, source, message, timestamp, proto) VALUES (?, ?, ?, ?, ?)",
-                     (alert_type, source, message, timestamp, proto)
-                 )
+                 if alert_rows:
+                     self.conn.executemany(
+                         "INSERT INTO alerts (type, source, message, timestamp, proto) VALUES (?, ?, ?, ?, ?)",
+                         alert_rows
+                     )
+                     # خيط الكتابة هو الكاتب الوحيد، فمعرفات الدفعة متتالية وتنتهي بآخر معرف مدرج
+                     last_id = self.conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+                     # تحديث العدادات في نفس المعاملة (صف لكل مفتاح في الدفعة وليس لكل تنبيه)
+                     self.conn.executemany(
+                         "INSERT INTO alert_stats (resolution, bucket, type, source, proto, count) VALUES (?, ?, ?, ?, ?, ?) "
+                         "ON CONFLICT (resolution, bucket, type, source, proto) DO UPDATE SET count = count + excluded.count",
+                         self._stats_rows(alert_rows)
+                     )
+                     self._prune_stats()
+                 if rollup_rows:
+                     self.conn.executemany(
+                         "INSERT INTO alert_rollups (window_start, window_end, type, source, proto, alert_key, message, first_seen, last_seen, count) "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                         rollup_rows
+                     )
+                 if baseline_rows:
+                     self.conn.executemany(
+                         "INSERT OR REPLACE INTO file_baselines (path, inode, size, mtime_ns, ctime_ns, mode, sha256, updated_at) "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                         [row for row in baseline_rows.values() if row is not None]
+                     )
+                     self.conn.executemany(
+                         "DELETE FROM file_baselines WHERE path = ?",
+                         [(path,) for path, row in baseline_rows.items() if row is None]
+                     )
+            committed = time.perf_counter()
+            METRIC_DB_BATCH_SECONDS.observe(committed - batch_start)
+            for enqueued in queued_at:
+                METRIC_ALERT_WRITE_SECONDS.observe(committed - enqueued)
+            with self._stats_lock:
+                self.written_alerts += len(alert_rows)
+                self.written_batches += 1
+            if self.broadcaster is not None and last_id is not None:
+                first_id = last_id - len(alert_rows) + 1
+                self.broadcaster.publish([
+                    {'id': first_id + i, 'type': alert_type, 'source': source, 'message': message,
+                     'timestamp': timestamp, 'proto': proto}
+                    for i, (alert_type, source, message, timestamp, proto) in enumerate(alert_rows)
+                ])
         except sqlite3.Error as e:
-             self.logger.error(f"خطأ في قاعدة البيانات عند تسجيل التنبيه: {e}")
+             self.logger.error(f"خطأ في قاعدة البيانات عند تسجيل {len(alert_rows)} تنبيه(ات) و {len(rollup_rows)} صف(وف) تجميع: {e}")
+        except Exception as e:
+             self.logger.error(f"خطأ غير متوقع عند تسجيل التنبيهات في قاعدة البيانات: {e}")
+
+        self._report_dropped()
+
+    # الإبلاغ عن التنبيهات المهملة منذ آخر تحذير (من خيط الكتابة فقط، مرة كل DROPPED_WARNING_INTERVAL على الأكثر)
+    def _report_dropped(self, force=False):
+        dropped = self.dropped_alerts
+        if dropped == self._reported_dropped:
+            return
+        now = time.monotonic()
+        if not force and now - self._dropped_reported_at < self.DROPPED_WARNING_INTERVAL:
+            return
+        self.logger.warning(f"IDSLogger: تم إهمال {dropped - self._reported_dropped} تنبيه(ات) بسبب امتلاء الطابور (المجموع: {dropped}).")
+        self._reported_dropped = dropped
+        self._dropped_reported_at = now
+
+    # حذف عدادات الدقيقة والساعة الأقدم من مدة الاحتفاظ (مرة كل دقيقة على الأكثر، داخل معاملة الدفعة)
+    def _prune_stats(self):
+        now = time.time()
+        if now - self._stats_pruned_at < 60:
+            return
+        self._stats_pruned_at = now
+        for resolution, retention in self.stats_retention.items():
+            if retention > 0:
+                self.conn.execute("DELETE FROM alert_stats WHERE resolution = ? AND bucket < ?", (resolution, int(now - retention)))
+
+    # إحصائيات طابور الكتابة
+    def get_queue_stats(self):
+        """يعيد قاموساً بعمق الطابور وسعته وحجم الدفعة وعدادات المكتوب والمهمل."""
+        with self._stats_lock:
+            return {
+                'queue_depth': self.alert_queue.qsize(),
+                'queue_capacity': self.queue_size,
+                'batch_size': self.batch_size,
+                'flush_interval': self.flush_interval,
+                'written': self.written_alerts,
+                'batches': self.written_batches,
+                'dropped': self.dropped_alerts,
+            }
+
+    # إغلاق المسجل: تفريغ الطابور ثم إغلاق قاعدة البيانات
+    def close(self, timeout=10.0):
+        """يكتب كل التنبيهات المتبقية في الطابور ثم يغلق اتصال قاعدة البيانات."""
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            # put بحجب (مع مهلة) لضمان وصول علامة الإيقاف حتى لو كان الطابور ممتلئاً
+            self.alert_queue.put(self._STOP, timeout=timeout)
+            self._writer_thread.join(timeout=timeout)
+        except queue.Full:
+            self.logger.warning("IDSLogger: تعذر إيقاف خيط الكتابة ضمن المهلة (الطابور ممتلئ).")
+        if self._writer_thread.is_alive():
+            self.logger.warning("IDSLogger: خيط كتابة التنبيهات لم يتوقف ضمن المهلة المحددة.")
+        stats = self.get_queue_stats()
+        self.logger.info(f"IDSLogger: إحصائيات الكتابة: مكتوب {stats['written']} في {stats['batches']} دفعة، مهمل {stats['dropped']}، متبقي {stats['queue_depth']}.")
+        with self._read_conns_lock:
+            read_conns, self._read_conns = self._read_conns, []
+        for read_conn in read_conns:
+            try:
+                read_conn.close()
+            except sqlite3.Error:
+                pass # قد يكون الاتصال مستخدماً من خيط آخر أثناء الإيقاف
+        try:
+            self.conn.close()
+            self.logger.info("تم إغلاق اتصال قاعدة البيانات.")
         except Exception as e:
-             self.logger.error(f"خطأ غير متوقع عند تسجيل التنبيه في قاعدة البيانات: {e}")
+            self.logger.error(f"خطأ بإغلاق قاعدة البيانات: {e}")
+
+
+# --- بث التنبيهات مباشرة لمتصفحات لوحة التحكم (Server-Sent Events) ---
+class _AlertSubscriber:
+    __slots__ = ('pending', 'overflowed')
+
+    def __init__(self):
+        self.pending = [] # (المعرف، إطار SSE جاهز) بانتظار الإرسال
+        self.overflowed = False
+
+
+class AlertBroadcaster:
+    """يوزع التنبيهات المكتوبة على كل اتصالات /api/alerts/stream دون أي استعلام لقاعدة البيانات.
+
+    كل تنبيه يحول إلى إطار SSE مرة واحدة مهما كان عدد المشاهدين. لكل مشترك مخزن محدود بـ buffer_size:
+    المشترك البطيء الذي يمتلئ مخزنه يفصل (بدلاً من حجب خيط الكتابة أو نمو الذاكرة)، ويستأنف المتصفح
+    تلقائياً بـ Last-Event-ID من قاعدة البيانات.
+    """
+
+    def __init__(self, config_obj):
+        try:
+            self.buffer_size = config_obj.getint('WEB', 'STREAM_BUFFER', fallback=1000)
+            self.max_clients = config_obj.getint('WEB', 'STREAM_MAX_CLIENTS', fallback=8)
+            self.heartbeat = config_obj.getfloat('WEB', 'STREAM_HEARTBEAT', fallback=15)
+            self.backfill_max = config_obj.getint('WEB', 'STREAM_BACKFILL_MAX', fallback=5000)
+            if min(self.buffer_size, self.max_clients, self.heartbeat) <= 0 or self.backfill_max < 0:
+                raise ValueError
+        except ValueError:
+            logging.getLogger('IDS').error("AlertBroadcaster: قيم STREAM_* في [WEB] غير صالحة. استخدام القيم الافتراضية.")
+            self.buffer_size, self.max_clients, self.heartbeat, self.backfill_max = 1000, 8, 15, 5000
+        self._cond = threading.Condition()
+        self._subscribers = set()
+        self._closed = False
+        self.published = 0
+        self.dropped_clients = 0
+
+    @staticmethod
+    def format_event(alert):
+        return f"id: {alert['id']}\nevent: alert\ndata: {json.dumps(alert, ensure_ascii=False)}\n\n"
+
+    @property
+    def client_count(self):
+        with self._cond:
+            return len(self._subscribers)
+
+    def subscribe(self):
+        subscriber = _AlertSubscriber()
+        with self._cond:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def try_subscribe(self):
+        """يشترك فقط إذا لم يبلغ عدد المشتركين max_clients (الفحص والإضافة تحت القفل نفسه). None عند الامتلاء."""
+        with self._cond:
+            if self._closed or len(self._subscribers) >= self.max_clients:
+                return None
+            subscriber = _AlertSubscriber()
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._cond:
+            self._subscribers.discard(subscriber)
+
+    def publish(self, alerts):
+        """يستدعى من خيط الكتابة بعد commit. لا ينتظر أي مشترك."""
+        with self._cond:
+            self.published += len(alerts)
+            if not self._subscribers:
+                return
+            frames = [(alert['id'], self.format_event(alert)) for alert in alerts]
+            for subscriber in list(self._subscribers):
+                if len(subscriber.pending) + len(frames) > self.buffer_size:
+                    subscriber.overflowed = True
+                    subscriber.pending = []
+                    self._subscribers.discard(subscriber)
+                    self.dropped_clients += 1
+                else:
+                    subscriber.pending.extend(frames)
+            self._cond.notify_all()
+
+    def wait(self, subscriber, timeout):
+        """ينتظر حتى timeout ويعيد الإطارات المعلقة. None إذا فصل المشترك (بطيء) أو أغلق البث."""
+        with self._cond:
+            if not subscriber.pending and not subscriber.overflowed and not self._closed:
+                self._cond.wait(timeout)
+            if subscriber.overflowed or self._closed:
+                return None
+            frames, subscriber.pending = subscriber.pending, []
+            return frames
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._subscribers.clear()
+            self._cond.notify_all()
+
+
+# --- مرحلة تجميع التنبيهات المكررة بين المراقبين و IDSLogger ---
+class AlertAggregator:
+    """يدمج التنبيهات ذات المفتاح نفسه (بما فيها المكررة التي لا تسجل كتنبيه مستقل) في سجل واحد لكل نافذة زمنية
+    يحوي first_seen و last_seen و count، ويكتبه في جدول alert_rollups مع ملخص واحد لكل نافذة."""
+    def __init__(self, logger_instance, window=60, max_keys=50000):
+        self.logger = logger_instance # كائن IDSLogger
+        self.window = window # طول النافذة الزمنية (بالثواني)
+        self.max_keys = max_keys # الحد الأقصى للمفاتيح المميزة في نافذة واحدة
+        self._records = {} # مفتاح التنبيه -> [type, source, proto, message, first_seen, last_seen, count]
+        self._lock = threading.Lock()
+        self._window_start = time.time()
+        self.overflow = 0 # عدد مرات الحدوث التي لم تجمع بمفتاح مستقل بسبب تجاوز max_keys
+        self._stop_event = threading.Event() # Event لإيقاف خيط الكتابة الدورية
+        self.flush_thread = None
+
+    # تسجيل حدوث تنبيه (يستدعى من خيوط المراقبة)
+    def record(self, key, alert_type, source, proto=None, message=None, now=None):
+        """يزيد عداد المفتاح في النافذة الحالية. message اختيارية (تمرر عادة مع أول تنبيه فعلي فقط)."""
+        if now is None:
+            now = time.time()
+        with self._lock:
+            rec = self._records.get(key)
+            if rec is None:
+                if len(self._records) >= self.max_keys:
+                    self.overflow += 1
+                    return
+                self._records[key] = [alert_type, source, proto, message, now, now, 1]
+            else:
+                rec[5] = now
+                rec[6] += 1
+                if rec[3] is None:
+                    rec[3] = message
+
+    # كتابة النافذة الحالية وبدء نافذة جديدة
+    def flush(self):
+        """يكتب سجلات النافذة الحالية في جدول alert_rollups ويسجل ملخصاً واحداً إذا كانت هناك تكرارات محذوفة."""
+        now = time.time()
+        with self._lock:
+            records, self._records = self._records, {}
+            overflow, self.overflow = self.overflow, 0
+            window_start, self._window_start = self._window_start, now
+        if not records and not overflow:
+            return
+
+        fmt = lambda ts: datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+        start_str, end_str = fmt(window_start), fmt(now)
+        rows = []
+        total = overflow
+        for key, (alert_type, source, proto, message, first_seen, last_seen, count) in records.items():
+            key_str = "|".join(str(part) for part in key) if isinstance(key, tuple) else str(key)
+            rows.append((start_str, end_str, alert_type, source, proto, key_str, message, fmt(first_seen), fmt(last_seen), count))
+            total += count
+        self.logger.log_rollups(rows)
+
+        # ملخص واحد للنافذة إذا تم حذف تكرارات (وإلا فكل المفاتيح سجلت كتنبيهات مستقلة بالفعل)
+        suppressed = total - len(records)
+        if suppressed > 0:
+            top = sorted(rows, key=lambda row: row[9], reverse=True)[:3]
+            top_str = "، ".join(f"{row[5]} ({row[9]})" for row in top)
+            message = (f"ملخص آخر {int(now - window_start)} ثانية: {total} تنبيه في {len(records)} مفتاح، "
+                       f"منها {suppressed} مكرر محذوف. الأكثر تكراراً: {top_str}")
+            if overflow:
+                message += f". {overflow} تنبيه تجاوز حد المفاتيح ({self.max_keys})"
+            self.logger.log_alert("ALERT_SUMMARY", message, "AlertAggregator")
+
+    # حلقة الكتابة الدورية
+    def _flush_loop(self):
+        # wait تعيد True فوراً عند طلب الإيقاف، وإلا تنتظر طول النافذة
+        while not self._stop_event.wait(self.window):
+            try:
+                self.flush()
+            except Exception as e:
+                self.logger.logger.error(f"AlertAggregator: خطأ بكتابة التجميع: {e}", exc_info=True)
+
+    def start(self):
+        """يبدأ خيط الكتابة الدورية للتجميع."""
+        if self.flush_thread is None or not self.flush_thread.is_alive():
+            self._stop_event.clear()
+            self._window_start = time.time()
+            self.flush_thread = threading.Thread(target=self._flush_loop, name="AlertAggregatorThread", daemon=True)
+            self.flush_thread.start()
+            self.logger.logger.info(f"AlertAggregator: بدء تجميع التنبيهات كل {self.window} ثانية.")
+
+    def stop(self):
+        """يوقف الخيط ويكتب النافذة الأخيرة."""
+        if self.flush_thread and self.flush_thread.is_alive():
+            self._stop_event.set()
+            self.flush_thread.join(timeout=5.0)
+        self.flush_thread = None
+        self.flush() # كتابة ما تبقى في النافذة الحالية قبل إغلاق المسجل
+
+
+# --- قياس أداء القراءة/الكتابة المتزامنة لقاعدة بيانات التنبيهات ---
+def _bench_db_scenario(db_path, tuned, duration, readers, batch_size, preload):
+    """يشغل خيط كتابة وعدة خيوط قراءة على قاعدة بيانات مؤقتة ويعيد (تنبيهات مكتوبة/ث، استعلامات/ث)."""
+    writer_conn = sqlite3.connect(str(db_path), check_same_thread=False)
+    if tuned:
+        IDSLogger.apply_pragmas(writer_conn)
+    else:
+        # السلوك السابق: journal افتراضي واتصال واحد مشترك بين كل الخيوط
+        writer_conn.execute("PRAGMA journal_mode=DELETE")
+    writer_conn.execute("""CREATE TABLE alerts (id INTEGER PRIMARY KEY AUTOINCREMENT, type TEXT NOT NULL, source TEXT,
+                           message TEXT NOT NULL, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP, proto TEXT)""")
+    if tuned:
+        IDSLogger.create_indexes(writer_conn.cursor())
+
+    alert_types = ['NIDS_ALERT', 'HIDS_ALERT', 'SYSTEM_INFO', 'SYSTEM_WARNING']
+    def make_rows(start, count):
+        return [(alert_types[i % 4], 'NetworkMonitor', f"تنبيه قياس {i}",
+                 datetime.fromtimestamp(1700000000 + i).strftime('%Y-%m-%d %H:%M:%S'), 'TCP')
+                for i in range(start, start + count)]
+    with writer_conn:
+        writer_conn.executemany("INSERT INTO alerts (type, source, message, timestamp, proto) VALUES (?, ?, ?, ?, ?)", make_rows(0, preload))
+
+    stop = threading.Event()
+    counts = {'writes': 0, 'reads': 0}
+    counts_lock = threading.Lock()
+
+    def writer():
+        next_id = preload
+        while not stop.is_set():
+            with writer_conn:
+                writer_conn.executemany("INSERT INTO alerts (type, source, message, timestamp, proto) VALUES (?, ?, ?, ?, ?)",
+                                        make_rows(next_id, batch_size))
+            next_id += batch_size
+            with counts_lock:
+                counts['writes'] += batch_size
+
+    def reader(index):
+        conn = IDSLogger.open_read_connection(db_path) if tuned else writer_conn
+        queries = [
+            ("SELECT id, type, source, message, timestamp, proto FROM alerts ORDER BY id DESC LIMIT 50", ()),
+            ("SELECT id, type, source, message, timestamp, proto FROM alerts WHERE type = ? ORDER BY id DESC LIMIT 50", ('HIDS_ALERT',)),
+            ("SELECT COUNT(*) FROM alerts WHERE timestamp >= ?", ('2023-11-14 22:00:00',)),
+        ]
+        done = 0
+        while not stop.is_set():
+            sql, params = queries[done % len(queries)]
+            conn.execute(sql, params).fetchall()
+            done += 1
+        with counts_lock:
+            counts['reads'] += done
+        if tuned:
+            conn.close()
+
+    threads = [threading.Thread(target=writer, name="BenchWriter")]
+    threads += [threading.Thread(target=reader, args=(i,), name=f"BenchReader-{i}") for i in range(readers)]
+    started = time.perf_counter()
+    for t in threads: t.start()
+    time.sleep(duration)
+    stop.set()
+    for t in threads: t.join()
+    elapsed = time.perf_counter() - started
+    writer_conn.close()
+    return counts['writes'] / elapsed, counts['reads'] / elapsed
+
+
+def run_db_benchmark(duration=5.0, readers=4, batch_size=100, preload=200000):
+    """يقارن الإنتاجية المتزامنة قبل (اتصال مشترك + journal افتراضي) وبعد (WAL + فهارس + اتصالات قراءة لكل خيط)."""
+    work_dir = Path(tempfile.mkdtemp(prefix='ids_bench_'))
+    try:
+        print(f"قياس قاعدة البيانات: {duration} ث، خيط كتابة واحد، {readers} خيوط قراءة، دفعات {batch_size}، {preload} تنبيه مسبق")
+        results = {}
+        for label, tuned in (('قبل (اتصال مشترك، journal=DELETE)', False), ('بعد (WAL، فهارس، اتصالات قراءة)', True)):
+            results[label] = _bench_db_scenario(work_dir / f"bench_{int(tuned)}.db", tuned, duration, readers, batch_size, preload)
+            print(f"  {label}: كتابة {results[label][0]:,.0f} تنبيه/ث، قراءة {results[label][1]:,.0f} استعلام/ث")
+        return results
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+# --- مراقب ملفات مبني على inotify مباشرة (Linux) بدلاً من المسح الدوري للمجلدات ---
+class InotifyWatcher:
+    """يراقب ملفات محددة عبر استدعاءات inotify من libc (ctypes) في خيط واحد ينتظر على الواصف دون استهلاك المعالج.
+
+    لكل ملف مراقبة خاصة (تعديل، خصائص، نقل/حذف الملف نفسه)، ولكل مجلد أب مراقبة إنشاء/حذف/نقل
+    تصفى بأسماء الملفات المراقبة فقط، لاكتشاف استبدال الملف (كتابة ملف مؤقت ثم rename) وإعادة إنشائه.
+    المجلدات في dirs (أشجار المجلدات المراقبة) لا تصفى: أي ملف جديد فيها يضاف للمراقبة، وأي مجلد فرعي جديد يراقب أيضاً.
+    accept(path) اختيارية: تقبل ملفاً جديداً في مجلد مراقب حتى لو لم يكن في القائمة (مثل مطابقة نمط glob).
+    callback(event_type, path) تستدعى بـ 'modified' أو 'attrib' أو 'created' أو 'deleted'.
+    """
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    IN_ISDIR = 0x40000000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+    FILE_MASK = IN_MODIFY | IN_ATTRIB | IN_MOVE_SELF | IN_DELETE_SELF
+    DIR_MASK = IN_CREATE | IN_MOVED_TO | IN_DELETE | IN_MOVED_FROM | IN_ONLYDIR
+    EVENT_HEADER = struct.Struct('iIII') # wd, mask, cookie, len
+
+    _libc = None
+
+    @classmethod
+    def available(cls):
+        """يتحقق من توفر inotify في libc (Linux فقط)."""
+        if cls._libc is None:
+            try:
+                libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+                libc.inotify_init1.argtypes = [ctypes.c_int]
+                libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+                libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+                cls._libc = libc
+            except (OSError, AttributeError):
+                cls._libc = False
+        return bool(cls._libc)
+
+    def __init__(self, paths, callback, logger=None, dirs=(), accept=None):
+        self.paths = {str(p) for p in paths}
+        self.accept = accept
+        self._open_dirs = {str(d) for d in dirs} # مجلدات تراقب كل محتوياتها
+        self.callback = callback
+        self.logger = logger or logging.getLogger('IDS')
+        self.fd = None
+        self.thread = None
+        self._stop = threading.Event()
+        self._wd_files = {} # واصف المراقبة -> مسار الملف
+        self._file_wds = {} # مسار الملف -> واصف المراقبة
+        self._wd_dirs = {} # واصف المراقبة -> مسار المجلد
+        self._dir_names = {} # مسار المجلد -> أسماء الملفات المراقبة فيه
+        self._inodes = {} # مسار الملف -> (الجهاز، inode) وقت إضافة المراقبة (لتمييز الاستبدال)
+        self._missing = set() # الملفات التي تم الإبلاغ عن حذفها ولم تعد بعد
+        self._lock = threading.Lock() # add_paths قد تستدعى من خيط الفحص الدوري
+        self._watch_limit_reported = False
+        self.watch_count = 0
+
+    def _add_watch(self, path, mask):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                # تجاوز fs.inotify.max_user_watches: رسالة واحدة بدلاً من رسالة لكل ملف
+                if not self._watch_limit_reported:
+                    self._watch_limit_reported = True
+                    self.logger.warning(f"InotifyWatcher: تم بلوغ الحد الأقصى لمراقبات inotify عند {path} "
+                                        f"(زد fs.inotify.max_user_watches). الملفات المتبقية تغطى بالفحص الدوري فقط.")
+            else:
+                self.logger.warning(f"InotifyWatcher: تعذر مراقبة {path}: {os.strerror(err)}")
+            return None
+        return wd
+
+    def _watch_dir(self, path):
+        wd = self._add_watch(path, self.DIR_MASK)
+        if wd is not None:
+            self._wd_dirs[wd] = path
+
+    def add_paths(self, paths, dirs=()):
+        """يضيف ملفات ومجلدات مفتوحة جديدة أثناء التشغيل (مثلاً بعد أن يجدها الفحص الدوري)."""
+        with self._lock:
+            watched_dirs = set(self._wd_dirs.values())
+            for path in dirs:
+                self._open_dirs.add(str(path))
+                if str(path) not in watched_dirs:
+                    self._watch_dir(str(path))
+                    watched_dirs.add(str(path))
+            for path in map(str, paths):
+                if path in self.paths:
+                    continue
+                self.paths.add(path)
+                parent, name = os.path.split(path)
+                self._dir_names.setdefault(parent, set()).add(name)
+                if parent not in watched_dirs:
+                    self._watch_dir(parent)
+                    watched_dirs.add(parent)
+                self._watch_file(path)
+            self.watch_count = len(self._wd_files) + len(self._wd_dirs)
+
+    def _watch_file(self, path):
+        """يضيف (أو يجدد) مراقبة الملف ويسجل هويته. يعيد True إذا نجحت."""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+        wd = self._add_watch(path, self.FILE_MASK)
+        if wd is None:
+            return False
+        self._wd_files[wd] = path
+        self._file_wds[path] = wd
+        self._inodes[path] = (st.st_dev, st.st_ino)
+        return True
+
+    def start(self):
+        if not self.available():
+            raise OSError("inotify غير متاح على هذا النظام")
+        self.fd = self._libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 فشل")
+        for path in sorted(self.paths):
+            parent, name = os.path.split(path)
+            self._dir_names.setdefault(parent, set()).add(name)
+            self._watch_file(path)
+        for parent in set(self._dir_names) | self._open_dirs:
+            self._watch_dir(parent)
+        self.watch_count = len(self._wd_files) + len(self._wd_dirs)
+        if not self.watch_count:
+            os.close(self.fd)
+            self.fd = None
+            raise OSError("لم يتم إضافة أي مراقبة inotify")
+        self._stop.clear()
+        self.thread = threading.Thread(target=self._loop, name="InotifyWatcherThread", daemon=True)
+        self.thread.start()
+
+    def _emit(self, event_type, path):
+        try:
+            self.callback(event_type, path)
+        except Exception as e:
+            self.logger.error(f"InotifyWatcher: خطأ بمعالجة الحدث '{event_type}' لـ {path}: {e}", exc_info=True)
+
+    def _path_replaced(self, path):
+        """يعالج ظهور الملف بمسار مراقب (إنشاء أو استبدال بـ rename). يعيد نوع الحدث أو None إذا لم يتغير."""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if self._inodes.get(path) == (st.st_dev, st.st_ino) and path in self._file_wds:
+            return None # نفس الملف (تم التعامل مع الحدث من المراقبة الأخرى)
+        is_new = path not in self._inodes # ملف جديد داخل شجرة مراقبة (أو لم تنجح مراقبته سابقاً)
+        self._watch_file(path)
+        if path in self._missing or is_new:
+            self._missing.discard(path)
+            return 'created'
+        return 'modified'
+
+    def _path_gone(self, path):
+        """يعالج اختفاء الملف من مساره المراقب (حذف أو نقل)."""
+        if path in self._missing or os.path.lexists(path):
+            return None
+        self._missing.add(path)
+        self._inodes.pop(path, None)
+        return 'deleted'
+
+    def _dispatch(self, wd, mask, name):
+        if mask & self.IN_Q_OVERFLOW:
+            # فقدت أحداث: نعيد فحص كل الملفات
+            self.logger.warning("InotifyWatcher: امتلأ طابور أحداث inotify. إعادة فحص كل الملفات المراقبة.")
+            return [('modified', p) for p in sorted(self.paths) if os.path.exists(p)]
+        if wd in self._wd_dirs:
+            if mask & self.IN_IGNORED:
+                del self._wd_dirs[wd] # المجلد حذف
+                return []
+            parent = self._wd_dirs[wd]
+            path = os.path.join(parent, name)
+            if name not in self._dir_names.get(parent, ()):
+                if not mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                    return [] # ملف غير مراقب في نفس المجلد
+                if parent not in self._open_dirs and (self.accept is None or mask & self.IN_ISDIR or not self.accept(path)):
+                    return []
+                if mask & self.IN_ISDIR:
+                    # مجلد فرعي جديد داخل شجرة مراقبة
+                    if not os.path.islink(path):
+                        self._open_dirs.add(path)
+                        self._watch_dir(path)
+                    return []
+                if os.path.islink(path) or not os.path.isfile(path):
+                    return []
+                # ملف جديد داخل شجرة مراقبة
+                self.paths.add(path)
+                self._dir_names.setdefault(parent, set()).add(name)
+            if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                event_type = self._path_replaced(path)
+            else:
+                event_type = self._path_gone(path)
+            return [(event_type, path)] if event_type else []
+
+        path = self._wd_files.get(wd)
+        if path is None:
+            return []
+        if mask & self.IN_IGNORED:
+            # أزالت النواة المراقبة (الملف حذف أو تم استبداله)
+            del self._wd_files[wd]
+            if self._file_wds.get(path) == wd:
+                del self._file_wds[path]
+            return []
+        if mask & (self.IN_DELETE_SELF | self.IN_MOVE_SELF):
+            if mask & self.IN_MOVE_SELF:
+                self._libc.inotify_rm_watch(self.fd, wd) # المراقبة تتبع الملف إلى مساره الجديد
+            event_type = self._path_gone(path) or self._path_replaced(path)
+            return [(event_type, path)] if event_type else []
+        if self._file_wds.get(path) != wd:
+            return [] # أحداث متأخرة من نسخة الملف القديمة بعد استبداله
+        if mask & self.IN_MODIFY:
+            return [('modified', path)]
+        if mask & self.IN_ATTRIB and os.path.exists(path):
+            return [('attrib', path)] # (تغير عدد الروابط عند الحذف يصل أيضاً كـ IN_ATTRIB)
+        return []
+
+    def _loop(self):
+        poller = select.poll()
+        poller.register(self.fd, select.POLLIN)
+        header_size = self.EVENT_HEADER.size
+        while not self._stop.is_set():
+            if not poller.poll(1000): # ينتظر داخل النواة (مهلة لفحص طلب الإيقاف فقط)
+                continue
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                continue
+            except OSError as e:
+                self.logger.error(f"InotifyWatcher: خطأ بقراءة أحداث inotify: {e}")
+                break
+            # دمج الأحداث المتكررة لنفس الملف داخل نفس الدفعة (الكتابة المجزأة تولد IN_MODIFY لكل استدعاء write)
+            events = {} # قاموس مرتب بدلاً من قائمة (قد تحتوي آلاف الأحداث بعد امتلاء الطابور)
+            offset = 0
+            with self._lock:
+                while offset + header_size <= len(data):
+                    wd, mask, _cookie, name_len = self.EVENT_HEADER.unpack_from(data, offset)
+                    name = data[offset + header_size:offset + header_size + name_len].rstrip(b'\0')
+                    offset += header_size + name_len
+                    for event in self._dispatch(wd, mask, os.fsdecode(name)):
+                        events[event] = None
+            for event_type, path in events:
+                self._emit(event_type, path)
+
+    def is_alive(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def stop(self):
+        self._stop.set()
+
+    def join(self, timeout=None):
+        if self.thread:
+            self.thread.join(timeout)
+        if self.fd is not None and not self.is_alive():
+            os.close(self.fd)
+            self.fd = None
+
+
+# --- توسيع مدخلات SENSITIVE_FILES (ملفات، أنماط glob، أشجار مجلدات) ---
+GLOB_CHARS = ('*', '?', '[')
+
+
+def walk_files(root, files, dirs):
+    """يمشي شجرة المجلد root بـ os.scandir (دون تتبع الروابط الرمزية) ويضيف الملفات العادية إلى files والمجلدات إلى dirs."""
+    stack = [root]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as entries:
+                dirs.add(current)
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            files[entry.path] = None
+                    except OSError:
+                        continue
+        except OSError:
+            continue # مجلد حذف أو بلا صلاحيات قراءة
+
+
+def expand_sensitive_paths(entries):
+    """يحول مدخلات SENSITIVE_FILES إلى (قائمة مسارات الملفات، مجموعة المجلدات المراقبة بالكامل).
+
+    المسار العادي يبقى كما هو (حتى لو لم يكن موجوداً بعد)، والمجلد يمشى بشكل متكرر،
+    والنمط (مثل /etc/*.conf أو /usr/lib/systemd/**) يوسع بـ glob ويمشى أي مجلد يطابقه.
+    """
+    files = {} # قاموس مرتب لإزالة التكرار مع الحفاظ على الترتيب
+    dirs = set()
+    for entry in entries:
+        if any(ch in entry for ch in GLOB_CHARS):
+            for match in glob.iglob(entry, recursive=True):
+                if os.path.islink(match):
+                    continue
+                if os.path.isdir(match):
+                    walk_files(match, files, dirs)
+                elif os.path.isfile(match):
+                    files[match] = None
+        elif os.path.isdir(entry):
+            walk_files(entry, files, dirs)
+        else:
+            files[entry] = None
+    return list(files), dirs
+
+
+# --- تحديد معدل القراءة من القرص (دلو رموز مشترك بين خيوط التجزئة) ---
+class IORateLimiter:
+    """يحد عدد البايتات المقروءة في الثانية. consume() تنتظر عند نفاد الرصيد (يسمح برصيد سالب ثم انتظار يعادله)."""
+
+    def __init__(self, mb_per_sec, stop_event=None):
+        self.rate = mb_per_sec * 1024 * 1024
+        self.capacity = self.rate # رصيد ثانية واحدة كحد أقصى للدفعات
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self.stop_event = stop_event # يوقف الانتظار عند إيقاف النظام
+        self._lock = threading.Lock()
+
+    def consume(self, nbytes):
+        if self.rate <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= nbytes
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0
+        if delay:
+            if self.stop_event is not None:
+                self.stop_event.wait(delay)
+            else:
+                time.sleep(delay)
+
+
+HASH_BUFFER_SIZE = 1024 * 1024 # حجم المخزن المؤقت للتجزئة (1 ميجابايت بدلاً من 4 كيلوبايت)
+
+
+def hash_file(path, limiter=None, length=None):
+    """يحسب SHA256 لملف. يستخدم hashlib.file_digest إن توفر (Python 3.11+)، أو قراءة بمخزن كبير عند تحديد معدل القراءة.
+
+    length يحدد تجزئة أول length بايت فقط (الجزء المراقب من ملف بوضع الإضافة). ترفع OSError عند الفشل. hashlib يحرر GIL أثناء التجزئة فيمكن تشغيلها على مجموعة خيوط.
+    """
+    start = time.perf_counter()
+    with open(path, 'rb', buffering=0) as f:
+        if limiter is None and length is None and hasattr(hashlib, 'file_digest'):
+            digest = hashlib.file_digest(f, 'sha256').hexdigest()
+            total = f.tell() # file_digest يقرأ حتى النهاية، فالإزاحة الحالية = عدد البايتات
+        else:
+            hasher = hashlib.sha256()
+            buf = bytearray(HASH_BUFFER_SIZE)
+            view = memoryview(buf)
+            total = 0
+            while length is None or total < length:
+                size = f.readinto(buf if length is None or length - total >= len(buf) else view[:length - total])
+                if not size: break
+                if limiter is not None:
+                    limiter.consume(size)
+                hasher.update(view[:size])
+                total += size
+            digest = hasher.hexdigest()
+    METRIC_FILE_HASH_BYTES.inc(total)
+    METRIC_FILE_HASH_SECONDS.observe(time.perf_counter() - start)
+    return digest
+
+
+# --- قياس أداء فحص سلامة الملفات ---
+def run_scan_benchmark(entries, workers=None, io_limit_mb=0):
+    """يقيس توسيع المدخلات وتجزئة كل الملفات: تسلسلياً بدفعات 4 كيلوبايت (السابق) ثم بمجموعة خيوط.
+
+    يسبق القياسين تمرير تمهيدي غير محسوب حتى يقيس كلاهما نفس حالة ذاكرة الصفحات.
+    """
+    if workers is None:
+        workers = min(4, os.cpu_count() or 1)
+    entries = [str(Path(e).resolve()) for e in entries] or AppConfig.SENSITIVE_FILES
+    t0 = time.perf_counter()
+    files, dirs = expand_sensitive_paths(entries)
+    files = [f for f in files if os.path.isfile(f)]
+    walk_elapsed = time.perf_counter() - t0
+    print(f"فحص الملفات: {len(files)} ملف في {len(dirs)} مجلد (المسح بـ scandir: {walk_elapsed:.3f} ث)")
+
+    def hash_4k(path):
+        hasher = hashlib.sha256()
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(4096)
+                if not chunk: break
+                hasher.update(chunk)
+        return hasher.hexdigest()
+
+    limiter = IORateLimiter(io_limit_mb) if io_limit_mb > 0 else None
+    scenarios = (
+        ('تسلسلي، دفعات 4 كيلوبايت', 1, hash_4k),
+        (f"{workers} خيوط، {'file_digest' if limiter is None and hasattr(hashlib, 'file_digest') else 'مخزن 1 ميجابايت'}"
+         f"{f'، حد {io_limit_mb} ميجابايت/ث' if limiter else ''}", workers, lambda p: hash_file(p, limiter)),
+    )
+    for path in files: # تمرير تمهيدي
+        try:
+            hash_file(path)
+        except OSError:
+            pass
+    results = {}
+    for label, pool_size, func in scenarios:
+        def safe_hash(path):
+            try:
+                return os.path.getsize(path) if func(path) else 0
+            except OSError:
+                return 0
+        t0 = time.perf_counter()
+        if pool_size > 1:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=pool_size) as pool:
+                total = sum(pool.map(safe_hash, files))
+        else:
+            total = sum(map(safe_hash, files))
+        elapsed = max(time.perf_counter() - t0, 1e-9)
+        results[label] = (len(files) / elapsed, total / elapsed / (1024 * 1024))
+        print(f"  {label}: {results[label][0]:,.0f} ملف/ث، {results[label][1]:,.1f} ميجابايت/ث ({total / (1024 * 1024):,.1f} ميجابايت في {elapsed:.2f} ث)")
+    return results
+
+
+# --- حالة ملف يراقب بوضع الإضافة فقط (سجلات تنمو باستمرار) ---
+class AppendOnlyState:
+    """يحتفظ بحالة التجزئة (sha256 غير منتهية) والإزاحة التي وصلت إليها، لتجزئة البايتات المضافة فقط.
+
+    يحفظ أيضاً أول وآخر WINDOW بايت مما تمت تجزئته للتحقق من عدم إعادة كتابة المحتوى السابق
+    بتكلفة ثابتة عند كل إضافة، مع رقم الـ inode والصلاحيات والمالك لاكتشاف استبدال الملف أو تغيير صلاحياته.
+    تعديل وسط الملف لا تكشفه النافذتان، فيعيد الفحص الدوري تجزئة [0، offset) ويقارنها بـ hexdigest().
+    """
+    __slots__ = ('hasher', 'offset', 'head', 'tail', 'dev', 'ino', 'mode', 'uid', 'gid')
+    WINDOW = 4096
+
+    def __init__(self, st):
+        self.hasher = hashlib.sha256()
+        self.offset = 0
+        self.head = b''
+        self.tail = b''
+        self.set_stat(st)
+
+    def set_stat(self, st):
+        self.dev, self.ino = st.st_dev, st.st_ino
+        self.mode, self.uid, self.gid = st.st_mode, st.st_uid, st.st_gid
+
+    def feed(self, f, limit=None):
+        """يجزئ ما بعد الإزاحة الحالية حتى نهاية الملف المفتوح f (أو حتى الإزاحة limit). يعيد عدد البايتات المضافة."""
+        f.seek(self.offset)
+        added = 0
+        while True:
+            chunk = f.read(65536 if limit is None else min(65536, limit - self.offset - added))
+            if not chunk: break
+            self.hasher.update(chunk)
+            if len(self.head) < self.WINDOW:
+                self.head += chunk[:self.WINDOW - len(self.head)]
+            self.tail = (self.tail + chunk[-self.WINDOW:])[-self.WINDOW:]
+            added += len(chunk)
+        self.offset += added
+        METRIC_FILE_HASH_BYTES.inc(added)
+        return added
+
+    def windows_intact(self, f):
+        """يقارن أول وآخر نافذة من الجزء المجزأ سابقاً بمحتوى الملف الحالي."""
+        f.seek(0)
+        if f.read(len(self.head)) != self.head:
+            return False
+        f.seek(self.offset - len(self.tail))
+        return f.read(len(self.tail)) == self.tail
+
+    def hexdigest(self):
+        return self.hasher.hexdigest()
 
 
 # --- فئة لمراقبة تغييرات الملفات (HIDS) ---
@@ -297,28 +1727,75 @@ class FileMonitor:
         self.logger = logger_instance # استخدام كائن Logger
         self.file_hashes = {} # قاموس لتخزين تجزئات الملفات (المسار -> التجزئة)
         self.watched_files = set() # مجموعة مسارات Path للملفات التي يجب مراقبتها تحديداً
-        self.observer = None # كائن مراقب watchdog
+        # مدخلات SENSITIVE_FILES: ملفات، أنماط glob، أو مجلدات تراقب كل محتوياتها بشكل متكرر
+        self.sensitive_entries = list(AppConfig.SENSITIVE_FILES)
+        self._glob_entries = [e for e in self.sensitive_entries if any(ch in e for ch in GLOB_CHARS)]
+        self._tree_roots = tuple(e.rstrip(os.sep) + os.sep for e in self.sensitive_entries
+                                 if e not in self._glob_entries and os.path.isdir(e))
+        files, self.tree_dirs = expand_sensitive_paths(self.sensitive_entries)
+        # الملفات المحددة في الإعدادات بعد التوسيع (يعاد إضافتها للمراقبة إذا حذفت ثم أنشئت من جديد)
+        self.configured_files = {Path(f) for f in files}
+        # ملفات وضع الإضافة فقط: لا تنبيه على الإضافة، بل على الاقتطاع أو إعادة الكتابة أو استبدال الـ inode أو تغيير الصلاحيات
+        self.append_only_files = {Path(f) for f in AppConfig.APPEND_ONLY_FILES} & self.configured_files
+        for file_str in AppConfig.APPEND_ONLY_FILES:
+            if Path(file_str) not in self.configured_files:
+                self.logger.logger.warning(f"FileMonitor: '{file_str}' في APPEND_ONLY_FILES ليس ضمن SENSITIVE_FILES. سيتم تجاهله.")
+        self.append_states = {} # المسار -> AppendOnlyState
+        # ملفات وضع الإضافة التي لم تتغير منذ آخر تشغيل: تبنى حالتها عند أول حدث (المسار -> صف خط الأساس)
+        self.pending_append_baselines = {}
+        # حفظ خط الأساس (المسار، inode، الحجم، mtime_ns، ctime_ns، الصلاحيات، sha256) في قاعدة البيانات
+        try:
+            self.persist_baselines = config.getboolean('HIDS', 'PERSIST_BASELINES', fallback=True)
+        except ValueError:
+            self.logger.logger.error("FileMonitor: قيمة 'PERSIST_BASELINES' في [HIDS] يجب أن تكون yes أو no. سيتم حفظ خط الأساس.")
+            self.persist_baselines = True
+        self.unchanged_at_start = 0 # عدد الملفات التي لم تتم إعادة تجزئتها عند البدء
+        # التجزئة المتوازية والفحص الدوري الكامل (بمعدل قراءة محدود حتى لا يؤثر على أحمال الإنتاج)
+        try:
+            self.hash_workers = config.getint('HIDS', 'HASH_WORKERS', fallback=0)
+            self.full_scan_interval = config.getfloat('HIDS', 'FULL_SCAN_INTERVAL', fallback=3600)
+            self.scan_io_limit = config.getfloat('HIDS', 'FULL_SCAN_IO_LIMIT_MB', fallback=20)
+        except ValueError:
+            self.logger.logger.error("FileMonitor: قيم HASH_WORKERS/FULL_SCAN_INTERVAL/FULL_SCAN_IO_LIMIT_MB في [HIDS] يجب أن تكون أرقاماً. استخدام القيم الافتراضية.")
+            self.hash_workers, self.full_scan_interval, self.scan_io_limit = 0, 3600, 20
+        if self.hash_workers <= 0:
+            self.hash_workers = min(4, os.cpu_count() or 1)
+        # دمج الأحداث: كل دفعة أحداث لنفس المسار تتحقق مرة واحدة بعد فترة هدوء، على خيط منفصل عن خيط المراقب
+        try:
+            self.quiet_period = config.getfloat('HIDS', 'EVENT_QUIET_PERIOD', fallback=0.5)
+            self.max_event_delay = config.getfloat('HIDS', 'EVENT_MAX_DELAY', fallback=5)
+        except ValueError:
+            self.logger.logger.error("FileMonitor: قيم EVENT_QUIET_PERIOD/EVENT_MAX_DELAY في [HIDS] يجب أن تكون أرقاماً. استخدام القيم الافتراضية.")
+            self.quiet_period, self.max_event_delay = 0.5, 5
+        self.quiet_period = max(0.0, self.quiet_period)
+        self.max_event_delay = max(self.quiet_period, self.max_event_delay)
+        self._pending = {} # المسار -> [وقت أول حدث، وقت آخر حدث، مجموعة أنواع الأحداث]
+        self._pending_cond = threading.Condition()
+        self._event_thread = None
+        self._event_stop = False
+        self.events_received = 0 # عدد الأحداث المستلمة من المراقب
+        self.verifications = 0 # عدد عمليات التحقق بعد الدمج
+        self._lock = threading.RLock() # يحمي الحالة بين خيط الأحداث وخيط الفحص الدوري
+        self._scan_stop = threading.Event()
+        self._scan_thread = None
+        self.observer = None # كائن المراقب (InotifyWatcher أو watchdog Observer)
+        # آلية المراقبة: auto (inotify إن توفر)، inotify، أو polling (watchdog PollingObserver)
+        self.backend = config.get('HIDS', 'FILE_MONITOR_BACKEND', fallback='auto').strip().lower() or 'auto'
+        if self.backend not in ('auto', 'inotify', 'polling'):
+            self.logger.logger.error(f"FileMonitor: قيمة 'FILE_MONITOR_BACKEND' في [HIDS] غير معروفة ({self.backend}). استخدام auto.")
+            self.backend = 'auto'
 
         # تهيئة تجزئات الملفات وقائمة المراقبة
         self._init_hashes_and_files()
 
     # حساب تجزئة (Hash) لملف معين
-    def _calculate_hash(self, file_path_obj: Path):
-        """يحسب تجزئة SHA256 لملف. يعيد None في حالة الخطأ."""
+    def _calculate_hash(self, file_path_obj: Path, limiter=None):
+        """يحسب تجزئة SHA256 لملف (hash_file). يعيد None في حالة الخطأ."""
         try:
             # التحقق من أن الملف موجود وهو ملف فعلي
             if not file_path_obj.exists() or not file_path_obj.is_file():
                  return None # لا يمكن حساب تجزئة لشيء غير موجود أو ليس ملفاً
-
-            hasher = hashlib.sha256()
-            # فتح الملف للقراءة الثنائية
-            with file_path_obj.open('rb') as f:
-                # قراءة الملف على دفعات لتجنب استهلاك الذاكرة للملفات الكبيرة
-                while True:
-                    chunk = f.read(4096) # قراءة 4 كيلوبايت في كل مرة
-                    if not chunk: break # التوقف عند نهاية الملف
-                    hasher.update(chunk) # تحديث الهاشر بالدفعة المقروءة
-            return hasher.hexdigest() # إعادة التجزئة النهائية كنص سداسي عشري
+            return hash_file(file_path_obj, limiter)
         except PermissionError:
              self.logger.logger.error(f"FileMonitor: لا تملك الصلاحيات الكافية لقراءة الملف {file_path_obj}")
              return None
@@ -330,29 +1807,306 @@ class FileMonitor:
             self.logger.logger.error(f"FileMonitor: خطأ غير متوقع بحساب تجزئة {file_path_obj}: {e}")
             return None
 
+    # تجزئة عدة ملفات على مجموعة خيوط محدودة
+    def _hash_files(self, paths, limiter=None, stop_event=None):
+        """يعيد قائمة التجزئات بنفس ترتيب paths (None عند الفشل أو بعد طلب الإيقاف)."""
+        def one(path):
+            if stop_event is not None and stop_event.is_set():
+                return None
+            return self._calculate_hash(path, limiter)
+        if self.hash_workers <= 1 or len(paths) <= 1:
+            return [one(p) for p in paths]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.hash_workers, thread_name_prefix='FileHash') as pool:
+            return list(pool.map(one, paths))
+
+    # هل المسار ضمن مدخلات SENSITIVE_FILES (شجرة مجلد أو نمط glob)؟
+    def _in_scope(self, path_str):
+        if path_str.startswith(self._tree_roots) or os.path.dirname(path_str) in self.tree_dirs:
+            return True
+        return any(fnmatch.fnmatch(path_str, pattern) for pattern in self._glob_entries)
+
+    # مفتاح المقارنة السريعة مع خط الأساس المحفوظ
+    @staticmethod
+    def _stat_key(st):
+        return (st.st_ino, st.st_size, st.st_mtime_ns, st.st_ctime_ns, st.st_mode)
+
+    # حفظ خط أساس ملف عبر طابور الكتابة
+    def _store_baseline(self, path_str, st, sha256, size=None):
+        if self.persist_baselines:
+            self.logger.log_baselines([(path_str, st.st_ino, st.st_size if size is None else size, st.st_mtime_ns,
+                                        st.st_ctime_ns, st.st_mode, sha256, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))])
+
+    # حفظ خط أساس ملف بعد حساب تجزئته (st تؤخذ قبل التجزئة حتى لا يغطي خط الأساس تعديلاً لم تتم تجزئته)
+    def _store_current_baseline(self, file_path_obj: Path, sha256, st=None):
+        if not self.persist_baselines:
+            return
+        try:
+            self._store_baseline(str(file_path_obj), st or file_path_obj.stat(), sha256)
+        except OSError:
+            pass # الملف حذف أو استبدل بعد التجزئة، الحدث التالي يحدث خط الأساس
+
+    # حذف خط أساس ملف محذوف
+    def _forget_baseline(self, path_str):
+        self.pending_append_baselines.pop(path_str, None)
+        if self.persist_baselines:
+            self.logger.log_baselines(deleted_paths=[path_str])
+
+    # وصف الاختلاف بين خط الأساس والحالة الحالية
+    @staticmethod
+    def _baseline_changes(baseline, st, content_changed):
+        changes = []
+        if content_changed:
+            changes.append("المحتوى")
+        if st.st_ino != baseline[0]:
+            changes.append(f"الـ inode {baseline[0]} -> {st.st_ino}")
+        if st.st_mode != baseline[4]:
+            changes.append(f"الصلاحيات {oct(baseline[4] & 0o7777)} -> {oct(st.st_mode & 0o7777)}")
+        return changes
+
+    # تهيئة حالة وضع الإضافة فقط (تجزئة كاملة مرة واحدة)
+    def _init_append_state(self, file_path_obj: Path, baseline=None):
+        """يجزئ الملف كاملاً ويحفظ حالة التجزئة والإزاحة لمتابعة الإضافات.
+
+        إذا أعطي baseline (صف من file_baselines) يتم التحقق أولاً من أن أول size بايت تطابق التجزئة المحفوظة
+        (الإضافة بعدها مسموحة). يعيد (التجزئة، قائمة الاختلافات عن خط الأساس) أو (None، []) في حالة الخطأ.
+        """
+        path_str = str(file_path_obj)
+        changes = []
+        try:
+            with file_path_obj.open('rb') as f:
+                st = os.fstat(f.fileno())
+                state = AppendOnlyState(st)
+                if baseline is not None:
+                    state.feed(f, limit=baseline[1])
+                    content_changed = state.offset < baseline[1] or state.hexdigest() != baseline[5]
+                    changes = self._baseline_changes(baseline, st, content_changed)
+                state.feed(f)
+        except PermissionError:
+            self.logger.logger.error(f"FileMonitor: لا تملك الصلاحيات الكافية لقراءة الملف {file_path_obj}")
+            self.append_states.pop(path_str, None)
+            return None, []
+        except OSError as e:
+            self.logger.logger.error(f"FileMonitor: خطأ بتهيئة وضع الإضافة للملف {file_path_obj}: {e}")
+            self.append_states.pop(path_str, None)
+            return None, []
+        self.append_states[path_str] = state
+        self.file_hashes[path_str] = state.hexdigest()
+        self._store_baseline(path_str, st, self.file_hashes[path_str], size=state.offset)
+        return self.file_hashes[path_str], changes
+
+    # التنبيه على ما تغير أثناء توقف النظام
+    def _report_offline_changes(self, file_path_obj: Path, changes):
+        if changes:
+            self.logger.log_alert("HIDS_ALERT", f"تعديل ملف حساس أثناء توقف النظام: {file_path_obj} ({'، '.join(changes)})", "FileMonitor")
+
+    # التحقق من ملف بوضع الإضافة فقط: تكلفة تتناسب مع البايتات المضافة وليس حجم الملف
+    def _check_append_only(self, file_path_obj: Path):
+        """يجزئ البايتات المضافة فقط وينبه على الاقتطاع أو إعادة الكتابة أو استبدال الـ inode أو تغيير الصلاحيات."""
+        path_str = str(file_path_obj)
+        state = self.append_states.get(path_str)
+        if state is None:
+            baseline = self.pending_append_baselines.pop(path_str, None)
+            if baseline is not None:
+                # أول حدث بعد بدء لم يعد فيه تجزئة الملف: التحقق من المحتوى السابق ثم متابعة الإضافات
+                current_hash, changes = self._init_append_state(file_path_obj, baseline)
+                if changes:
+                    self.logger.log_alert("HIDS_ALERT", f"إعادة كتابة محتوى سابق في ملف سجل: {file_path_obj} ({'، '.join(changes)})", "FileMonitor")
+            elif self._init_append_state(file_path_obj)[0]:
+                self.logger.log_alert("HIDS_ALERT", f"تعديل ملف حساس ({file_path_obj}) لم تكن تجزئته الأولية متاحة.", "FileMonitor")
+            return
+        try:
+            with file_path_obj.open('rb') as f:
+                st = os.fstat(f.fileno())
+                if (st.st_dev, st.st_ino) != (state.dev, state.ino):
+                    reason = f"استبدال ملف سجل (تغير الـ inode من {state.ino} إلى {st.st_ino})"
+                elif st.st_size < state.offset:
+                    reason = f"اقتطاع ملف سجل (الحجم {st.st_size} أصغر من {state.offset} بايت تمت مراقبتها)"
+                elif not state.windows_intact(f):
+                    reason = "إعادة كتابة محتوى سابق في ملف سجل"
+                else:
+                    reason = None
+                if reason is None:
+                    if (st.st_mode, st.st_uid, st.st_gid) != (state.mode, state.uid, state.gid):
+                        self.logger.log_alert("HIDS_ALERT", f"تغيير صلاحيات/مالك ملف سجل: {file_path_obj} "
+                                              f"(mode {oct(state.mode & 0o7777)} -> {oct(st.st_mode & 0o7777)}, "
+                                              f"uid {state.uid} -> {st.st_uid}, gid {state.gid} -> {st.st_gid})", "FileMonitor")
+                        state.set_stat(st)
+                    added = state.feed(f)
+                    self.file_hashes[path_str] = state.hexdigest()
+                    self._store_baseline(path_str, os.fstat(f.fileno()), self.file_hashes[path_str], size=state.offset)
+                    if added:
+                        self.logger.logger.debug(f"FileMonitor: إضافة {added} بايت إلى {file_path_obj} (الإزاحة {state.offset}).")
+                    return
+        except FileNotFoundError:
+            return # الحذف يعالج بحدث 'deleted'
+        except OSError as e:
+            self.logger.logger.error(f"FileMonitor: خطأ بقراءة الإضافات إلى {file_path_obj}: {e}")
+            return
+        self.logger.log_alert("HIDS_ALERT", f"{reason}: {file_path_obj}", "FileMonitor")
+        # بدء حالة جديدة من المحتوى الحالي (تجزئة كاملة مرة واحدة)
+        self._init_append_state(file_path_obj)
+
     # تهيئة التجزئات الأولية وقائمة الملفات للمراقبة
     def _init_hashes_and_files(self):
-        """يحسب التجزئات الأولية للملفات الحساسة ويحدد المجلدات التي ستتم مراقبتها."""
-        self.logger.logger.info("FileMonitor: تهيئة مراقبة الملفات...")
-        count = 0 # عداد للملفات التي تمكننا من مراقبتها بنجاح
-        for file_str in AppConfig.SENSITIVE_FILES:
-            file_path = Path(file_str) # تحويل المسار النصي إلى كائن Path
+        """يحسب التجزئات الأولية للملفات الحساسة ويحدد المجلدات التي ستتم مراقبتها.
 
+        الملفات التي لم تتغير بيانات stat لها منذ آخر تشغيل تأخذ تجزئتها من خط الأساس، والباقي يجزأ على مجموعة خيوط.
+        """
+        self.logger.logger.info("FileMonitor: تهيئة مراقبة الملفات...")
+        # خطوط الأساس المحفوظة من التشغيل السابق (المسار -> inode، الحجم، mtime_ns، ctime_ns، الصلاحيات، sha256)
+        baselines = self.logger.load_baselines() if self.persist_baselines else {}
+        to_hash = [] # (المسار، stat، خط الأساس) للملفات التي تغيرت أو ليس لها خط أساس
+        for file_path in sorted(self.configured_files):
+            file_str = str(file_path)
+            baseline = baselines.get(file_str)
+            try:
+                st = file_path.stat()
+            except OSError:
+                st = None
             # التحقق من وجود الملف وأنه ملف فعلاً
-            if file_path.exists() and file_path.is_file():
-                current_hash = self._calculate_hash(file_path)
+            if st is None or not stat.S_ISREG(st.st_mode):
+                # إذا كان المسار المحدد غير موجود أو ليس ملفاً
+                self.logger.logger.warning(f"FileMonitor: ملف حساس '{file_str}' غير موجود أو ليس ملفاً.")
+                if baseline is not None:
+                    self.logger.log_alert("HIDS_ALERT", f"حذف ملف حساس أثناء توقف النظام: {file_path}", "FileMonitor")
+                    self._forget_baseline(file_str)
+                continue
+            if baseline is not None and self._stat_key(st) == baseline[:5]:
+                # لم يتغير منذ آخر تشغيل: لا حاجة لقراءة الملف
+                self.unchanged_at_start += 1
+                self.file_hashes[file_str] = baseline[5]
+                self.watched_files.add(file_path)
+                if file_path in self.append_only_files:
+                    self.pending_append_baselines[file_str] = baseline
+            elif file_path in self.append_only_files:
+                current_hash, changes = self._init_append_state(file_path, baseline)
                 if current_hash:
-                    self.file_hashes[str(file_path)] = current_hash # تخزين التجزئة باستخدام المسار كنص
-                    self.watched_files.add(file_path) # إضافة كائن Path إلى مجموعة المراقبة
-                    count += 1
+                    self.watched_files.add(file_path)
+                    self._report_offline_changes(file_path, changes)
                 else:
-                    # إذا لم نتمكن من حساب التجزئة (غالباً بسبب الصلاحيات)، نسجل تحذيراً
                     self.logger.logger.warning(f"FileMonitor: تخطي مراقبة '{file_str}' بسبب مشكلة (ربما صلاحيات).")
             else:
-                # إذا كان المسار المحدد غير موجود أو ليس ملفاً
-                self.logger.logger.warning(f"FileMonitor: ملف حساس '{file_str}' غير موجود أو ليس ملفاً.")
-
-        self.logger.logger.info(f"FileMonitor: اكتملت تهيئة الملفات. المراقبة: {count} ملفات من أصل {len(AppConfig.SENSITIVE_FILES)}.")
+                to_hash.append((file_path, st, baseline))
+
+        for (file_path, st, baseline), current_hash in zip(to_hash, self._hash_files([item[0] for item in to_hash])):
+            if not current_hash:
+                # إذا لم نتمكن من حساب التجزئة (غالباً بسبب الصلاحيات)، نسجل تحذيراً
+                self.logger.logger.warning(f"FileMonitor: تخطي مراقبة '{file_path}' بسبب مشكلة (ربما صلاحيات).")
+                continue
+            self.file_hashes[str(file_path)] = current_hash # تخزين التجزئة باستخدام المسار كنص
+            self.watched_files.add(file_path) # إضافة كائن Path إلى مجموعة المراقبة
+            self._store_baseline(str(file_path), st, current_hash)
+            if baseline is not None:
+                self._report_offline_changes(file_path, self._baseline_changes(baseline, st, current_hash != baseline[5]))
+
+        # ملفات لها خط أساس داخل شجرة أو نمط مراقب لكنها لم تعد موجودة
+        for file_str in baselines:
+            if Path(file_str) not in self.configured_files and self._in_scope(file_str) and not os.path.lexists(file_str):
+                self.logger.log_alert("HIDS_ALERT", f"حذف ملف حساس أثناء توقف النظام: {file_str}", "FileMonitor")
+                self._forget_baseline(file_str)
+
+        self.logger.logger.info(f"FileMonitor: اكتملت تهيئة الملفات. المراقبة: {len(self.watched_files)} ملفات من أصل {len(self.configured_files)} "
+                                f"({self.unchanged_at_start} لم تتغير منذ آخر تشغيل ولم تتم إعادة تجزئتها، {len(to_hash)} تمت تجزئتها).")
+
+    # الفحص الدوري الكامل: إعادة تجزئة كل الملفات بمعدل قراءة محدود
+    def full_scan(self):
+        """يعيد توسيع مدخلات SENSITIVE_FILES ويجزئ كل الملفات المراقبة ويقارنها بالتجزئات المخزنة.
+
+        يكتشف ما قد يفوت المراقب: تعديل مع إعادة mtime، أحداث مفقودة، ملفات جديدة في الأشجار المراقبة أو محذوفة.
+        ملفات وضع الإضافة فقط يجزأ منها الجزء المراقب [0، الإزاحة) فقط ويقارن بتجزئة تلك الإزاحة (تعديل في
+        وسط الملف لا تكشفه نافذتا البداية والنهاية عند أحداث الإضافة). يعيد قاموس إحصائيات.
+        """
+        started = time.monotonic()
+        files, dirs = expand_sensitive_paths(self.sensitive_entries)
+        current = {Path(f) for f in files}
+        with self._lock:
+            self.configured_files |= current
+            self.tree_dirs |= dirs
+            gone = [p for p in self.watched_files if not os.path.lexists(p)]
+            appeared = [p for p in current if p not in self.watched_files and p.is_file()]
+        for file_path in gone:
+            self._verify_path(str(file_path), {'deleted'})
+        for file_path in appeared:
+            self._verify_path(str(file_path), {'created'})
+        if isinstance(self.observer, InotifyWatcher):
+            self.observer.add_paths(appeared, dirs)
+
+        with self._lock:
+            targets = [p for p in self.watched_files if p not in self.append_only_files]
+            # (المسار، الحالة المرجعية، inode، الطول المراقب، التجزئة عند هذا الطول) لملفات وضع الإضافة
+            prefixes = []
+            for file_path in self.watched_files & self.append_only_files:
+                state = self.append_states.get(str(file_path))
+                if state is not None:
+                    prefixes.append((file_path, state, state.ino, state.offset, state.hexdigest()))
+                else:
+                    baseline = self.pending_append_baselines.get(str(file_path))
+                    if baseline is not None:
+                        prefixes.append((file_path, baseline, baseline[0], baseline[1], baseline[5]))
+        items = []
+        for file_path in targets:
+            try:
+                items.append((file_path, file_path.stat()))
+            except OSError:
+                continue # حذف أثناء الفحص، يعالجه حدث الحذف
+        limiter = IORateLimiter(self.scan_io_limit, self._scan_stop) if self.scan_io_limit > 0 else None
+        hashes = self._hash_files([item[0] for item in items], limiter, self._scan_stop)
+        prefix_hashes = []
+        for file_path, _ref, _ino, length, _digest in prefixes:
+            try:
+                prefix_hashes.append(None if self._scan_stop.is_set() else hash_file(file_path, limiter, length))
+            except OSError:
+                prefix_hashes.append(None) # حذف أو استبدل أثناء الفحص، يعالجه حدث الحذف/التعديل
+
+        total_bytes = mismatches = 0
+        with self._lock:
+            for (file_path, ref, ino, length, digest), current_hash in zip(prefixes, prefix_hashes):
+                if current_hash is None:
+                    continue
+                total_bytes += length
+                path_str = str(file_path)
+                # الحالة أعيد بناؤها أثناء التجزئة (حدث اكتشف التغيير وأطلق تنبيهه) أو استبدل الملف
+                if ref is not self.append_states.get(path_str, self.pending_append_baselines.get(path_str)):
+                    continue
+                try:
+                    if file_path.stat().st_ino != ino:
+                        continue
+                except OSError:
+                    continue
+                if current_hash != digest:
+                    mismatches += 1
+                    self.logger.log_alert("HIDS_ALERT", f"إعادة كتابة محتوى سابق في ملف سجل (اكتشف بالفحص الدوري): {file_path}", "FileMonitor")
+                    self.pending_append_baselines.pop(path_str, None)
+                    self._init_append_state(file_path)
+            for (file_path, st), current_hash in zip(items, hashes):
+                if current_hash is None:
+                    continue
+                total_bytes += st.st_size
+                try:
+                    if self._stat_key(file_path.stat()) != self._stat_key(st):
+                        continue # تغير أثناء التجزئة، يعالجه حدث التعديل
+                except OSError:
+                    continue
+                stored = self.file_hashes.get(str(file_path))
+                if stored is not None and stored != current_hash:
+                    mismatches += 1
+                    self.logger.log_alert("HIDS_ALERT", f"تعديل ملف حساس (اكتشف بالفحص الدوري): {file_path}", "FileMonitor")
+                    self.file_hashes[str(file_path)] = current_hash
+                    self._store_baseline(str(file_path), st, current_hash)
+        elapsed = time.monotonic() - started
+        stats = {'files': len(items) + len(prefixes), 'bytes': total_bytes, 'new': len(appeared), 'deleted': len(gone),
+                 'mismatches': mismatches, 'elapsed': elapsed}
+        self.logger.logger.info(f"FileMonitor: اكتمل الفحص الدوري: {stats['files']} ملف، {total_bytes / (1024 * 1024):.1f} ميجابايت "
+                                f"في {elapsed:.1f} ث، {mismatches} تعديل، {len(appeared)} جديد، {len(gone)} محذوف.")
+        return stats
+
+    # حلقة خيط الفحص الدوري
+    def _full_scan_loop(self):
+        while not self._scan_stop.wait(self.full_scan_interval):
+            try:
+                self.full_scan()
+            except Exception as e:
+                self.logger.logger.error(f"FileMonitor: خطأ أثناء الفحص الدوري: {e}", exc_info=True)
 
     # بدء مراقب الملفات (Watcher)
     def start(self):
@@ -361,20 +2115,36 @@ class FileMonitor:
             self.logger.logger.warning("FileMonitor: قائمة الملفات للمراقبة فارغة. لن يتم بدء مراقب الملفات.")
             return None # لا يوجد شيء لمراقبته
 
+        if self.backend in ('auto', 'inotify'):
+            if InotifyWatcher.available():
+                watcher = InotifyWatcher(self.watched_files, self._handle_event, self.logger.logger,
+                                         dirs=self.tree_dirs, accept=self._in_scope if self._glob_entries else None)
+                try:
+                    watcher.start()
+                    self.observer = watcher
+                    self.logger.logger.info(f"FileMonitor: بدء مراقب الملفات (inotify) بـ {watcher.watch_count} مراقبة لـ {len(self.watched_files)} ملف(ات).")
+                    self._start_event_thread()
+                    self._start_full_scan()
+                    return self.observer
+                except OSError as e:
+                    self.logger.logger.warning(f"FileMonitor: فشل بدء مراقب inotify ({e}). العودة إلى المراقبة الدورية.")
+            else:
+                self.logger.logger.warning("FileMonitor: inotify غير متاح على هذا النظام. العودة إلى المراقبة الدورية.")
+
         # معالج الأحداث المخصص
         event_handler = FileSystemEventHandler()
         # ربط الدوال المخصصة بالأحداث
         event_handler.on_modified = self._on_modified
         event_handler.on_created = self._on_created
         event_handler.on_deleted = self._on_deleted
+        event_handler.on_moved = self._on_moved
 
         # إنشاء كائن المراقب. نستخدم PollingObserver إذا كان النظام لا يدعم inotify
         self.observer = Observer()
 
         # تحديد المجلدات الأبوية للملفات المراقبة لتسجيلها للمراقبة بواسطة watchdog
         watched_dirs = set()
-        for file_path_obj in self.watched_files:
-            parent_dir = file_path_obj.parent # الحصول على المجلد الأب
+        for parent_dir in {p.parent for p in self.watched_files} | {Path(d) for d in self.tree_dirs}: # المجلدات الأبوية ومجلدات الأشجار المراقبة
             # التحقق من أن المجلد الأب لم تتم إضافته بالفعل للمراقبة وأنه موجود ومجلد فعلاً
             if parent_dir not in watched_dirs and parent_dir.exists() and parent_dir.is_dir():
                 # تسجيل المجلد الأب للمراقبة. recursive=False لأننا نهتم بالأحداث في هذا المجلد فقط
@@ -395,28 +2165,113 @@ class FileMonitor:
             # بدء خيط المراقب
             self.observer.start()
             self.logger.logger.info(f"FileMonitor: بدء مراقب الملفات على {len(watched_dirs)} مجلد(ات).")
+            self._start_event_thread()
+            self._start_full_scan()
             return self.observer # إعادة الكائن المراقب للتحكم فيه لاحقاً
         except Exception as e:
             self.logger.logger.error(f"FileMonitor: فشل بدء مراقب الملفات: {e}")
             return None
 
-    # معالج عام لأحداث الملفات
+    # بدء خيط الفحص الدوري الكامل
+    def _start_full_scan(self):
+        if self.full_scan_interval > 0 and self._scan_thread is None:
+            self._scan_stop.clear()
+            self._scan_thread = threading.Thread(target=self._full_scan_loop, name="FileScanThread", daemon=True)
+            self._scan_thread.start()
+            limit = f"{self.scan_io_limit:g} ميجابايت/ث" if self.scan_io_limit > 0 else "بدون حد"
+            self.logger.logger.info(f"FileMonitor: الفحص الكامل كل {self.full_scan_interval:g} ث ({self.hash_workers} خيوط تجزئة، معدل القراءة {limit}).")
+
+    # بدء خيط التحقق من الأحداث المدمجة
+    def _start_event_thread(self):
+        if self._event_thread is None:
+            self._event_stop = False
+            self._event_thread = threading.Thread(target=self._event_loop, name="FileEventThread", daemon=True)
+            self._event_thread.start()
+
+    # معالج عام لأحداث الملفات (يستدعى من خيط المراقب)
     def _handle_event(self, event_type, event_src_path_str):
-        """يعالج أحداث الملفات ويتحقق مما إذا كانت تتعلق بملف حساس."""
-        event_file_path = Path(event_src_path_str).resolve() # الحصول على المسار المطلق للملف المتأثر
-        self.logger.logger.debug(f"FileMonitor: حدث '{event_type}' لـ {event_file_path}") # تسجيل الحدث للمراجعة
+        """يضيف الحدث إلى مرحلة الدمج حسب المسار دون أي تجزئة أو resolve() على خيط المراقب.
+
+        المسارات تأتي مطلقة من المراقب (المجلدات المراقبة محولة إلى مسارات مطلقة في AppConfig).
+        """
+        now = time.monotonic()
+        with self._pending_cond:
+            self.events_received += 1
+            entry = self._pending.get(event_src_path_str)
+            if entry is None:
+                self._pending[event_src_path_str] = [now, now, {event_type}]
+                self._pending_cond.notify()
+            else:
+                entry[1] = now
+                entry[2].add(event_type)
+
+    # حلقة خيط التحقق: مسار جاهز بعد فترة هدوء بلا أحداث، أو بعد EVENT_MAX_DELAY لملف يكتب باستمرار
+    def _event_loop(self):
+        while True:
+            with self._pending_cond:
+                while not self._event_stop:
+                    now = time.monotonic()
+                    due = [path for path, (first, last, _kinds) in self._pending.items()
+                           if now - last >= self.quiet_period or now - first >= self.max_event_delay]
+                    if due:
+                        break
+                    if self._pending:
+                        # الانتظار حتى أقرب مسار يصبح جاهزاً
+                        wake = min(min(last + self.quiet_period, first + self.max_event_delay)
+                                   for first, last, _kinds in self._pending.values())
+                        self._pending_cond.wait(max(0.01, wake - now))
+                    else:
+                        self._pending_cond.wait()
+                if self._event_stop:
+                    return
+                ready = [(path, self._pending.pop(path)[2]) for path in due]
+            for path, kinds in ready:
+                try:
+                    self._verify_path(path, kinds)
+                except Exception as e:
+                    self.logger.logger.error(f"FileMonitor: خطأ بالتحقق من {path} بعد الأحداث {sorted(kinds)}: {e}", exc_info=True)
+
+    # التحقق من مسار بعد دمج أحداثه: المقارنة بين الحالة المعروفة والحالة الفعلية على القرص
+    def _verify_path(self, path_str, kinds):
+        """يحول دفعة الأحداث إلى تغيير منطقي واحد: حذف، إنشاء، أو تعديل (يشمل الاستبدال بحذف ثم إنشاء أو rename)."""
+        event_file_path = Path(path_str)
+        self.logger.logger.debug(f"FileMonitor: أحداث {sorted(kinds)} لـ {event_file_path}") # تسجيل الأحداث للمراجعة
+        with self._lock:
+            self.verifications += 1
+            known = event_file_path in self.watched_files
+            exists = event_file_path.is_file()
+            if known and not exists:
+                event_type = 'deleted'
+            elif exists and not known:
+                event_type = 'created'
+            elif known:
+                event_type = 'modified'
+            else:
+                return # ملف مؤقت أنشئ وحذف خلال فترة الهدوء، أو ملف غير مراقب حذف
+            self._handle_event_locked(event_type, event_file_path)
+
+    def _handle_event_locked(self, event_type, event_file_path):
+        # ملف محدد في الإعدادات (أو جديد داخل شجرة/نمط مراقب) أنشئ أو أعيد إنشاؤه: يعود إلى قائمة المراقبة
+        if event_type == 'created' and (event_file_path in self.configured_files or self._in_scope(str(event_file_path))):
+            self.configured_files.add(event_file_path)
+            self.watched_files.add(event_file_path)
 
         # التحقق مما إذا كان الملف المتأثر هو أحد الملفات الحساسة التي نراقبها
         if event_file_path in self.watched_files:
-            # إذا كان الحدث تعديل
-            if event_type == 'modified':
-                 self._check_file_modification(event_file_path)
+            # إذا كان الحدث تعديل (أو تغيير خصائص قد يرافق تعديل المحتوى)
+            if event_type == 'modified' or event_type == 'attrib':
+                 if event_file_path in self.append_only_files:
+                     self._check_append_only(event_file_path)
+                 else:
+                     self._check_file_modification(event_file_path)
             # إذا كان الحدث حذف
             elif event_type == 'deleted':
                  self.logger.log_alert("HIDS_ALERT", f"حذف ملف حساس: {event_file_path}", "FileMonitor")
                  # إزالة الملف من قائمة التجزئات و قائمة المراقبة المحلية (لا يمكن مراقبته بعد حذفه)
                  if str(event_file_path) in self.file_hashes:
                       del self.file_hashes[str(event_file_path)]
+                 self.append_states.pop(str(event_file_path), None)
+                 self._forget_baseline(str(event_file_path))
                  self.watched_files.discard(event_file_path)
                  self.logger.logger.info(f"FileMonitor: تمت إزالة {event_file_path} من المراقبة.")
             # إذا كان الحدث إنشاء (في مجلد مراقب)
@@ -425,7 +2280,12 @@ class FileMonitor:
                 # يمكن استخدام هذا لاكتشاف إنشاء ملفات في مسارات حساسة.
                 self.logger.log_alert("HIDS_ALERT", f"إنشاء ملف في مسار حساس: {event_file_path}", "FileMonitor")
                 # حاول حساب التجزئة للملف الجديد وإضافته للقائمة المحلية لمراقبته إذا تم تعديله لاحقاً
-                new_hash = self._calculate_hash(event_file_path)
+                if event_file_path in self.append_only_files:
+                    new_hash = self._init_append_state(event_file_path)[0]
+                else:
+                    new_hash = self._calculate_hash(event_file_path)
+                    if new_hash:
+                        self._store_current_baseline(event_file_path, new_hash)
                 if new_hash:
                      self.file_hashes[str(event_file_path)] = new_hash
                      # يمكن إضافة الملف الجديد إلى self.watched_files هنا إذا أردنا مراقبة التغييرات عليه أيضاً
@@ -448,13 +2308,25 @@ class FileMonitor:
          if not event.is_directory: # تجاهل أحداث الحذف للمجلدات
              self._handle_event('deleted', event.src_path)
 
+    def _on_moved(self, event):
+         # الاستبدال بالكتابة إلى ملف مؤقت ثم rename: حذف للمصدر وإنشاء للوجهة
+         if not event.is_directory:
+             self._handle_event('deleted', event.src_path)
+             self._handle_event('created', event.dest_path)
+
     # التحقق من تعديل الملف بناءً على التجزئة
     def _check_file_modification(self, file_path_obj: Path):
         """يحسب تجزئة الملف الحالي ويقارنها بالتجزئة المخزنة."""
+        try:
+            st = file_path_obj.stat()
+        except OSError:
+            st = None
         current_hash = self._calculate_hash(file_path_obj)
         if current_hash is None:
             self.logger.logger.error(f"FileMonitor: لم يتمكن من حساب تجزئة للملف المعدل {file_path_obj}.")
             return # لا يمكن المتابعة بدون التجزئة
+        # تحديث خط الأساس المحفوظ (حتى لو لم يتغير المحتوى، لتبقى بيانات stat مطابقة عند إعادة التشغيل)
+        self._store_current_baseline(file_path_obj, current_hash, st)
 
         original_hash = self.file_hashes.get(str(file_path_obj))
 
@@ -473,7 +2345,11 @@ class FileMonitor:
 
     # إيقاف مراقب الملفات
     def stop(self):
-        """يوقف خيط مراقب الملفات التابع لـ watchdog."""
+        """يوقف خيط مراقب الملفات التابع لـ watchdog وخيط الفحص الدوري وخيط التحقق من الأحداث."""
+        self._scan_stop.set()
+        if self._scan_thread is not None:
+            self._scan_thread.join(timeout=5.0)
+            self._scan_thread = None
         if self.observer and self.observer.is_alive():
              self.logger.logger.info("FileMonitor: طلب إيقاف مراقب الملفات...")
              self.observer.stop() # إرسال طلب إيقاف
@@ -483,23 +2359,317 @@ class FileMonitor:
              else:
                  self.logger.logger.warning("FileMonitor: مراقب الملفات لم يتوقف ضمن المهلة المحددة.")
         self.observer = None # إعادة تعيين الكائن بعد الإيقاف
+        if self._event_thread is not None:
+            with self._pending_cond:
+                self._event_stop = True
+                dropped = len(self._pending)
+                self._pending.clear()
+                self._pending_cond.notify()
+            self._event_thread.join(timeout=5.0)
+            self._event_thread = None
+            self.logger.logger.info(f"FileMonitor: {self.events_received} حدث(ث) دمجت في {self.verifications} عملية تحقق"
+                                    f"{f' ({dropped} مسار(ات) بانتظار التحقق عند الإيقاف)' if dropped else ''}.")
+
+
+# --- مطابقة عدة نصوص حرفية دفعة واحدة (Aho-Corasick) ---
+class AhoCorasick:
+    """آلة Aho-Corasick لنصوص حرفية: تكلفة البحث تتناسب مع طول النص وليس عدد الأنماط."""
+
+    def __init__(self, patterns):
+        self.goto = [{}] # الحالة -> {الحرف: الحالة التالية}
+        self.fail = [0]
+        self.out = [None] # الحالة -> أول نمط ينتهي عندها (أو عبر روابط الفشل)
+        for pattern in patterns:
+            state = 0
+            for ch in pattern:
+                nxt = self.goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[state][ch] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append(None)
+                state = nxt
+            if self.out[state] is None:
+                self.out[state] = pattern
+        # بناء روابط الفشل بالعرض (BFS). حالات العمق الأول تفشل إلى الجذر
+        pending = list(self.goto[0].values())
+        for state in pending:
+            for ch, nxt in self.goto[state].items():
+                pending.append(nxt)
+                fallback = self.fail[state]
+                while fallback and ch not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[nxt] = self.goto[fallback].get(ch, 0)
+                if self.out[nxt] is None:
+                    self.out[nxt] = self.out[self.fail[nxt]]
+
+    def search(self, text):
+        """يعيد أول نمط يظهر في text أو None."""
+        goto, fail, out = self.goto, self.fail, self.out
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state] is not None:
+                return out[state]
+        return None
+
+
+# --- محرك مطابقة العمليات المشبوهة (الاسم، سطر الأوامر، مسار الملف التنفيذي، تجزئته) ---
+class ProcessMatcher:
+    """يجمع مؤشرات العمليات المشبوهة مرة واحدة عند البدء.
+
+    صيغة كل مدخل: 're:<تعبير نمطي>'، 'glob:<نمط>'، 'sub:<نص جزئي>'، أو نص بدون بادئة
+    (مطابقة تامة للاسم، نص جزئي لسطر الأوامر ومسار الملف التنفيذي). المطابقة غير حساسة لحالة الأحرف.
+    الأسماء التامة في مجموعة، والنصوص الجزئية في آلة Aho-Corasick واحدة، والأنماط والتعابير في تعبير نمطي
+    مجمع واحد بمجموعات مسماة لكل حقل، فلا تزيد تكلفة المطابقة بزيادة عدد المؤشرات الحرفية.
+    """
+    FIELDS = ('name', 'cmdline', 'exe')
+
+    def __init__(self, name_patterns=(), cmdline_patterns=(), exe_patterns=(), bad_hashes=()):
+        self.exact = {}     # الحقل -> مجموعة الأسماء التامة
+        self.literals = {}  # الحقل -> AhoCorasick
+        self.regexes = {}   # الحقل -> (تعبير مجمع، قائمة المدخلات الأصلية حسب رقم المجموعة)
+        self.invalid = []
+        self.count = 0
+        for field, entries in zip(self.FIELDS, (name_patterns, cmdline_patterns, exe_patterns)):
+            exact, literals, regex_parts, sources, group_names = set(), [], [], [], set()
+            for entry in entries:
+                kind, _, body = entry.partition(':')
+                kind = kind.lower()
+                if kind not in ('re', 'glob', 'sub') or not body:
+                    kind, body = ('exact' if field == 'name' else 'sub'), entry
+                if kind == 'exact':
+                    exact.add(body.lower())
+                elif kind == 'sub':
+                    literals.append(body.lower())
+                else:
+                    source = body if kind == 're' else r'\A' + fnmatch.translate(body)
+                    error = self._regex_error(source, len(sources), group_names)
+                    if error:
+                        self.invalid.append(f"{entry} ({error})")
+                        continue
+                    regex_parts.append(f"(?P<p{len(sources)}>{source})")
+                    sources.append(entry)
+                self.count += 1
+            if exact:
+                self.exact[field] = exact
+            if literals:
+                self.literals[field] = AhoCorasick(literals)
+            if regex_parts:
+                self.regexes[field] = (re.compile('|'.join(regex_parts), re.IGNORECASE | re.DOTALL), sources)
+        self.bad_hashes = {h.strip().lower() for h in bad_hashes if h.strip()}
+        self.count += len(self.bad_hashes)
+        self.needs_cmdline = 'cmdline' in self.literals or 'cmdline' in self.regexes
+        self.needs_exe = bool(self.bad_hashes) or 'exe' in self.literals or 'exe' in self.regexes
+        self._hash_cache = OrderedDict() # (dev, inode, mtime_ns, size) -> sha256
+        self._hash_cache_max = 4096
+
+    @staticmethod
+    def _regex_error(source, index, group_names):
+        """يتحقق من تعبير المستخدم قبل ضمه إلى التعبير المجمع كمجموعة (?P<p{index}>...). يعيد سبب الرفض أو None.
+
+        كل تعبير يترجم وحده أولاً. المراجع الخلفية (\\1، (?P=name)، (?(1)...)) ترفض لأن أرقام المجموعات
+        تتغير بعد الضم، وأسماء المجموعات pN محجوزة، والاسم المكرر بين تعبيرين في نفس الحقل يفشل الضم.
+        """
+        flags = re.IGNORECASE | re.DOTALL
+        try:
+            compiled = re.compile(source, flags)
+        except re.error as e:
+            return str(e)
+        i = 0
+        while i < len(source):
+            c = source[i]
+            if c == '\\':
+                if source[i + 1:i + 2].isdigit() and source[i + 1] != '0':
+                    return "المراجع الخلفية غير مدعومة"
+                i += 2
+                continue
+            if c == '[': # تخطي فئة الأحرف (\1 داخلها رمز ثماني وليس مرجعاً)
+                i += 1
+                if source[i:i + 1] == '^':
+                    i += 1
+                if source[i:i + 1] == ']':
+                    i += 1 # ']' في بداية الفئة حرف عادي
+                while i < len(source) and source[i] != ']':
+                    i += 2 if source[i] == '\\' else 1
+            elif source.startswith(('(?P=', '(?('), i):
+                return "المراجع الخلفية غير مدعومة"
+            i += 1
+        for name in compiled.groupindex:
+            if re.fullmatch(r'p\d+', name):
+                return f"اسم المجموعة {name} محجوز"
+            if name in group_names:
+                return f"اسم المجموعة {name} مكرر"
+        try:
+            re.compile(f"(?P<p{index}>{source})", flags) # الأعلام العامة مثل (?i) لا تصح داخل مجموعة
+        except re.error as e:
+            return str(e)
+        group_names.update(compiled.groupindex)
+        return None
+
+    def __bool__(self):
+        return self.count > 0
+
+    def match_field(self, field, value):
+        """يعيد المدخل المطابق للقيمة في الحقل المحدد أو None."""
+        if not value:
+            return None
+        lowered = value.lower()
+        if lowered in self.exact.get(field, ()):
+            return value
+        automaton = self.literals.get(field)
+        if automaton is not None:
+            found = automaton.search(lowered)
+            if found is not None:
+                return f"sub:{found}"
+        compiled = self.regexes.get(field)
+        if compiled is not None:
+            m = compiled[0].search(value)
+            if m is not None:
+                return compiled[1][int(m.lastgroup[1:])]
+        return None
+
+    def exe_hash(self, exe_path):
+        """يعيد SHA256 للملف التنفيذي مع ذاكرة مؤقتة بمفتاح (dev، inode، mtime، الحجم). None عند الفشل."""
+        try:
+            st = os.stat(exe_path)
+            key = (st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size)
+            digest = self._hash_cache.get(key)
+            if digest is None:
+                digest = hash_file(exe_path)
+                self._hash_cache[key] = digest
+                if len(self._hash_cache) > self._hash_cache_max:
+                    self._hash_cache.popitem(last=False)
+            else:
+                self._hash_cache.move_to_end(key)
+            return digest
+        except OSError:
+            return None
+
+    def match(self, name, cmdline=None, exe=None, check_name=True, exe_file=None):
+        """يعيد (الحقل، المؤشر المطابق) أو None. check_name=False لتخطي الأسماء (عملية في القائمة الموثوقة).
+        exe_file: المسار المستخدم لقراءة الملف التنفيذي عند التجزئة (افتراضياً exe)."""
+        if check_name:
+            found = self.match_field('name', name)
+            if found is not None:
+                return 'name', found
+        for field, value in (('cmdline', cmdline), ('exe', exe)):
+            found = self.match_field(field, value)
+            if found is not None:
+                return field, found
+        exe_file = exe_file or exe
+        if self.bad_hashes and exe_file:
+            digest = self.exe_hash(exe_file)
+            if digest in self.bad_hashes:
+                return 'sha256', digest
+        return None
+
+
+# --- اشتراك في أحداث العمليات من النواة عبر netlink proc connector (Linux) ---
+class ProcConnector:
+    """يستقبل أحداث exec/exit/comm للعمليات لحظة حدوثها بدلاً من المرور الدوري على كل العمليات.
+
+    يتطلب صلاحيات root (CAP_NET_ADMIN) ونواة مبنية بـ CONFIG_PROC_EVENTS.
+    """
+    NETLINK_CONNECTOR = 11
+    CN_IDX_PROC = 1
+    CN_VAL_PROC = 1
+    NLMSG_DONE = 3
+    PROC_CN_MCAST_LISTEN = 1
+    PROC_CN_MCAST_IGNORE = 2
+    PROC_EVENT_EXEC = 0x00000002
+    PROC_EVENT_COMM = 0x00000200
+    PROC_EVENT_EXIT = 0x80000000
+    NLMSG_HEADER = struct.Struct('=IHHII') # len, type, flags, seq, pid
+    CN_MSG = struct.Struct('=IIIIHH') # idx, val, seq, ack, len, flags
+    EVENT_HEADER = struct.Struct('=IIQ') # what, cpu, timestamp_ns
+    EVENT_IDS = struct.Struct('=II') # process_pid, process_tgid (أول حقلين في exec/exit/comm)
+    EVENT_OFFSET = NLMSG_HEADER.size + CN_MSG.size
+
+    def __init__(self):
+        self.sock = None
+
+    def _send_op(self, op):
+        payload = self.CN_MSG.pack(self.CN_IDX_PROC, self.CN_VAL_PROC, 0, 0, 4, 0) + struct.pack('=I', op)
+        self.sock.send(self.NLMSG_HEADER.pack(self.NLMSG_HEADER.size + len(payload), self.NLMSG_DONE, 0, 0, 0) + payload)
+
+    def open(self):
+        """ينشئ مقبس netlink ويشترك في مجموعة أحداث العمليات. يرفع OSError إذا لم يكن متاحاً."""
+        if not hasattr(socket, 'AF_NETLINK'):
+            raise OSError("netlink غير متاح على هذا النظام")
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, self.NETLINK_CONNECTOR)
+        try:
+            self.sock.bind((0, self.CN_IDX_PROC))
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+            self._send_op(self.PROC_CN_MCAST_LISTEN)
+        except OSError:
+            self.close()
+            raise
+
+    def read_events(self, timeout=1.0):
+        """ينتظر حتى timeout ويعيد قائمة (what, pid, tgid). يرفع OSError(ENOBUFS) إذا فقدت أحداث لامتلاء المخزن."""
+        if not select.select([self.sock], [], [], timeout)[0]:
+            return []
+        data = self.sock.recv(65536)
+        events = []
+        offset = 0
+        while offset + self.EVENT_OFFSET + self.EVENT_HEADER.size + self.EVENT_IDS.size <= len(data):
+            msg_len = self.NLMSG_HEADER.unpack_from(data, offset)[0]
+            what = self.EVENT_HEADER.unpack_from(data, offset + self.EVENT_OFFSET)[0]
+            pid, tgid = self.EVENT_IDS.unpack_from(data, offset + self.EVENT_OFFSET + self.EVENT_HEADER.size)
+            events.append((what, pid, tgid))
+            if msg_len <= 0: break
+            offset += (msg_len + 3) & ~3 # محاذاة NLMSG_ALIGN
+        return events
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                self._send_op(self.PROC_CN_MCAST_IGNORE)
+            except OSError:
+                pass
+            self.sock.close()
+            self.sock = None
 
 
 # --- فئة لمراقبة العمليات (HIDS) ---
 class ProcessMonitor:
+    # كل كم دورة فحص دوري يعاد تقييم كل العمليات (وليس الجديدة فقط)
+    FULL_RECHECK_PASSES = 20
+
     def __init__(self, logger_instance, config_obj):
         self.logger = logger_instance # كائن Logger
         self.config = config_obj # كائن Configuration
         self.running = threading.Event() # Event للتحكم في حلقة المراقبة (بدء/إيقاف)
+        self._stop_event = threading.Event() # للانتظار بين الفحوص الدورية (الانتظار على running المضبوطة يعود فوراً)
+        self.connector = None # ProcConnector عند استخدام أحداث netlink
         self.monitor_thread = None # خيط التشغيل الخاص بالمراقبة
-        self.alerted_pids = set() # مجموعة لتتبع PIDs العمليات التي تم التنبيه عليها بالفعل لتجنب التكرار المستمر
+        # العمليات التي تم التنبيه عليها بالفعل لتجنب التكرار المستمر، بمفتاح (PID، وقت البدء)
+        # حتى لا تمنع عملية قديمة التنبيه على عملية جديدة أعيد استخدام رقمها
+        self.alerted_procs = set()
+        # العمليات المصنفة مسبقاً: PID -> (رقم inode لمجلد /proc/PID، وقت البدء بالـ ticks)
+        # الفحص الدوري يقرأ /proc كاملاً مرة واحدة ولا يفحص إلا العمليات الجديدة
+        self.classified = {}
+        self._usernames = {} # ذاكرة uid -> اسم المستخدم
+        self._passes = 0
+        self.use_proc_fs = platform.system() == 'Linux' and os.path.isdir('/proc')
 
         # قراءة قوائم العمليات المشبوهة والموثوقة من الإعدادات (تحويلها إلى مجموعة حروف صغيرة)
         suspicious_str = self.config.get('HIDS', 'SUSPICIOUS_PROCS', fallback='')
         whitelist_str = self.config.get('HIDS', 'WHITELIST_PROCS', fallback='')
-        self.suspicious_procs = {p.strip().lower() for p in suspicious_str.split(',') if p.strip()}
         self.whitelist_procs = {p.strip().lower() for p in whitelist_str.split(',') if p.strip()}
 
+        # مؤشرات سطر الأوامر ومسار الملف التنفيذي وتجزئات الملفات التنفيذية الضارة
+        cmdline_patterns = self._split_indicators(self.config.get('HIDS', 'SUSPICIOUS_CMDLINES', fallback=''))
+        exe_patterns = self._split_indicators(self.config.get('HIDS', 'SUSPICIOUS_EXES', fallback=''))
+        bad_hashes = self._load_hashes(self.config.get('HIDS', 'SUSPICIOUS_EXE_HASHES_FILE', fallback='').strip())
+        self.matcher = ProcessMatcher(self._split_indicators(suspicious_str), cmdline_patterns, exe_patterns, bad_hashes)
+        for entry in self.matcher.invalid:
+            self.logger.logger.error(f"ProcessMonitor: نمط غير صالح تم تجاهله: {entry}")
+
         # قراءة الفاصل الزمني للفحص
         try:
              self.check_interval = self.config.getint('HIDS', 'PROCESS_CHECK_INTERVAL', fallback=20)
@@ -508,29 +2678,218 @@ class ProcessMonitor:
              self.logger.logger.error("ProcessMonitor: قيمة 'PROCESS_CHECK_INTERVAL' في [HIDS] يجب أن تكون عدد صحيح موجب. استخدام القيمة الافتراضية 20.")
              self.check_interval = 20
 
-        self.logger.logger.info(f"ProcessMonitor: تهيئة. مشبوه: {len(self.suspicious_procs)}, موثوق: {len(self.whitelist_procs)}. الفاصل الزمني: {self.check_interval} ثواني.")
+        # آلية المراقبة: auto (أحداث netlink إن توفرت)، netlink، أو polling (الفحص الدوري)
+        self.backend = self.config.get('HIDS', 'PROCESS_MONITOR_BACKEND', fallback='auto').strip().lower() or 'auto'
+        if self.backend not in ('auto', 'netlink', 'polling'):
+            self.logger.logger.error(f"ProcessMonitor: قيمة 'PROCESS_MONITOR_BACKEND' في [HIDS] غير معروفة ({self.backend}). استخدام auto.")
+            self.backend = 'auto'
+
+        self.logger.logger.info(f"ProcessMonitor: تهيئة. مؤشرات: {self.matcher.count}, موثوق: {len(self.whitelist_procs)}. الفاصل الزمني: {self.check_interval} ثواني.")
+
+    @staticmethod
+    def _split_indicators(value):
+        """القيمة متعددة الأسطر تقسم بالأسطر (حتى تحتوي التعابير النمطية على فواصل)، وإلا بالفواصل."""
+        parts = value.splitlines() if '\n' in value.strip() else value.split(',')
+        return [p.strip() for p in parts if p.strip()]
+
+    def _load_hashes(self, path):
+        """يقرأ تجزئات SHA256 (واحدة في كل سطر، # للتعليقات). يعيد قائمة فارغة عند عدم التحديد أو الخطأ."""
+        if not path:
+            return []
+        hashes = []
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    value = line.split('#', 1)[0].strip().lower()
+                    if not value:
+                        continue
+                    if len(value) != 64 or any(c not in '0123456789abcdef' for c in value):
+                        self.logger.logger.warning(f"ProcessMonitor: سطر غير صالح في {path}: {value[:80]}")
+                        continue
+                    hashes.append(value)
+        except OSError as e:
+            self.logger.logger.error(f"ProcessMonitor: تعذر قراءة ملف التجزئات '{path}': {e}")
+        return hashes
+
+    # قراءة اسم العملية ووقت بدئها من /proc/PID/stat (قراءة واحدة، أسرع من psutil)
+    @staticmethod
+    def _read_stat(pid):
+        """يعيد (الاسم، وقت البدء بالـ ticks) أو None إذا انتهت العملية.
 
-    # دالة فحص العمليات
+        الاسم في stat مقطوع إلى 15 حرفاً فيكمل من psutil عند الحاجة.
+        """
+        try:
+            with open(f'/proc/{pid}/stat', 'rb') as f:
+                data = f.read()
+            end = data.rfind(b')')
+            name = data[data.find(b'(') + 1:end].decode('utf-8', 'replace')
+            start_time = int(data[end + 2:].split(None, 20)[19]) # الحقل 22: starttime
+            if len(name) >= 15:
+                name = psutil.Process(pid).name()
+            return name, start_time
+        except (OSError, ValueError, IndexError, psutil.Error):
+            return None
+
+    # تحويل uid إلى اسم مستخدم مع ذاكرة مؤقتة
+    def _username(self, pid):
+        try:
+            uid = os.stat(f'/proc/{pid}').st_uid
+        except OSError:
+            return 'N/A'
+        username = self._usernames.get(uid)
+        if username is None:
+            try:
+                username = pwd.getpwuid(uid).pw_name if pwd else str(uid)
+            except KeyError:
+                username = str(uid)
+            self._usernames[uid] = username
+        return username
+
+    # تقييم عملية واحدة (عملية جديدة، أو exec، أو تغيير الاسم)
+    def _check_pid(self, pid, stat_info=None):
+        """يعيد وقت بدء العملية (أو None إذا انتهت) بعد التنبيه عليها إن كان اسمها مشبوهاً."""
+        stat_info = stat_info or self._read_stat(pid)
+        if stat_info is None:
+            return None # انتهت العملية قبل قراءة اسمها
+        name, start_time = stat_info
+        if (pid, start_time) in self.alerted_procs:
+            return start_time
+        cmdline = exe = None
+        if self.matcher.needs_cmdline:
+            try:
+                with open(f'/proc/{pid}/cmdline', 'rb') as f:
+                    cmdline = f.read().rstrip(b'\0').replace(b'\0', b' ').decode('utf-8', 'replace')
+            except OSError:
+                pass
+        if self.matcher.needs_exe:
+            try:
+                exe = os.readlink(f'/proc/{pid}/exe')
+            except OSError:
+                pass # خيوط النواة أو عملية لا يمكن الوصول إليها
+        self._report_match(pid, start_time, name, cmdline, exe, self._username)
+        return start_time
+
+    def _report_match(self, pid, key, name, cmdline, exe, username):
+        """يطابق العملية مع المؤشرات وينبه مرة واحدة. الأسماء الموثوقة تتخطى مطابقة الاسم فقط،
+        فيبقى سطر الأوامر والمسار والتجزئة فعالة (مثل python3 -c 'import pty...')."""
+        METRIC_PROCESS_CHECKED.inc()
+        check_name = name.lower() not in self.whitelist_procs
+        # التجزئة تقرأ عبر /proc/PID/exe حتى لو حذف الملف التنفيذي أو استبدل بعد التشغيل
+        exe_file = f'/proc/{pid}/exe' if self.use_proc_fs and exe else exe
+        found = self.matcher.match(name, cmdline, exe, check_name, exe_file)
+        if found is None:
+            return
+        field, indicator = found
+        user = username(pid) if callable(username) else username
+        self.logger.log_alert('HIDS_ALERT', f"عملية مشبوهة: {name} (PID:{pid}, User:{user}) — تطابق {field}: {indicator}"
+                              f"{f' ({exe})' if exe and field != 'exe' else ''}", 'ProcessMonitor')
+        self.alerted_procs.add((pid, key))
+
+    # الفحص التزايدي: قراءة قائمة /proc وفحص العمليات الجديدة فقط
+    def _check_processes_incremental(self):
+        """يقرأ مجلد /proc بـ scandir. العملية المعروفة بنفس رقم inode لمجلدها لا تقرأ إطلاقاً، والجديدة
+        (أو التي تغير inode مجلدها) تقرأ /proc/PID/stat لها مرة واحدة لمعرفة وقت بدئها واسمها.
+
+        كل FULL_RECHECK_PASSES دورة يعاد تقييم كل العمليات (لاكتشاف exec داخل عملية معروفة دون netlink).
+        """
+        self._passes += 1
+        full = self._passes % self.FULL_RECHECK_PASSES == 0
+        seen = {}
+        try:
+            with os.scandir('/proc') as entries:
+                for entry in entries:
+                    if not entry.name.isdigit():
+                        continue
+                    pid = int(entry.name)
+                    inode = entry.inode()
+                    known = self.classified.get(pid)
+                    if known is not None and known[0] == inode and not full:
+                        seen[pid] = known
+                        continue
+                    stat_info = self._read_stat(pid)
+                    if stat_info is None:
+                        continue # انتهت العملية
+                    if known is not None and known[1] == stat_info[1] and not full:
+                        seen[pid] = (inode, known[1]) # نفس العملية (أعيد إنشاء inode مجلدها في ذاكرة النواة)
+                        continue
+                    self._check_pid(pid, stat_info)
+                    seen[pid] = (inode, stat_info[1])
+        except OSError as e:
+            self.logger.logger.error(f"ProcessMonitor: خطأ بقراءة /proc: {e}")
+            return
+        METRIC_PROCESS_SCANNED.inc(len(seen))
+        self.classified = seen
+        # إزالة العمليات المنتهية من قائمة التنبيهات (حتى لا تنمو بلا نهاية)
+        self.alerted_procs = {key for key in self.alerted_procs if seen.get(key[0], (None, None))[1] == key[1]}
+
+    # حلقة أحداث netlink: تكلفة تتناسب مع معدل تشغيل العمليات وليس عددها
+    def _netlink_loop(self):
+        """يقيم كل عملية لحظة exec (أو تغيير اسمها) ويزيل PID من قائمة التنبيهات عند انتهائها."""
+        self.logger.logger.info("ProcessMonitor: بدء حلقة أحداث العمليات (netlink proc connector)...")
+        self._check_processes() # فحص أولي للعمليات التي كانت تعمل قبل الاشتراك
+        exec_events = (ProcConnector.PROC_EVENT_EXEC, ProcConnector.PROC_EVENT_COMM)
+        while self.running.is_set():
+            try:
+                events = self.connector.read_events(timeout=1.0)
+            except OSError as e:
+                if e.errno == errno.ENOBUFS:
+                    # فقدت أحداث (ذروة تشغيل عمليات): إعادة المزامنة بفحص كامل
+                    self.logger.logger.warning("ProcessMonitor: فقدت أحداث عمليات (امتلاء مخزن netlink). إعادة فحص كل العمليات.")
+                    self._check_processes()
+                    continue
+                if not self.running.is_set():
+                    break
+                self.logger.logger.error(f"ProcessMonitor: خطأ بقراءة أحداث netlink ({e}). العودة إلى الفحص الدوري.")
+                self.connector.close()
+                self.connector = None
+                self._poll_loop()
+                return
+            for what, pid, tgid in events:
+                if pid != tgid:
+                    continue # أحداث الخيوط (threads) وليس العمليات
+                if what in exec_events:
+                    stat_info = self._read_stat(pid)
+                    if stat_info is not None:
+                        self._check_pid(pid, stat_info)
+                        self.classified[pid] = (None, stat_info[1])
+                elif what == ProcConnector.PROC_EVENT_EXIT:
+                    known = self.classified.pop(pid, None)
+                    if known is not None:
+                        self.alerted_procs.discard((pid, known[1]))
+        self.logger.logger.info("ProcessMonitor: إيقاف حلقة أحداث العمليات.")
+
+    # دالة فحص العمليات (مع قياس مدة الدورة)
     def _check_processes(self):
+        start = time.perf_counter()
+        try:
+            self._scan_processes()
+        finally:
+            METRIC_PROCESS_SCAN_SECONDS.observe(time.perf_counter() - start)
+
+    def _scan_processes(self):
         """تفحص العمليات الجارية بحثاً عن أسماء مشبوهة ليست في القائمة الموثوقة."""
-        current_pids = set() # مجموعة لتخزين الـ PIDs الحالية للعمليات المفحوصة
+        if self.use_proc_fs:
+            self._check_processes_incremental()
+            return
+        current_procs = set() # مجموعة لتخزين (PID، وقت البدء) للعمليات المفحوصة
         try:
-            # المرور على جميع العمليات الجارية باستخدام psutil
-            for proc in psutil.process_iter(['pid', 'name', 'username']):
+            # المرور على جميع العمليات الجارية باستخدام psutil (الأنظمة بدون /proc)
+            attrs = ['pid', 'name', 'username', 'create_time']
+            if self.matcher.needs_cmdline:
+                attrs.append('cmdline')
+            if self.matcher.needs_exe:
+                attrs.append('exe')
+            for proc in psutil.process_iter(attrs):
                 try:
                     pid = proc.info['pid']
-                    name = proc.info['name'].lower() # اسم العملية بحروف صغيرة
-                    current_pids.add(pid) # إضافة الـ PID الحالي لقائمة العمليات الجارية
-
-                    # التحقق: إذا كان الاسم مشبوه + ليس موثوق + لم يتم التنبيه عليه مسبقاً بهذا الـ PID
-                    if name in self.suspicious_procs and name not in self.whitelist_procs and pid not in self.alerted_pids:
-                        # سجل التنبيه
-                        self.logger.log_alert(
-                            'HIDS_ALERT',
-                            f"عملية مشبوهة: {proc.info['name']} (PID:{pid}, User:{proc.info.get('username','N/A')})",
-                            'ProcessMonitor'
-                        )
-                        self.alerted_pids.add(pid) # إضافة الـ PID إلى قائمة التنبيهات المسجلة
+                    key = (pid, proc.info['create_time'])
+                    current_procs.add(key) # إضافة العملية لقائمة العمليات الجارية
+
+                    # التحقق: إذا طابقت العملية أحد المؤشرات + لم يتم التنبيه على نفس العملية مسبقاً
+                    if key not in self.alerted_procs:
+                        cmdline = ' '.join(proc.info.get('cmdline') or ()) or None
+                        self._report_match(pid, key[1], proc.info['name'] or '', cmdline, proc.info.get('exe'),
+                                           proc.info.get('username') or 'N/A')
 
                 # معالجة الأخطاء المحتملة أثناء الوصول لمعلومات العملية
                 except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
@@ -538,11 +2897,12 @@ class ProcessMonitor:
                 except Exception as e:
                      self.logger.logger.error(f"ProcessMonitor: خطأ بمعالجة PID {getattr(proc,'pid','UKN')}: {e}")
 
+            METRIC_PROCESS_SCANNED.inc(len(current_procs))
             # إزالة الـ PIDs التي لم تعد موجودة من قائمة التنبيهات المسجلة
             # (حتى لا تنمو القائمة بلا نهاية)
-            pids_to_remove = self.alerted_pids - current_pids
-            if pids_to_remove:
-                 self.alerted_pids.difference_update(pids_to_remove)
+            procs_to_remove = self.alerted_procs - current_procs
+            if procs_to_remove:
+                 self.alerted_procs.difference_update(procs_to_remove)
                  # self.logger.logger.debug(f"ProcessMonitor: تمت إزالة PIDs من قائمة التنبيهات المسجلة: {list(pids_to_remove)}") # اختياري للتصحيح
 
         except Exception as e:
@@ -551,25 +2911,41 @@ class ProcessMonitor:
 
     # حلقة مراقبة العمليات التي تعمل في خيط منفصل
     def _monitor_loop(self):
-        """الحلقة الرئيسية لفحص العمليات بشكل دوري."""
+        """الحلقة الرئيسية: أحداث netlink إن كانت مفعلة، وإلا الفحص الدوري."""
+        if self.connector is not None:
+            self._netlink_loop()
+        else:
+            self._poll_loop()
+
+    def _poll_loop(self):
+        """فحص العمليات بشكل دوري."""
         self.logger.logger.info("ProcessMonitor: بدء حلقة مراقبة العمليات...")
         # تستمر الحلقة طالما أن 'running' Event مضبوطة
         while self.running.is_set():
             self._check_processes() # نفذ فحص العمليات
-            # انتظر الفاصل الزمني المحدد أو استيقظ فوراً إذا تم مسح 'running' Event
-            self.running.wait(self.check_interval)
+            # انتظر الفاصل الزمني المحدد أو استيقظ فوراً عند طلب الإيقاف
+            self._stop_event.wait(self.check_interval)
         self.logger.logger.info("ProcessMonitor: إيقاف حلقة مراقبة العمليات.")
 
     # بدء خيط مراقبة العمليات
     def start(self):
         """يبدأ خيط مراقبة العمليات إذا لم يكن يعمل بالفعل."""
-        if not self.suspicious_procs:
-            self.logger.logger.warning("ProcessMonitor: قائمة العمليات المشبوهة فارغة. لن يتم بدء مراقب العمليات.")
+        if not self.matcher:
+            self.logger.logger.warning("ProcessMonitor: قوائم مؤشرات العمليات المشبوهة فارغة. لن يتم بدء مراقب العمليات.")
             return # لا يوجد عمليات مشبوهة لمراقبتها
 
         # التحقق مما إذا كان الخيط غير موجود أو لا يعمل
         if self.monitor_thread is None or not self.monitor_thread.is_alive():
+            if self.backend in ('auto', 'netlink'):
+                connector = ProcConnector()
+                try:
+                    connector.open()
+                    self.connector = connector
+                    self.logger.logger.info("ProcessMonitor: استخدام أحداث العمليات من النواة (netlink proc connector).")
+                except OSError as e:
+                    self.logger.logger.warning(f"ProcessMonitor: netlink proc connector غير متاح ({e}). العودة إلى الفحص الدوري كل {self.check_interval} ثانية.")
             self.running.set() # ضبط Event لبدء الحلقة
+            self._stop_event.clear()
             # إنشاء الخيط وتحديد الدالة الهدف واسم الخيط وجعله Daemon (يتوقف عند إغلاق البرنامج الرئيسي)
             self.monitor_thread = threading.Thread(target=self._monitor_loop, name="ProcessMonitorThread", daemon=True)
             self.monitor_thread.start() # بدء الخيط
@@ -581,6 +2957,7 @@ class ProcessMonitor:
         if self.monitor_thread and self.monitor_thread.is_alive():
             self.logger.logger.info("ProcessMonitor: طلب إيقاف خيط مراقبة العمليات...")
             self.running.clear() # مسح Event لإنهاء حلقة المراقبة
+            self._stop_event.set() # إيقاظ الحلقة من الانتظار
             # الانتظار حتى ينتهي الخيط (بمهلة للسماح له بإنهاء دورته الحالية)
             self.monitor_thread.join(timeout=self.check_interval + 5)
             if not self.monitor_thread.is_alive():
@@ -588,43 +2965,1531 @@ class ProcessMonitor:
             else:
                 self.logger.logger.warning("ProcessMonitor: خيط مراقبة العمليات لم يتوقف ضمن المهلة المحددة.")
         self.monitor_thread = None # إعادة تعيين الكائن بعد الإيقاف
+        if self.connector is not None:
+            self.connector.close()
+            self.connector = None
+
+
+# --- تتبع سجل المصادقة (auth.log) وكشف تخمين كلمات المرور (HIDS) ---
+class _AuthSource:
+    """حالة مصدر واحد (عنوان IP أو مستخدم sudo): أوقات آخر المحاولات فقط، بحجم ثابت لكل مصدر."""
+    __slots__ = ('failures', 'invalid', 'alerted', 'last_user')
+
+    def __init__(self, failure_threshold, invalid_threshold):
+        self.failures = deque(maxlen=failure_threshold) # أوقات آخر محاولات فاشلة
+        self.invalid = deque(maxlen=invalid_threshold) # أوقات آخر محاولات بأسماء مستخدمين غير موجودة
+        self.alerted = {} # نوع التنبيه -> وقت آخر تنبيه (تنبيه واحد لكل نافذة)
+        self.last_user = None
+
+
+class AuthLogMonitor:
+    """يتتبع سجل المصادقة سطراً سطراً (إزاحة القراءة + إيقاظ inotify) ويكشف تخمين كلمات مرور SSH و sudo.
+
+    يتحمل تدوير السجل (logrotate): تغير inode المسار يعني قراءة ما تبقى من الملف القديم ثم فتح الجديد من بدايته،
+    وتقلص الحجم (copytruncate) يعني القراءة من البداية. لكل مصدر deque بطول الحد فقط، والمصادر محدودة بـ
+    MAX_SOURCES (الأقدم نشاطاً يحذف أولاً)، فالذاكرة ثابتة مهما كان حجم الهجوم.
+    """
+    CHUNK_SIZE = 1024 * 1024
+    MAX_LINE_BYTES = 64 * 1024 # سطر أطول من ذلك بدون نهاية يحذف (حماية الذاكرة)
+    MONTHS = {m: i for i, m in enumerate(('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+                                          'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'), 1)}
+    # sshd (و sshd-session في OpenSSH الحديث)، مع أسطر "message repeated N times" من rsyslog
+    SSHD_RE = re.compile(
+        r'(?:message repeated (?P<repeat>\d+) times: \[ )?'
+        r'(?:(?P<result>Failed|Accepted) (?P<method>\S+) for (?P<invalid>invalid user )?(?P<user>.*?)'
+        r'|Invalid user (?P<iuser>.*?)) from (?P<ip>[0-9A-Fa-f:.]+) port \d+')
+    SUDO_RE = re.compile(
+        r'sudo(?:\[\d+\])?:\s+(?P<user>\S+) : (?:(?P<count>\d+) incorrect password attempts?|(?P<denied>user NOT in sudoers))')
+
+    def __init__(self, logger_instance, config_obj):
+        self.logger = logger_instance
+        self.config = config_obj
+        self.path = self.config.get('HIDS', 'AUTHLOG_FILE', fallback='').strip()
+        try:
+            self.window = self.config.getfloat('HIDS', 'AUTHLOG_WINDOW', fallback=60)
+            self.failure_threshold = self.config.getint('HIDS', 'AUTHLOG_FAILURE_THRESHOLD', fallback=5)
+            self.invalid_threshold = self.config.getint('HIDS', 'AUTHLOG_INVALID_USER_THRESHOLD', fallback=3)
+            self.sudo_threshold = self.config.getint('HIDS', 'AUTHLOG_SUDO_FAILURE_THRESHOLD', fallback=3)
+            self.max_sources = self.config.getint('HIDS', 'AUTHLOG_MAX_SOURCES', fallback=10000)
+            self.poll_interval = self.config.getfloat('HIDS', 'AUTHLOG_POLL_INTERVAL', fallback=1.0)
+            if min(self.window, self.failure_threshold, self.invalid_threshold, self.sudo_threshold,
+                   self.max_sources, self.poll_interval) <= 0:
+                raise ValueError
+        except ValueError:
+            self.logger.logger.error("AuthLogMonitor: قيم AUTHLOG_* في [HIDS] يجب أن تكون أعداداً موجبة. استخدام القيم الافتراضية.")
+            self.window, self.failure_threshold, self.invalid_threshold, self.sudo_threshold = 60, 5, 3, 3
+            self.max_sources, self.poll_interval = 10000, 1.0
+        self.sources = OrderedDict() # المفتاح ('ssh', IP) أو ('sudo', مستخدم) -> _AuthSource
+        self.running = threading.Event()
+        self._wake = threading.Event()
+        self.thread = None
+        self.watcher = None
+        self._file = None
+        self._ident = None # (الجهاز، inode) للملف المفتوح
+        self._partial = b'' # بقية سطر لم يكتمل بعد
+        self._last_prefix = None # الطابع الزمني الأخير (يتكرر لكل الأسطر في نفس الثانية)
+        self._last_time = 0.0
+        self.lines = self.bytes_read = self.alerts = self.rotations = self.evicted = 0
+
+    # --- الطابع الزمني للسطر ---
+    def _line_time(self, line):
+        """يحول الطابع الزمني في بداية السطر (syslog التقليدي أو ISO 8601) إلى ثوان. يعيد الوقت الحالي عند الفشل."""
+        iso = line[4:5] == '-' and line[10:11] == 'T'
+        prefix = line[:19] if iso else line[:15]
+        if prefix == self._last_prefix:
+            return self._last_time
+        try:
+            if iso:
+                # المنطقة الزمنية لا تهم (الفروق فقط تستخدم في النافذة)
+                value = time.mktime((int(prefix[:4]), int(prefix[5:7]), int(prefix[8:10]),
+                                     int(prefix[11:13]), int(prefix[14:16]), int(prefix[17:19]), 0, 0, -1))
+            else:
+                now = time.time()
+                value = time.mktime((time.localtime(now).tm_year, self.MONTHS[prefix[:3]], int(prefix[4:6]),
+                                     int(prefix[7:9]), int(prefix[10:12]), int(prefix[13:15]), 0, 0, -1))
+                if value > now + 86400: # سجل من نهاية السنة السابقة (syslog التقليدي بدون سنة)
+                    value = time.mktime((time.localtime(now).tm_year - 1, self.MONTHS[prefix[:3]], int(prefix[4:6]),
+                                         int(prefix[7:9]), int(prefix[10:12]), int(prefix[13:15]), 0, 0, -1))
+        except (KeyError, ValueError, OverflowError):
+            return time.time()
+        self._last_prefix, self._last_time = prefix, value
+        return value
+
+    # --- حالة المصادر ---
+    def _source(self, key):
+        state = self.sources.get(key)
+        if state is None:
+            if len(self.sources) >= self.max_sources:
+                self.sources.popitem(last=False) # المصدر الأقدم نشاطاً
+                self.evicted += 1
+            threshold = self.sudo_threshold if key[0] == 'sudo' else self.failure_threshold
+            state = self.sources[key] = _AuthSource(threshold, self.invalid_threshold)
+        else:
+            self.sources.move_to_end(key)
+        return state
+
+    def _record(self, attempts, ts, count):
+        """يضيف count محاولة ويعيد True إذا بلغ عدد المحاولات الحد خلال النافذة."""
+        attempts.extend(repeat(ts, min(count, attempts.maxlen)))
+        return len(attempts) == attempts.maxlen and ts - attempts[0] <= self.window
+
+    def _alert(self, state, kind, ts, message):
+        last = state.alerted.get(kind)
+        if last is not None and ts - last < self.window:
+            return
+        state.alerted[kind] = ts
+        self.alerts += 1
+        self.logger.log_alert('HIDS_ALERT', message, 'AuthLogMonitor')
+
+    # --- تحليل الأسطر ---
+    def process_lines(self, lines):
+        """يحلل أسطر السجل المضافة. فحص نصي سريع قبل التعبير النمطي لأن معظم الأسطر ليست من sshd/sudo."""
+        sshd_search = self.SSHD_RE.search
+        sudo_search = self.SUDO_RE.search
+        for line in lines:
+            if 'sshd' in line:
+                m = sshd_search(line)
+                if m is None:
+                    continue
+                ip = m.group('ip')
+                ts = self._line_time(line)
+                count = int(m.group('repeat') or 1)
+                state = self._source(('ssh', ip))
+                result = m.group('result')
+                if result == 'Failed':
+                    state.last_user = m.group('user')
+                    if self._record(state.failures, ts, count):
+                        self._alert(state, 'brute_force', ts,
+                                    f"هجوم تخمين كلمات مرور SSH من {ip}: {self.failure_threshold}+ محاولة فاشلة خلال "
+                                    f"{self.window:g} ثانية (آخر مستخدم: {state.last_user}، الطريقة: {m.group('method')})")
+                elif result == 'Accepted':
+                    last = state.alerted.get('brute_force')
+                    if last is not None and ts - last <= self.window:
+                        self._alert(state, 'login_after_brute_force', ts,
+                                    f"دخول SSH ناجح من {ip} بعد هجوم تخمين كلمات مرور: المستخدم {m.group('user')} "
+                                    f"(الطريقة: {m.group('method')})")
+                else: # Invalid user
+                    state.last_user = m.group('iuser')
+                    if self._record(state.invalid, ts, count):
+                        self._alert(state, 'invalid_users', ts,
+                                    f"محاولات SSH بأسماء مستخدمين غير موجودة من {ip}: {self.invalid_threshold}+ خلال "
+                                    f"{self.window:g} ثانية (آخر اسم: {state.last_user})")
+            elif 'sudo' in line:
+                m = sudo_search(line)
+                if m is None:
+                    continue
+                user = m.group('user')
+                ts = self._line_time(line)
+                state = self._source(('sudo', user))
+                if m.group('denied'):
+                    self._alert(state, 'not_in_sudoers', ts, f"محاولة sudo من مستخدم غير مصرح له: {user}")
+                elif self._record(state.failures, ts, int(m.group('count'))):
+                    self._alert(state, 'sudo_brute_force', ts,
+                                f"كلمات مرور sudo خاطئة متكررة للمستخدم {user}: {self.sudo_threshold}+ خلال {self.window:g} ثانية")
+        self.lines += len(lines)
+
+    # --- تتبع الملف ---
+    def _open(self, from_end):
+        f = open(self.path, 'rb')
+        st = os.fstat(f.fileno())
+        if from_end:
+            f.seek(0, os.SEEK_END)
+        self._file, self._ident, self._partial = f, (st.st_dev, st.st_ino), b''
+
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _read_available(self):
+        """يقرأ من الإزاحة الحالية حتى نهاية الملف بدفعات ويحلل الأسطر المكتملة فقط."""
+        while True:
+            chunk = self._file.read(self.CHUNK_SIZE)
+            if not chunk:
+                return
+            self.bytes_read += len(chunk)
+            data = self._partial + chunk if self._partial else chunk
+            end = data.rfind(b'\n')
+            if end < 0:
+                self._partial = data if len(data) <= self.MAX_LINE_BYTES else b''
+                continue
+            self._partial = data[end + 1:]
+            if len(self._partial) > self.MAX_LINE_BYTES:
+                self._partial = b''
+            self.process_lines(data[:end].decode('utf-8', 'replace').split('\n'))
+
+    def _drain(self):
+        """يقرأ كل ما أضيف منذ آخر قراءة ويتعامل مع التدوير والاقتطاع."""
+        if self._file is None:
+            try:
+                self._open(from_end=False) # الملف ظهر (أو أعيد إنشاؤه) بعد البدء: قراءته كاملاً
+            except OSError:
+                return
+        self._read_available()
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return # تم نقل الملف ولم ينشأ الجديد بعد: نستمر بالقديم
+        if (st.st_dev, st.st_ino) != self._ident:
+            # تدوير: ما تبقى في القديم قرئ أعلاه، والسطر غير المكتمل في نهايته يحلل كما هو
+            if self._partial:
+                self.process_lines([self._partial.decode('utf-8', 'replace')])
+            self._close()
+            self.rotations += 1
+            self.logger.logger.info(f"AuthLogMonitor: تم تدوير {self.path}. متابعة القراءة من بداية الملف الجديد.")
+            try:
+                self._open(from_end=False)
+            except OSError:
+                return
+            self._read_available()
+        elif st.st_size < self._file.tell():
+            # اقتطاع (copytruncate)
+            self.logger.logger.info(f"AuthLogMonitor: تم اقتطاع {self.path}. متابعة القراءة من البداية.")
+            self._file.seek(0)
+            self._partial = b''
+            self.rotations += 1
+            self._read_available()
+
+    def _tail_loop(self):
+        self.logger.logger.info(f"AuthLogMonitor: بدء تتبع {self.path}...")
+        while self.running.is_set():
+            try:
+                self._drain()
+            except Exception as e:
+                self.logger.logger.error(f"AuthLogMonitor: خطأ بقراءة {self.path}: {e}", exc_info=True)
+            # inotify يوقظ الحلقة فور الكتابة، والمهلة تغطي الأنظمة بدونه
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+        self.logger.logger.info("AuthLogMonitor: إيقاف تتبع سجل المصادقة.")
+
+    def start(self):
+        """يبدأ التتبع من نهاية الملف الحالي (الأسطر السابقة لا تعاد معالجتها)."""
+        if not self.path:
+            self.logger.logger.info("AuthLogMonitor: لم يحدد AUTHLOG_FILE. لن يتم تتبع سجل المصادقة.")
+            return
+        if self.thread is not None and self.thread.is_alive():
+            return
+        try:
+            self._open(from_end=True)
+        except OSError as e:
+            self.logger.logger.warning(f"AuthLogMonitor: تعذر فتح {self.path} ({e}). سيتم تتبعه عند إنشائه.")
+        if InotifyWatcher.available():
+            watcher = InotifyWatcher([self.path], lambda _event, _path: self._wake.set(), self.logger.logger)
+            try:
+                watcher.start()
+                self.watcher = watcher
+            except OSError as e:
+                self.logger.logger.warning(f"AuthLogMonitor: inotify غير متاح ({e}). الفحص كل {self.poll_interval:g} ثانية.")
+        self.running.set()
+        self.thread = threading.Thread(target=self._tail_loop, name="AuthLogMonitorThread", daemon=True)
+        self.thread.start()
+        self.logger.logger.info(f"AuthLogMonitor: تم البدء. الحد: {self.failure_threshold} محاولة فاشلة / "
+                                f"{self.invalid_threshold} مستخدم غير موجود خلال {self.window:g} ثانية.")
+
+    def stop(self):
+        if self.thread is not None:
+            self.running.clear()
+            self._wake.set()
+            self.thread.join(timeout=5.0)
+            self.thread = None
+            self.logger.logger.info(f"AuthLogMonitor: تمت معالجة {self.lines:,} سطر، {self.alerts} تنبيه، "
+                                    f"{self.rotations} تدوير، {len(self.sources)} مصدر نشط ({self.evicted} محذوف).")
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher.join(timeout=2.0)
+            self.watcher = None
+        self._close()
+
+
+def _generate_auth_log(path, line_count, sources=5000):
+    """ينشئ سجل مصادقة تجريبياً: ضوضاء (cron/systemd) مع محاولات SSH فاشلة من sources عنوان وأسطر sudo."""
+    rnd = random.Random(1)
+    host = 'kali'
+    start = time.time() - line_count / 1000.0
+    with open(path, 'w', encoding='utf-8') as f:
+        for i in range(line_count):
+            tm = time.localtime(start + i / 1000.0)
+            stamp = f"{time.strftime('%b', tm)} {tm.tm_mday:2d} {time.strftime('%H:%M:%S', tm)}"
+            pid = 1000 + i % 30000
+            kind = rnd.random()
+            ip = f"10.{rnd.randrange(sources) >> 8 & 255}.{rnd.randrange(sources) & 255}.{rnd.randrange(1, 255)}"
+            if kind < 0.55:
+                line = f"CRON[{pid}]: pam_unix(cron:session): session opened for user root(uid=0) by (uid=0)"
+            elif kind < 0.65:
+                line = f"systemd-logind[412]: New session {i} of user kali."
+            elif kind < 0.85:
+                line = f"sshd[{pid}]: Failed password for root from {ip} port {rnd.randrange(1024, 65535)} ssh2"
+            elif kind < 0.92:
+                line = f"sshd[{pid}]: Invalid user admin{i % 50} from {ip} port {rnd.randrange(1024, 65535)}"
+            elif kind < 0.95:
+                line = f"sshd[{pid}]: message repeated 3 times: [ Failed password for root from {ip} port 22 ssh2]"
+            elif kind < 0.98:
+                line = f"sshd[{pid}]: Accepted publickey for kali from {ip} port 50022 ssh2: ED25519 SHA256:abc"
+            else:
+                line = f"sudo:     user{i % 20} : 3 incorrect password attempts ; TTY=pts/0 ; PWD=/home ; USER=root ; COMMAND=/bin/bash"
+            f.write(f"{stamp} {host} {line}\n")
+
+
+def run_authlog_benchmark(path=None, line_count=300000):
+    """يمرر سجل مصادقة (المحدد أو سجلاً تجريبياً) عبر قارئ AuthLogMonitor ويطبع الإنتاجية وحجم الحالة."""
+    class _CountingSink:
+        def __init__(self):
+            self.logger = logging.getLogger('IDS')
+            self.alerts = 0
+
+        def log_alert(self, alert_type, message, source="System", proto=None):
+            self.alerts += 1
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if not path:
+            path = os.path.join(tmp_dir, 'auth.log')
+            _generate_auth_log(path, line_count)
+        elif not os.path.isfile(path):
+            print(f"ملف السجل غير موجود: {path}")
+            return None
+        sink = _CountingSink()
+        monitor = AuthLogMonitor(sink, config)
+        monitor.path = path
+        monitor._open(from_end=False)
+        t0 = time.perf_counter()
+        try:
+            monitor._drain()
+        finally:
+            monitor._close()
+        elapsed = max(time.perf_counter() - t0, 1e-9)
+    print(f"تحليل سجل المصادقة {path}:")
+    print(f"  الأسطر: {monitor.lines:,} خلال {elapsed:.3f} ث ({monitor.lines / elapsed:,.0f} سطر/ث، "
+          f"{monitor.bytes_read / elapsed / (1024 * 1024):,.1f} ميجابايت/ث)")
+    print(f"  التنبيهات: {sink.alerts:,}، المصادر المتتبعة: {len(monitor.sources):,} (الحد {monitor.max_sources:,}، "
+          f"حذف {monitor.evicted:,})")
+    return monitor.lines / elapsed
+
+
+# --- تحليل الحزم الخام ومحرك الالتقاط AF_PACKET (NIDS) ---
+
+# معلومات الحزمة المستخرجة والمشتركة بين محركي الالتقاط (Scapy والخام)
+# proto: 'TCP' أو 'UDP' أو 'ICMP' أو 'ICMPv6' ، sport/dport: None لـ ICMP ، icmp_type: None لـ TCP/UDP
+PacketInfo = namedtuple('PacketInfo', ['proto', 'src_ip', 'dst_ip', 'sport', 'dport', 'icmp_type', 'tcp_flags', 'length'])
+
+ETH_P_ALL = 0x0003
+ETH_P_IP = 0x0800
+ETH_P_IPV6 = 0x86DD
+ETH_P_8021Q = 0x8100
+ETH_P_8021AD = 0x88A8
+# ترويسات امتداد IPv6 التي يتم تخطيها للوصول إلى ترويسة الطبقة الرابعة
+IPV6_EXT_HEADERS = {0, 43, 60}
+IPV6_FRAGMENT_HEADER = 44
+
+# أنواع ICMP/ICMPv6 التي تعتبر Ping (Echo Request/Reply)
+ICMP_ECHO_TYPES = {('ICMP', 8): 'Echo Request', ('ICMP', 0): 'Echo Reply',
+                   ('ICMPv6', 128): 'Echo Request', ('ICMPv6', 129): 'Echo Reply'}
+
+_unpack_u16 = struct.Struct('!H').unpack_from
+_unpack_ports = struct.Struct('!HH').unpack_from
+_unpack_addrs = struct.Struct('!II').unpack_from
+
+
+def parse_ethernet_frame(frame):
+    """يحلل إطار Ethernet مباشرة من memoryview بإزاحات ثابتة. يعيد PacketInfo أو None إذا لم تكن الحزمة TCP/UDP/ICMP فوق IP."""
+    if len(frame) < 14:
+        return None
+    eth_type = _unpack_u16(frame, 12)[0]
+    offset = 14
+    # تخطي وسوم VLAN (802.1Q / 802.1ad) إذا كانت موجودة داخل الإطار
+    while eth_type in (ETH_P_8021Q, ETH_P_8021AD) and len(frame) >= offset + 4:
+        eth_type = _unpack_u16(frame, offset + 2)[0]
+        offset += 4
+    return parse_ip_packet(frame, eth_type, offset)
+
+
+def parse_ip_packet(frame, eth_type, offset):
+    """يحلل حزمة IPv4/IPv6 تبدأ عند offset داخل frame (eth_type يحدد الإصدار). يعيد PacketInfo أو None."""
+    frame_len = len(frame)
+    if eth_type == ETH_P_IP:
+        if frame_len < offset + 20:
+            return None
+        ihl = (frame[offset] & 0x0F) * 4
+        # الأجزاء غير الأولى (Fragments) لا تحتوي على ترويسة الطبقة الرابعة
+        if _unpack_u16(frame, offset + 6)[0] & 0x1FFF:
+            return None
+        l4_proto = frame[offset + 9]
+        src_ip = socket.inet_ntop(socket.AF_INET, frame[offset + 12:offset + 16])
+        dst_ip = socket.inet_ntop(socket.AF_INET, frame[offset + 16:offset + 20])
+        offset += ihl
+    elif eth_type == ETH_P_IPV6:
+        if frame_len < offset + 40:
+            return None
+        l4_proto = frame[offset + 6]
+        src_ip = socket.inet_ntop(socket.AF_INET6, frame[offset + 8:offset + 24])
+        dst_ip = socket.inet_ntop(socket.AF_INET6, frame[offset + 24:offset + 40])
+        offset += 40
+        # المرور على سلسلة ترويسات الامتداد حتى الوصول إلى ترويسة الطبقة الرابعة
+        while l4_proto in IPV6_EXT_HEADERS or l4_proto == IPV6_FRAGMENT_HEADER:
+            if frame_len < offset + 8:
+                return None
+            if l4_proto == IPV6_FRAGMENT_HEADER:
+                if _unpack_u16(frame, offset + 2)[0] & 0xFFF8:
+                    return None # جزء غير أول
+                l4_proto, offset = frame[offset], offset + 8
+            else:
+                l4_proto, offset = frame[offset], offset + (frame[offset + 1] + 1) * 8
+    else:
+        return None
+
+    if l4_proto == 6: # TCP
+        if frame_len < offset + 14:
+            return None
+        sport, dport = _unpack_ports(frame, offset)
+        return PacketInfo('TCP', src_ip, dst_ip, sport, dport, None, frame[offset + 13], frame_len)
+    if l4_proto == 17: # UDP
+        if frame_len < offset + 4:
+            return None
+        sport, dport = _unpack_ports(frame, offset)
+        return PacketInfo('UDP', src_ip, dst_ip, sport, dport, None, None, frame_len)
+    if l4_proto == 1 and eth_type == ETH_P_IP: # ICMP
+        if frame_len < offset + 1:
+            return None
+        return PacketInfo('ICMP', src_ip, dst_ip, None, None, frame[offset], None, frame_len)
+    if l4_proto == 58 and eth_type == ETH_P_IPV6: # ICMPv6
+        if frame_len < offset + 1:
+            return None
+        return PacketInfo('ICMPv6', src_ip, dst_ip, None, None, frame[offset], None, frame_len)
+    return None
+
+
+# --- قراءة ملفات pcap تدريجياً (لوضع إعادة التشغيل Replay) ---
+# أنواع طبقة الربط المدعومة في ملفات pcap
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+
+
+def iter_pcap(path):
+    """يقرأ ملف pcap (بصيغة libpcap الكلاسيكية) حزمة حزمة دون تحميله كاملاً في الذاكرة. يعيد (timestamp, linktype, data)."""
+    with open(path, 'rb') as f:
+        header = f.read(24)
+        if len(header) < 24:
+            raise ValueError(f"ملف pcap غير صالح أو فارغ: {path}")
+        magic = header[:4]
+        # تحديد ترتيب البايتات ودقة الطابع الزمني (ميكرو/نانو ثانية) من الرقم السحري
+        formats = {
+            b'\xd4\xc3\xb2\xa1': ('<', 1e-6), b'\xa1\xb2\xc3\xd4': ('>', 1e-6),
+            b'\x4d\x3c\xb2\xa1': ('<', 1e-9), b'\xa1\xb2\x3c\x4d': ('>', 1e-9),
+        }
+        if magic not in formats:
+            raise ValueError(f"صيغة pcap غير مدعومة (pcapng غير مدعوم بمحرك raw): {path}")
+        endian, ts_scale = formats[magic]
+        linktype = struct.unpack(endian + 'I', header[20:24])[0] & 0x0FFFFFFF
+        record = struct.Struct(endian + 'IIII')
+        while True:
+            rec_header = f.read(16)
+            if len(rec_header) < 16:
+                return
+            ts_sec, ts_frac, incl_len, _orig_len = record.unpack(rec_header)
+            data = f.read(incl_len)
+            if len(data) < incl_len:
+                return # ملف مقطوع
+            yield ts_sec + ts_frac * ts_scale, linktype, data
+
+
+def parse_link_frame(linktype, data):
+    """يحلل حزمة ملتقطة حسب نوع طبقة الربط في ملف pcap. يعيد PacketInfo أو None."""
+    if linktype == LINKTYPE_ETHERNET:
+        return parse_ethernet_frame(data)
+    if linktype == LINKTYPE_LINUX_SLL:
+        # ترويسة Linux cooked: 16 بايت، نوع البروتوكول في آخر بايتين
+        if len(data) < 16:
+            return None
+        return parse_ip_packet(data, _unpack_u16(data, 14)[0], 16)
+    if linktype in (LINKTYPE_RAW, LINKTYPE_IPV4, LINKTYPE_IPV6):
+        if not data:
+            return None
+        version = data[0] >> 4
+        return parse_ip_packet(data, ETH_P_IP if version == 4 else ETH_P_IPV6 if version == 6 else 0, 0)
+    return None
+
+
+def flow_hash(linktype, frame):
+    """تجزئة متماثلة لخماسية التدفق بأقل تحليل ممكن (نفس القيمة للاتجاهين).
+
+    يعيد (التجزئة، هل الحزمة TCP SYN بدون ACK أو ICMP/ICMPv6 Echo Request لكاشف المسح)، أو (None, False)
+    للحزم غير IP أو الأجزاء غير الأولى. تعتمد على العناوين والمنافذ فقط (بدون inet_ntop أو PacketInfo)
+    لأنها تنفذ في خيط الالتقاط لكل حزمة.
+    """
+    frame_len = len(frame)
+    if linktype == LINKTYPE_ETHERNET:
+        if frame_len < 14:
+            return None, False
+        eth_type = _unpack_u16(frame, 12)[0]
+        offset = 14
+        while eth_type in (ETH_P_8021Q, ETH_P_8021AD) and frame_len >= offset + 4:
+            eth_type = _unpack_u16(frame, offset + 2)[0]
+            offset += 4
+    elif linktype == LINKTYPE_LINUX_SLL:
+        if frame_len < 16:
+            return None, False
+        eth_type, offset = _unpack_u16(frame, 14)[0], 16
+    elif linktype in (LINKTYPE_RAW, LINKTYPE_IPV4, LINKTYPE_IPV6):
+        if not frame_len:
+            return None, False
+        version = frame[0] >> 4
+        eth_type, offset = (ETH_P_IP if version == 4 else ETH_P_IPV6 if version == 6 else 0), 0
+    else:
+        return None, False
+
+    if eth_type == ETH_P_IP:
+        if frame_len < offset + 20 or _unpack_u16(frame, offset + 6)[0] & 0x1FFF:
+            return None, False
+        src, dst = _unpack_addrs(frame, offset + 12)
+        l4_proto = frame[offset + 9]
+        offset += (frame[offset] & 0x0F) * 4
+    elif eth_type == ETH_P_IPV6:
+        if frame_len < offset + 40:
+            return None, False
+        src = int.from_bytes(frame[offset + 8:offset + 24], 'big')
+        dst = int.from_bytes(frame[offset + 24:offset + 40], 'big')
+        l4_proto = frame[offset + 6]
+        offset += 40
+    else:
+        return None, False
+    # المنافذ للـ TCP/UDP فقط (ICMP وترويسات امتداد IPv6 تجزأ بالعناوين، وهي كافية لأن مفاتيح ICMP لا تحتوي منافذ)
+    scan = False
+    if (l4_proto == 6 or l4_proto == 17) and frame_len >= offset + 4:
+        sport, dport = _unpack_ports(frame, offset)
+        src = (src << 16) | sport
+        dst = (dst << 16) | dport
+        scan = l4_proto == 6 and frame_len > offset + 13 and frame[offset + 13] & 0x12 == 0x02
+    elif l4_proto == 1 or l4_proto == 58:
+        scan = frame_len > offset and frame[offset] == (8 if l4_proto == 1 else 128)
+    return hash((src, dst) if src < dst else (dst, src)), scan
+
+
+# --- مدرج تكراري لزمن المعالجة لكل حزمة (ذاكرة ثابتة بدلاً من تخزين كل القياسات) ---
+class LatencyHistogram:
+    RESOLUTION_NS = 100 # دقة الخانة الواحدة (100 نانوثانية)
+    BUCKETS = 20000 # 20000 خانة = حتى 2 ميلي ثانية، وما بعدها في خانة التجاوز
+
+    def __init__(self):
+        self.counts = [0] * (self.BUCKETS + 1)
+        self.total = 0
+        self.sum_ns = 0
+        self.max_ns = 0
+
+    def add(self, latency_ns):
+        index = latency_ns // self.RESOLUTION_NS
+        self.counts[index if index < self.BUCKETS else self.BUCKETS] += 1
+        self.total += 1
+        self.sum_ns += latency_ns
+        if latency_ns > self.max_ns:
+            self.max_ns = latency_ns
+
+    def merge(self, counts, sum_ns, max_ns):
+        """يدمج مدرجاً آخر (من عملية عاملة مثلاً) في هذا المدرج."""
+        for index, count in enumerate(counts):
+            if count:
+                self.counts[index] += count
+                self.total += count
+        self.sum_ns += sum_ns
+        self.max_ns = max(self.max_ns, max_ns)
+
+    def percentile(self, pct):
+        """يعيد قيمة النسبة المئوية المطلوبة بالنانوثانية (الحد الأعلى للخانة)."""
+        if not self.total:
+            return 0
+        target = self.total * pct / 100.0
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return self.max_ns if index == self.BUCKETS else min((index + 1) * self.RESOLUTION_NS, self.max_ns)
+        return self.max_ns
+
+
+# --- محرك التقاط خام عبر مقبس AF_PACKET مع حلقة TPACKET_V3 (Linux) ---
+class RawPacketCapture:
+    SOL_PACKET = 263
+    PACKET_RX_RING = 5
+    PACKET_VERSION = 10
+    TPACKET_V3 = 2
+    TP_STATUS_KERNEL = 0
+    TP_STATUS_USER = 1
+    BLOCK_SIZE = 1 << 20 # حجم كتلة الحلقة (1 ميجابايت، يجب أن يكون من مضاعفات حجم الصفحة)
+    FRAME_SIZE = 2048
+    BLOCK_TIMEOUT_MS = 60 # مهلة تسليم الكتلة للمستخدم حتى لو لم تمتلئ
+
+    def __init__(self, interface_name, ring_size_mb=32, logger=None):
+        self.interface_name = interface_name
+        self.logger = logger or logging.getLogger('IDS')
+        # مقبس AF_PACKET (بنفس اسم خاصية مقابس Scapy لإتاحة ربط مرشح BPF عليه)
+        self.ins = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+        self.ring = None
+        self.block_nr = max(1, int(ring_size_mb))
+        try:
+            self._setup_ring()
+        except (OSError, ValueError) as e:
+            # نواة قديمة أو قيود على الذاكرة: العودة إلى recv_into على مخزن مؤقت واحد
+            self.logger.warning(f"NetworkMonitor: تعذر إعداد حلقة TPACKET_V3 ({e}). استخدام recv_into بدلاً منها.")
+            self.ring = None
+        self.ins.bind((interface_name, ETH_P_ALL))
+
+    # إعداد حلقة الاستقبال المشتركة مع النواة (mmap)
+    def _setup_ring(self):
+        self.ins.setsockopt(self.SOL_PACKET, self.PACKET_VERSION, self.TPACKET_V3)
+        req = struct.pack('IIIIIII', self.BLOCK_SIZE, self.block_nr, self.FRAME_SIZE,
+                          (self.BLOCK_SIZE * self.block_nr) // self.FRAME_SIZE,
+                          self.BLOCK_TIMEOUT_MS, 0, 0)
+        self.ins.setsockopt(self.SOL_PACKET, self.PACKET_RX_RING, req)
+        self.ring = mmap.mmap(self.ins.fileno(), self.BLOCK_SIZE * self.block_nr,
+                              mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+
+    # ربط مرشح BPF بالمقبس (يتطلب libpcap عبر Scapy لترجمة التعبير)
+    def set_filter(self, bpf_filter):
+        """يطبق مرشح BPF على المقبس. يعيد True عند النجاح."""
+        if not bpf_filter:
+            return False
+        if attach_filter is None:
+            self.logger.warning("NetworkMonitor: لا يمكن ترجمة مرشح BPF بدون Scapy/libpcap. سيتم الالتقاط بدون مرشح.")
+            return False
+        try:
+            attach_filter(self.ins, bpf_filter, self.interface_name)
+            return True
+        except Exception as e:
+            self.logger.warning(f"NetworkMonitor: تعذر تطبيق مرشح BPF ({e}). سيتم الالتقاط بدون مرشح والتصفية في بايثون.")
+            return False
+
+    # مولد الإطارات الملتقطة كـ memoryview (بدون نسخ من الحلقة)
+    def frames(self, keep_running):
+        """يعيد الإطارات الملتقطة واحداً تلو الآخر طالما أن keep_running() صحيحة. الإطار صالح فقط حتى الإطار التالي."""
+        if self.ring is not None:
+            yield from self._ring_frames(keep_running)
+        else:
+            yield from self._recv_frames(keep_running)
+
+    def _ring_frames(self, keep_running):
+        poller = select.poll()
+        poller.register(self.ins.fileno(), select.POLLIN | select.POLLERR)
+        ring_view = memoryview(self.ring)
+        block_index = 0
+        try:
+            while keep_running():
+                block_offset = block_index * self.BLOCK_SIZE
+                # tpacket_block_desc: الحالة عند الإزاحة 8، عدد الحزم عند 12، إزاحة أول حزمة عند 16
+                block_status, num_pkts, first_offset = struct.unpack_from('III', ring_view, block_offset + 8)
+                if not block_status & self.TP_STATUS_USER:
+                    poller.poll(1000) # الانتظار حتى تسلم النواة كتلة جديدة (مع مهلة لفحص keep_running)
+                    continue
+                pkt_offset = block_offset + first_offset
+                for _ in range(num_pkts):
+                    # tpacket3_hdr: الإزاحة التالية عند 0، snaplen عند 12، tp_mac عند 24
+                    next_offset = struct.unpack_from('I', ring_view, pkt_offset)[0]
+                    snaplen = struct.unpack_from('I', ring_view, pkt_offset + 12)[0]
+                    mac = struct.unpack_from('H', ring_view, pkt_offset + 24)[0]
+                    frame = ring_view[pkt_offset + mac:pkt_offset + mac + snaplen]
+                    yield frame
+                    frame.release()
+                    pkt_offset += next_offset
+                # إعادة الكتلة إلى النواة
+                struct.pack_into('I', ring_view, block_offset + 8, self.TP_STATUS_KERNEL)
+                block_index = (block_index + 1) % self.block_nr
+        finally:
+            ring_view.release()
+
+    def _recv_frames(self, keep_running):
+        buf = bytearray(65536)
+        view = memoryview(buf)
+        self.ins.settimeout(1.0)
+        while keep_running():
+            try:
+                nbytes = self.ins.recv_into(buf)
+            except socket.timeout:
+                continue
+            yield view[:nbytes]
+
+    def close(self):
+        """يغلق الحلقة والمقبس."""
+        if self.ring is not None:
+            try:
+                self.ring.close()
+            except BufferError:
+                pass # لا تزال هناك مراجع للحلقة، سيتم تحريرها مع المقبس
+            self.ring = None
+        self.ins.close()
+
+
+# --- ذاكرة مؤقتة لإزالة تكرار التنبيهات (NIDS) ---
+class AlertDedupCache:
+    """ذاكرة مؤقتة بمدة صلاحية ثابتة وحد أقصى للإدخالات، مقسمة إلى أجزاء (shards) لكل منها قفل مستقل.
+
+    كل جزء OrderedDict مرتب حسب وقت الإدراج، لذا الإدخالات المنتهية دائماً في بدايته
+    وتنظيفها O(1) مطفأة بدلاً من المرور على كل الإدخالات مع كل تنبيه.
+    """
+    def __init__(self, expiry=10, max_entries=100000, shards=16):
+        self.expiry = expiry # مدة اعتبار المفتاح مكرراً (بالثواني)
+        self.shard_count = 1 << max(0, int(shards) - 1).bit_length() # تقريب عدد الأجزاء إلى قوة للعدد 2
+        self._mask = self.shard_count - 1
+        self.max_entries = max_entries
+        self._max_per_shard = max(1, max_entries // self.shard_count)
+        self._shards = [OrderedDict() for _ in range(self.shard_count)]
+        self._locks = [threading.Lock() for _ in range(self.shard_count)]
+        self.evicted = 0 # عدد الإدخالات المستبعدة بسبب الحد الأقصى (قبل انتهاء صلاحيتها)
+
+    def check_and_add(self, key, now=None):
+        """يعيد True ويسجل المفتاح إذا لم يظهر خلال مدة الصلاحية، أو False إذا كان مكرراً."""
+        index = hash(key) & self._mask
+        shard = self._shards[index]
+        with self._locks[index]:
+            if now is None:
+                now = time.monotonic()
+            # إزالة الإدخالات المنتهية من بداية الجزء (الأقدم أولاً)
+            cutoff = now - self.expiry
+            while shard:
+                oldest_key = next(iter(shard))
+                if shard[oldest_key] >= cutoff:
+                    break
+                del shard[oldest_key]
+
+            if key in shard:
+                return False
+            shard[key] = now
+            # استبعاد أقدم إدخال عند تجاوز الحد الأقصى للذاكرة
+            if len(shard) > self._max_per_shard:
+                shard.popitem(last=False)
+                self.evicted += 1
+            return True
+
+    def __len__(self):
+        return sum(len(shard) for shard in self._shards)
+
+
+# --- فهرس القائمة الموثوقة: عناوين وشبكات CIDR لـ IPv4 و IPv6 (NIDS) ---
+class IPPrefixSet:
+    """مجموعة عناوين/شبكات IP مجمعة في مجالات صحيحة مرتبة ومدمجة لكل عائلة، والبحث فيها بـ bisect.
+
+    الشبكات المتداخلة أو المتجاورة تدمج في مجال واحد، لذا تكلفة البحث O(log n) بعدد المجالات
+    (أقل من 32/128 مقارنة حتى مع عشرات آلاف الإدخالات) بدلاً من مقارنة العنوان بكل شبكة.
+    نتائج العناوين المتكررة تحفظ في ذاكرة صغيرة محدودة لتجنب تحويل العنوان النصي مع كل حزمة.
+    """
+    MEMO_SIZE = 65536
+
+    def __init__(self, entries=()):
+        self.invalid = [] # الإدخالات غير الصالحة (للتحذير)
+        networks = {4: [], 6: []}
+        for entry in entries:
+            entry = str(entry).strip()
+            if not entry:
+                continue
+            try:
+                network = ipaddress.ip_network(entry, strict=False)
+            except ValueError:
+                self.invalid.append(entry)
+                continue
+            networks[network.version].append(network)
+        # الشبكات المختصرة (لمرشح BPF والعرض) والمجالات المدمجة (للبحث)
+        self.networks = [n for version in (4, 6) for n in ipaddress.collapse_addresses(networks[version])]
+        self._starts = {}
+        self._ends = {}
+        for version in (4, 6):
+            starts, ends = [], []
+            for network in ipaddress.collapse_addresses(networks[version]):
+                first, last = int(network.network_address), int(network.broadcast_address)
+                if ends and first <= ends[-1] + 1:
+                    ends[-1] = max(ends[-1], last)
+                else:
+                    starts.append(first)
+                    ends.append(last)
+            self._starts[version], self._ends[version] = starts, ends
+        self._v4_starts, self._v4_ends = self._starts[4], self._ends[4]
+        self._v6_starts, self._v6_ends = self._starts[6], self._ends[6]
+        self._memo = {}
+
+    def __contains__(self, ip):
+        """يتحقق من انتماء عنوان نصي (IPv4 أو IPv6) لأي شبكة. العناوين غير الصالحة لا تنتمي."""
+        result = self._memo.get(ip)
+        if result is None:
+            result = self._lookup(ip)
+            if len(self._memo) >= self.MEMO_SIZE:
+                self._memo.clear()
+            self._memo[ip] = result
+        return result
+
+    def _lookup(self, ip):
+        try:
+            if ':' in ip:
+                starts, ends = self._v6_starts, self._v6_ends
+                if not starts:
+                    return False
+                value = int.from_bytes(socket.inet_pton(socket.AF_INET6, ip), 'big')
+            else:
+                starts, ends = self._v4_starts, self._v4_ends
+                if not starts:
+                    return False
+                value = int.from_bytes(socket.inet_aton(ip), 'big')
+        except (OSError, TypeError):
+            return False
+        index = bisect.bisect_right(starts, value) - 1
+        return index >= 0 and value <= ends[index]
+
+    def __len__(self):
+        return len(self.networks)
+
+    def __iter__(self):
+        return (str(network) for network in self.networks)
+
+    def __str__(self):
+        return ', '.join(self)
+
+
+# --- جدول تتبع الاتصالات (Flows) لإطلاق تنبيه واحد لكل اتصال بدلاً من كل حزمة (NIDS) ---
+TCP_FIN = 0x01
+TCP_SYN = 0x02
+TCP_RST = 0x04
+TCP_ACK = 0x10
+
+
+class Flow:
+    """سجل اتصال مضغوط (__slots__). الاتجاه الأمامي هو اتجاه أول حزمة شوهدت في الاتصال."""
+    __slots__ = ('proto', 'src_ip', 'src_port', 'dst_ip', 'dst_port', 'first_seen', 'last_seen',
+                 'packets_fwd', 'bytes_fwd', 'packets_rev', 'bytes_rev', 'state', 'fin_seen')
+
+    def __init__(self, info, now):
+        self.proto = info.proto
+        self.src_ip, self.src_port = info.src_ip, info.sport
+        self.dst_ip, self.dst_port = info.dst_ip, info.dport
+        self.first_seen = self.last_seen = now
+        self.packets_fwd = self.bytes_fwd = self.packets_rev = self.bytes_rev = 0
+        self.state = 'NEW' if info.proto == 'TCP' else 'ACTIVE'
+        self.fin_seen = 0 # بت 1 = FIN من الاتجاه الأمامي، بت 2 = FIN من الاتجاه العكسي
+
+    def add(self, info, now):
+        """يحدث العدادات وحالة TCP بحزمة جديدة. يعيد True إذا أغلقت الحزمة الاتصال (FIN من الطرفين أو RST)."""
+        forward = info.src_ip == self.src_ip and info.sport == self.src_port
+        if forward:
+            self.packets_fwd += 1
+            self.bytes_fwd += info.length
+        else:
+            self.packets_rev += 1
+            self.bytes_rev += info.length
+        self.last_seen = now
+        flags = info.tcp_flags
+        if flags is None or self.state in ('CLOSED', 'RESET'):
+            return False
+        if flags & TCP_RST:
+            self.state = 'RESET'
+            return True
+        if flags & TCP_FIN:
+            self.fin_seen |= 1 if forward else 2
+            if self.fin_seen == 3:
+                self.state = 'CLOSED'
+                return True
+            self.state = 'CLOSING'
+        elif flags & TCP_SYN:
+            if not flags & TCP_ACK:
+                self.state = 'SYN_SENT'
+            elif self.state == 'SYN_SENT':
+                self.state = 'ESTABLISHED'
+        elif self.state in ('NEW', 'SYN_SENT'):
+            # اتصال شوهد من منتصفه أو اكتمال المصافحة
+            self.state = 'ESTABLISHED'
+        return False
+
+    def reset_counters(self, now):
+        """يبدأ فترة قياس جديدة لنفس الاتصال (بعد انتهاء مهلة النشاط)."""
+        self.first_seen = now
+        self.packets_fwd = self.bytes_fwd = self.packets_rev = self.bytes_rev = 0
+
+
+class FlowTable:
+    """جدول اتصالات بمفتاح خماسي ثنائي الاتجاه موحد، مرتب حسب آخر نشاط (OrderedDict) لانتهاء مهلة الخمول بتكلفة O(1).
+
+    الاتصالات المغلقة تنقل إلى جدول منفصل بمهلة قصيرة كي لا تنشئ حزم ACK المتأخرة اتصالاً جديداً.
+    on_end(flow, reason) تستدعى عند انتهاء الاتصال: closed/reset/idle/active/evicted/shutdown.
+    """
+    def __init__(self, idle_timeout=300, active_timeout=3600, closed_timeout=10, max_flows=100000, on_end=None):
+        self.idle_timeout = idle_timeout
+        self.active_timeout = active_timeout
+        self.closed_timeout = closed_timeout
+        self.max_flows = max_flows
+        self.on_end = on_end
+        self._active = OrderedDict()
+        self._closing = OrderedDict()
+        self._lock = threading.Lock() # خيط الالتقاط وخيط انتهاء المهلات
+        self._last_expire = None
+        self.evicted = 0
+
+    def update(self, info, now):
+        """يسجل حزمة TCP/UDP في اتصالها. يعيد (الاتصال، True إذا كانت الحزمة بداية اتصال جديد)."""
+        src, dst = (info.src_ip, info.sport), (info.dst_ip, info.dport)
+        key = (info.proto,) + (src + dst if src <= dst else dst + src)
+        with self._lock:
+            if self._last_expire is None or now - self._last_expire >= 1.0:
+                self._expire_locked(now)
+            flow = self._active.get(key)
+            if flow is None:
+                flow = self._closing.get(key)
+                if flow is not None:
+                    flags = info.tcp_flags or 0
+                    if flags & TCP_SYN and not flags & TCP_ACK:
+                        del self._closing[key] # إعادة استخدام المنافذ: اتصال جديد
+                    else:
+                        flow.add(info, now) # حزم متأخرة بعد الإغلاق
+                        return flow, False
+                flow = Flow(info, now)
+                self._active[key] = flow
+                if flow.add(info, now):
+                    self._move_to_closing(key, flow)
+                elif len(self._active) > self.max_flows:
+                    _, oldest = self._active.popitem(last=False)
+                    self.evicted += 1
+                    self._end(oldest, 'evicted')
+                return flow, True
+
+            self._active.move_to_end(key)
+            if now - flow.first_seen >= self.active_timeout:
+                # تقرير دوري للاتصالات الطويلة دون اعتبارها اتصالاً جديداً
+                self._end(flow, 'active')
+                flow.reset_counters(now)
+            if flow.add(info, now):
+                self._move_to_closing(key, flow)
+            return flow, False
+
+    def _move_to_closing(self, key, flow):
+        del self._active[key]
+        self._closing[key] = flow
+        self._end(flow, flow.state.lower())
+
+    def _end(self, flow, reason):
+        if self.on_end:
+            self.on_end(flow, reason)
+
+    def _expire_locked(self, now):
+        self._last_expire = now
+        cutoff = now - self.idle_timeout
+        while self._active:
+            key, flow = next(iter(self._active.items()))
+            if flow.last_seen >= cutoff:
+                break
+            del self._active[key]
+            self._end(flow, 'idle')
+        cutoff = now - self.closed_timeout
+        while self._closing:
+            key, flow = next(iter(self._closing.items()))
+            if flow.last_seen >= cutoff:
+                break
+            del self._closing[key]
+
+    def expire(self, now):
+        """ينهي الاتصالات الخاملة ويحذف المغلقة بعد مهلتها."""
+        with self._lock:
+            self._expire_locked(now)
+
+    def flush(self):
+        """ينهي كل الاتصالات المفتوحة (عند الإيقاف أو نهاية إعادة التشغيل)."""
+        with self._lock:
+            active, self._active = self._active, OrderedDict()
+            self._closing.clear()
+            for flow in active.values():
+                self._end(flow, 'shutdown')
+
+    def __len__(self):
+        return len(self._active) + len(self._closing)
+
+
+# --- كشف المسح وفيضان SYN بنوافذ منزلقة وهياكل احتمالية محدودة الذاكرة (NIDS) ---
+class BloomFilter:
+    """مرشح Bloom بحجم ثابت (عدد البتات قوة للعدد 2) وثلاث دوال تجزئة مشتقة من hash واحد (تجزئة مزدوجة)."""
+    def __init__(self, bits=1 << 22):
+        self.bits = 1 << max(3, int(bits) - 1).bit_length()
+        self._mask = self.bits - 1
+        self.data = bytearray(self.bits >> 3)
+
+    def add(self, key):
+        """يضيف المفتاح. يعيد True إذا كان جديداً (بت واحد على الأقل لم يكن مضبوطاً)."""
+        h = hash(key)
+        h1, h2 = h & 0xFFFFFFFF, ((h >> 32) & 0xFFFFFFFF) | 1
+        data, mask = self.data, self._mask
+        new = False
+        for bit in (h1 & mask, (h1 + h2) & mask, (h1 + 2 * h2) & mask):
+            byte, flag = bit >> 3, 1 << (bit & 7)
+            if not data[byte] & flag:
+                data[byte] |= flag
+                new = True
+        return new
+
+    def clear(self):
+        self.data = bytearray(self.bits >> 3)
+
+
+class CountMinSketch:
+    """عدادات Count-Min بثلاثة صفوف وعرض ثابت: تقدير لا يقل عن العدد الحقيقي بذاكرة لا تعتمد على عدد المفاتيح.
+
+    الدوال تأخذ hash(key) مباشرة كي يحسب المستدعي التجزئة مرة واحدة لعدة جداول بنفس المفتاح.
+    """
+    DEPTH = 3
+
+    def __init__(self, width=16384):
+        self.width = 1 << max(1, int(width) - 1).bit_length()
+        self._mask = self.width - 1
+        self.table = array('I', bytes(4 * self.width * self.DEPTH))
+        self.max_value = 0 # أكبر عداد (يحدث عند تجميد الجدول كنافذة سابقة)
+
+    def _indexes(self, h):
+        h1, h2 = h & 0xFFFFFFFF, ((h >> 32) & 0xFFFFFFFF) | 1
+        width, mask = self.width, self._mask
+        return h1 & mask, width + ((h1 + h2) & mask), 2 * width + ((h1 + 2 * h2) & mask)
+
+    def add(self, h, count=1):
+        """يزيد عداد المفتاح ويعيد التقدير الجديد (أصغر قيمة بين الصفوف)."""
+        table = self.table
+        i0, i1, i2 = self._indexes(h)
+        a = table[i0] = table[i0] + count
+        b = table[i1] = table[i1] + count
+        c = table[i2] = table[i2] + count
+        return min(a, b, c)
+
+    def estimate(self, h):
+        table = self.table
+        i0, i1, i2 = self._indexes(h)
+        return min(table[i0], table[i1], table[i2])
+
+    def clear(self):
+        self.table = array('I', bytes(4 * self.width * self.DEPTH))
+        self.max_value = 0
+
+    @property
+    def memory_bytes(self):
+        return self.table.itemsize * len(self.table)
+
+
+class ScanDetector:
+    """يكشف المسح الأفقي (عناوين وجهة مميزة) والعمودي (منافذ وجهة مميزة) وفيضان SYN لكل مصدر، وفيضان SYN لكل وجهة.
+
+    التميز يحدد بمرشح Bloom للنافذة الحالية، والعد في Count-Min لنافذتين (الحالية والسابقة) مع تقدير منزلق:
+    العدد = الحالية + السابقة × (الجزء المتبقي من النافذة السابقة). الذاكرة ثابتة مهما كان عدد عناوين المصدر.
+    on_alert(kind, subject, estimate, threshold) تستدعى مرة واحدة لكل (نوع، عنوان) في النافذة.
+    """
+    MAX_ALERTS_PER_WINDOW = 1000 # حد التنبيهات في النافذة (حماية من فيضان عناوين مزورة يشبع العدادات)
+
+    def __init__(self, window=60, port_threshold=100, host_threshold=50, syn_threshold=1000,
+                 sketch_width=16384, on_alert=None, logger=None):
+        self.window = window
+        self.port_threshold = port_threshold
+        self.host_threshold = host_threshold
+        self.syn_threshold = syn_threshold
+        self.on_alert = on_alert
+        self.logger = logger or logging.getLogger('IDS')
+        bloom_bits = sketch_width * 256
+        self._seen_ports = BloomFilter(bloom_bits) # أزواج (مصدر، منفذ وجهة) في النافذة الحالية
+        self._seen_hosts = BloomFilter(bloom_bits) # أزواج (مصدر، عنوان وجهة) في النافذة الحالية
+        # [الحالية، السابقة] لكل مقياس
+        self._ports = [CountMinSketch(sketch_width), CountMinSketch(sketch_width)]
+        self._hosts = [CountMinSketch(sketch_width), CountMinSketch(sketch_width)]
+        self._syns = [CountMinSketch(sketch_width), CountMinSketch(sketch_width)]
+        self._window_start = None
+        self._alerted = set()
+        self.suppressed = 0
+
+    @property
+    def memory_bytes(self):
+        sketches = self._ports + self._hosts + self._syns
+        return len(self._seen_ports.data) + len(self._seen_hosts.data) + sum(sk.memory_bytes for sk in sketches)
+
+    def _advance(self, now):
+        """يبدل النوافذ عند انتهاء النافذة الحالية ويعيد وزن النافذة السابقة في التقدير المنزلق."""
+        if self._window_start is None:
+            self._window_start = now
+        elapsed = now - self._window_start
+        if elapsed >= self.window:
+            if self.suppressed:
+                self.logger.warning(f"ScanDetector: تم حذف {self.suppressed} تنبيه مسح/فيضان تجاوزت حد النافذة ({self.MAX_ALERTS_PER_WINDOW}).")
+                self.suppressed = 0
+            for pair in (self._ports, self._hosts, self._syns):
+                pair.reverse() # الحالية تصبح السابقة
+                pair[0].clear()
+                if elapsed >= 2 * self.window:
+                    pair[1].clear() # لا نشاط في النافذة السابقة
+                else:
+                    pair[1].max_value = max(pair[1].table)
+            self._seen_ports.clear()
+            self._seen_hosts.clear()
+            self._alerted.clear()
+            self._window_start = now if elapsed >= 2 * self.window else self._window_start + self.window
+            elapsed = now - self._window_start
+        return 1.0 - elapsed / self.window
+
+    def _check(self, kind, subject, pair, h, weight, threshold):
+        estimate = pair[0].add(h)
+        previous = pair[1]
+        # لا حاجة لقراءة النافذة السابقة إذا لم يكن بإمكانها إيصال التقدير إلى الحد (الحالة الغالبة)
+        if estimate + previous.max_value * weight < threshold:
+            return
+        estimate += int(previous.estimate(h) * weight)
+        if estimate >= threshold and (kind, subject) not in self._alerted:
+            if len(self._alerted) >= self.MAX_ALERTS_PER_WINDOW:
+                self.suppressed += 1
+                return
+            self._alerted.add((kind, subject))
+            if self.on_alert:
+                self.on_alert(kind, subject, estimate, threshold)
+
+    def observe_syn(self, src_ip, dst_ip, dst_port, now):
+        """يسجل حزمة TCP SYN بدون ACK (محاولة اتصال جديدة)."""
+        weight = self._advance(now)
+        h = hash(src_ip)
+        if self._seen_ports.add((src_ip, dst_port)):
+            self._check('PORT_SCAN', src_ip, self._ports, h, weight, self.port_threshold)
+        if self._seen_hosts.add((src_ip, dst_ip)):
+            self._check('HOST_SCAN', src_ip, self._hosts, h, weight, self.host_threshold)
+        self._check('SYN_FLOOD', src_ip, self._syns, h, weight, self.syn_threshold)
+        # فيضان SYN نحو وجهة واحدة (يكشف الفيضان من عناوين مصدر مزورة)
+        self._check('SYN_FLOOD_TARGET', dst_ip, self._syns, hash(('dst', dst_ip)), weight, self.syn_threshold)
+
+    def observe_ping(self, src_ip, dst_ip, now):
+        """يسجل ICMP Echo Request (مسح العناوين بـ Ping)."""
+        weight = self._advance(now)
+        if self._seen_hosts.add((src_ip, dst_ip)):
+            self._check('HOST_SCAN', src_ip, self._hosts, hash(src_ip), weight, self.host_threshold)
+
+
+# --- توزيع معالجة الحزم على عمليات عاملة عبر حلقات ذاكرة مشتركة (NIDS متعدد الأنوية) ---
+class SharedPacketRing:
+    """حلقة منتج واحد/مستهلك واحد في ذاكرة مشتركة (mmap مجهول يرث عبر fork) بخانات ثابتة الحجم.
+
+    المنتج (خيط الالتقاط) يكتب الخانة ثم ينشر مؤشر الرأس، والمستهلك (العملية العاملة) يقرأ حتى الرأس
+    ثم ينشر مؤشر الذيل؛ كل مؤشر يكتبه طرف واحد فقط لذا لا حاجة لأقفال بين العمليات.
+    """
+    SLOT_SIZE = 256
+    SLOT_HEADER = struct.Struct('=dHHI') # توقيت الحزمة، نوع طبقة الربط، الطول المنسوخ، الطول الأصلي
+    SNAP_LEN = SLOT_SIZE - SLOT_HEADER.size # تكفي لترويسات Ethernet/VLAN/IP/TCP (الحمولة غير مطلوبة للكشف)
+    DATA_OFFSET = 128 # الرأس عند 0 والذيل عند 64 (في خطي ذاكرة مختلفين لتجنب المشاركة الزائفة)
+    _U64 = struct.Struct('=Q')
+
+    def __init__(self, slots=8192):
+        self.slots = slots
+        self.mem = mmap.mmap(-1, self.DATA_OFFSET + slots * self.SLOT_SIZE)
+        self.buf = memoryview(self.mem)
+        self._head = 0 # نسخة المنتج المحلية من الرأس
+        self._tail = 0 # نسخة المنتج من الذيل (تحدث فقط عند امتلاء الحلقة) أو نسخة المستهلك المحلية
+
+    def put(self, ts, linktype, frame):
+        """يضيف إطاراً (يقطع بعد SNAP_LEN). يعيد False إذا كانت الحلقة ممتلئة. يستدعى من المنتج فقط."""
+        head = self._head
+        if head - self._tail >= self.slots:
+            self._tail = self._U64.unpack_from(self.buf, 64)[0]
+            if head - self._tail >= self.slots:
+                return False
+        offset = self.DATA_OFFSET + (head % self.slots) * self.SLOT_SIZE
+        wire_len = len(frame)
+        caplen = wire_len if wire_len < self.SNAP_LEN else self.SNAP_LEN
+        self.SLOT_HEADER.pack_into(self.buf, offset, ts, linktype, caplen, wire_len)
+        data_offset = offset + self.SLOT_HEADER.size
+        self.buf[data_offset:data_offset + caplen] = frame[:caplen]
+        self._head = head + 1
+        self._U64.pack_into(self.buf, 0, head + 1) # نشر الخانة بعد اكتمال كتابتها
+        return True
+
+    def consume(self, handler, max_items=1024):
+        """يمرر حتى max_items خانة منشورة إلى handler(ts, linktype, data, wire_len) كدفعة واحدة. يستدعى من المستهلك فقط."""
+        tail = self._tail
+        count = min(self._U64.unpack_from(self.buf, 0)[0] - tail, max_items)
+        if count <= 0:
+            return 0
+        buf, slots, slot_size, header_size = self.buf, self.slots, self.SLOT_SIZE, self.SLOT_HEADER.size
+        unpack_header = self.SLOT_HEADER.unpack_from
+        for position in range(tail, tail + count):
+            offset = self.DATA_OFFSET + (position % slots) * slot_size
+            ts, linktype, caplen, wire_len = unpack_header(buf, offset)
+            data = buf[offset + header_size:offset + header_size + caplen]
+            handler(ts, linktype, data, wire_len)
+            data.release()
+        self._tail = tail + count
+        self._U64.pack_into(buf, 64, tail + count) # تحرير الخانات للمنتج
+        return count
+
+    def close(self):
+        try:
+            self.buf.release()
+            self.mem.close()
+        except (BufferError, ValueError):
+            pass
+
+
+class _WorkerAlertSink:
+    """بديل IDSLogger داخل العملية العاملة: يجمع التنبيهات وسجلات التجميع ويرسلها دفعات إلى العملية الرئيسية."""
+    def __init__(self, result_queue):
+        self.logger = logging.getLogger('IDS')
+        self.result_queue = result_queue
+        self._pending = []
+        self._lock = threading.Lock() # خيط التجميع في العملية العاملة يكتب أيضاً
+
+    def log_alert(self, alert_type, message, source="System", proto=None):
+        with self._lock:
+            self._pending.append((alert_type, message, source, proto))
+
+    def log_rollups(self, rows, timeout=5.0):
+        self.result_queue.put(('rollups', rows))
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if pending:
+            self.result_queue.put(('alerts', pending))
+
+
+def _packet_worker_main(index, ring, result_queue, stop_event, config_obj, replay, rules=None):
+    """حلقة العملية العاملة: تحليل الحزم من حلقتها وتطبيق قواعد الكشف على حصتها من التدفقات."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN) # الإيقاف يتم عبر stop_event من العملية الرئيسية
+    # مقاييس العملية تبدأ من الصفر وترسل مجاميعها دورياً إلى العملية الرئيسية (تدمج في /metrics)
+    metrics.reset_after_fork()
+    sink = _WorkerAlertSink(result_queue)
+    aggregator = None
+    try:
+        rollup_window = config_obj.getfloat('DATABASE', 'ROLLUP_WINDOW', fallback=60)
+        rollup_max_keys = config_obj.getint('DATABASE', 'ROLLUP_MAX_KEYS', fallback=50000)
+    except ValueError:
+        rollup_window, rollup_max_keys = 60, 50000
+    if rollup_window > 0:
+        aggregator = AlertAggregator(sink, rollup_window, max(1, rollup_max_keys))
+        aggregator.start()
+    # كل عملية تملك ذاكرة إزالة التكرار وحالة الكشف لتدفقاتها فقط
+    monitor = NetworkMonitor(sink, config_obj, aggregator=aggregator, replay=True, workers=0)
+    if rules is not None:
+        # القواعد كما هي في المراقب الرئيسي (قد تكون حدثت بعد قراءة الإعدادات)
+        monitor.suspicious_ports, monitor._monitor_icmp_ping, monitor.whitelist_ips = rules
+    # كشف المسح يعمل في العملية الرئيسية: حزم المصدر الواحد موزعة على العمليات حسب التدفق،
+    # فلا ترى أي عملية كل منافذ/عناوين المسح (انظر PacketWorkerPool.dispatch)
+    monitor.scan_detector = None
+    process_packet = monitor._process_packet
+    histogram = LatencyHistogram() if replay else None
+    perf_counter_ns = time.perf_counter_ns
+    observe_packet, count_error = METRIC_NIDS_PACKET_SECONDS.observe, METRIC_NIDS_PACKET_ERRORS.inc
+    packets = 0
+
+    def handle(ts, linktype, data, wire_len):
+        started = perf_counter_ns()
+        try:
+            info = parse_link_frame(linktype, data)
+            if info is not None:
+                if info.length != wire_len:
+                    info = info._replace(length=wire_len) # الإطار مقطوع في الحلقة
+                # توقيت 0 يعني حزمة حية: تستخدم ساعة العملية لإزالة التكرار
+                process_packet(info, ts or None)
+        except Exception as e:
+            count_error()
+            sink.logger.error(f"PacketWorker-{index}: خطأ بمعالجة الحزمة: {e}", exc_info=False)
+        elapsed = perf_counter_ns() - started
+        observe_packet(elapsed / 1e9)
+        if histogram:
+            histogram.add(elapsed)
+
+    last_expire = last_metrics = time.monotonic()
+    try:
+        while True:
+            if time.monotonic() - last_metrics >= PacketWorkerPool.METRICS_INTERVAL:
+                last_metrics = time.monotonic()
+                result_queue.put(('metrics', index, metrics.export()))
+            consumed = ring.consume(handle)
+            if consumed:
+                packets += consumed
+                sink.flush()
+            elif stop_event.is_set():
+                # لا تتوقف العملية قبل تفريغ ما نشره المنتج قبل طلب الإيقاف
+                if not ring.consume(handle):
+                    break
+            else:
+                # في الالتقاط الحي تنتهي الاتصالات الخاملة حتى بدون حزم (في إعادة التشغيل تتبع توقيت الملف)
+                if not replay and monitor.flow_table is not None and time.monotonic() - last_expire >= 1.0:
+                    last_expire = time.monotonic()
+                    monitor.flow_table.expire(last_expire)
+                    sink.flush()
+                time.sleep(0.0005)
+    finally:
+        if monitor.flow_table is not None:
+            monitor.flow_table.flush()
+        if aggregator:
+            aggregator.stop()
+        sink.flush()
+        result_queue.put(('metrics', index, metrics.export()))
+        result_queue.put(('stats', index, {
+            'packets': packets,
+            'alerts': monitor.alerts_raised,
+            'histogram': (histogram.counts, histogram.sum_ns, histogram.max_ns) if histogram else None,
+        }))
+
+
+class PacketWorkerPool:
+    """يوزع الإطارات على عمليات عاملة حسب تجزئة التدفق ويدمج تنبيهاتها في IDSLogger الوحيد."""
+    METRICS_INTERVAL = 1.0 # كل كم ثانية ترسل العملية العاملة مجاميع مقاييسها إلى العملية الرئيسية
+
+    def __init__(self, logger_instance, config_obj, workers, ring_slots=8192, replay=False, rules=None, scan_observer=None):
+        self.logger = logger_instance
+        self.config = config_obj
+        self.count = workers
+        # scan_observer(ts, linktype, frame): يستدعى في خيط الالتقاط لحزم SYN و Echo Request قبل توزيعها
+        self.scan_observer = scan_observer
+        self.ring_slots = ring_slots
+        self.replay = replay # وضع إعادة التشغيل: توقيت الحزم من الملف وقياس زمن المعالجة داخل العمليات
+        self.rules = rules # (المنافذ المشبوهة، مراقبة ICMP، القائمة الموثوقة) من المراقب الرئيسي، أو None للقراءة من الإعدادات
+        self.rings = []
+        self.processes = []
+        self.worker_stats = {}
+        self.dispatched = 0
+        self.dropped = 0 # إطارات أهملت لامتلاء حلقة العملية (في الالتقاط الحي فقط)
+        self._context = multiprocessing.get_context('fork')
+        self._result_queue = None
+        self._stop_event = None
+        self._merger_thread = None
+
+    def start(self):
+        self._result_queue = self._context.Queue()
+        self._stop_event = self._context.Event()
+        for index in range(self.count):
+            ring = SharedPacketRing(self.ring_slots)
+            process = self._context.Process(target=_packet_worker_main, name=f"PacketWorker-{index}",
+                                            args=(index, ring, self._result_queue, self._stop_event, self.config, self.replay, self.rules),
+                                            daemon=True)
+            process.start()
+            self.rings.append(ring)
+            self.processes.append(process)
+        self._merger_thread = threading.Thread(target=self._merge_loop, name="PacketWorkerMerger", daemon=True)
+        self._merger_thread.start()
+        self.logger.logger.info(f"PacketWorkerPool: تم بدء {self.count} عمليات لمعالجة الحزم.")
+
+    def dispatch(self, ts, linktype, frame, block=False):
+        """يرسل الإطار إلى حلقة العملية المالكة لتدفقه. block=True ينتظر عند امتلاء الحلقة بدلاً من الإهمال."""
+        flow, scan = flow_hash(linktype, frame)
+        if flow is None:
+            return False
+        if scan and self.scan_observer is not None:
+            # كاشف مسح واحد يرى كل محاولات الاتصال بحدوده الفعلية
+            self.scan_observer(ts, linktype, frame)
+        ring = self.rings[flow % self.count]
+        while not ring.put(ts, linktype, frame):
+            if not block:
+                self.dropped += 1
+                return False
+            time.sleep(0.0001)
+        self.dispatched += 1
+        return True
+
+    def _merge_loop(self):
+        """ينقل تنبيهات العمليات وسجلات التجميع إلى طابور الكاتب الوحيد في IDSLogger."""
+        while True:
+            try:
+                item = self._result_queue.get(timeout=0.5)
+            except queue.Empty:
+                if self._stop_event.is_set() and not any(p.is_alive() for p in self.processes):
+                    return
+                continue
+            kind = item[0]
+            if kind == 'alerts':
+                for alert_type, message, source, proto in item[1]:
+                    self.logger.log_alert(alert_type, message, source, proto=proto)
+            elif kind == 'rollups':
+                self.logger.log_rollups(item[1])
+            elif kind == 'metrics':
+                metrics.update_remote(self._metrics_source(item[1]), item[2])
+            elif kind == 'stats':
+                self.worker_stats[item[1]] = item[2]
+                if len(self.worker_stats) == self.count:
+                    return
+
+    # مصدر مقاييس العملية العاملة: رقم العملية (pid) فلا تتداخل مجموعات العمليات بعد إعادة التشغيل
+    def _metrics_source(self, index):
+        return f"PacketWorker-{self.processes[index].pid}"
+
+    def stop(self, timeout=10.0):
+        """يوقف العمليات بعد تفريغ حلقاتها، ويعيد إحصائيات مجمعة (الحزم، التنبيهات، المدرج التكراري)."""
+        if self._stop_event is None:
+            return None
+        self._stop_event.set()
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                self.logger.logger.warning(f"PacketWorkerPool: العملية {process.name} لم تتوقف ضمن المهلة. إنهاؤها.")
+                process.terminate()
+                process.join(1.0)
+        self._merger_thread.join(timeout)
+        for index in range(len(self.processes)):
+            metrics.retire_remote(self._metrics_source(index))
+        for ring in self.rings:
+            ring.close()
+        self._result_queue.close()
+
+        histogram = LatencyHistogram() if self.replay else None
+        totals = {'packets': 0, 'alerts': 0, 'histogram': histogram}
+        for stats in self.worker_stats.values():
+            totals['packets'] += stats['packets']
+            totals['alerts'] += stats['alerts']
+            if histogram and stats['histogram']:
+                histogram.merge(*stats['histogram'])
+        self.logger.logger.info(f"PacketWorkerPool: تم الإيقاف. الحزم الموزعة: {self.dispatched}، المهملة: {self.dropped}، "
+                                f"التنبيهات: {totals['alerts']}")
+        self._stop_event = None
+        return totals
 
 
 # --- فئة مراقبة الشبكة (NIDS) ---
 class NetworkMonitor:
-    def __init__(self, logger_instance, config_obj):
+    BPF_WHITELIST_MAX_TERMS = 32 # أكثر من ذلك يبقى الاستثناء في IPPrefixSet فقط (كل شبكة تضيف ~10 تعليمات، وحد النواة 4096)
+
+    def __init__(self, logger_instance, config_obj, aggregator=None, replay=False, workers=None):
         self.logger = logger_instance # كائن Logger
         self.config = config_obj # كائن Configuration
+        self.aggregator = aggregator # مرحلة تجميع التنبيهات المكررة (اختيارية)
+        self.replay = replay # وضع إعادة تشغيل ملف pcap (بدون واجهة شبكة أو صلاحيات root)
+        self.alerts_raised = 0 # عدد التنبيهات التي تم إطلاقها من هذا المراقب
         self.running = threading.Event() # Event للتحكم في حلقة التقاط الحزم
         self.monitor_thread = None # خيط التشغيل الخاص بالمراقبة
         self.interface_name = None # اسم واجهة الشبكة للمراقبة
         self.suspicious_ports = set() # مجموعة المنافذ المشبوهة
-        self.whitelist_ips = set() # مجموعة عناوين IP الموثوقة
+        self.whitelist_ips = IPPrefixSet() # عناوين وشبكات IP الموثوقة (CIDR، IPv4/IPv6)
         self._monitor_icmp_ping = False # هل تتم مراقبة ICMP Ping؟
 
-        # قاموس لتخزين التنبيهات الحديثة (مفتاح التنبيه -> timestamp) لتجنب التكرار السريع
-        self.recent_alerts_cache = {}
-        # قفل لحماية الوصول المتزامن إلى ذاكرة التنبيهات المؤقتة من خيط Sniffing
-        self.recent_alerts_lock = threading.Lock()
         # المدة التي يتم فيها اعتبار التنبيه مكرراً (بالثواني) لنفس الاتجاه/النوع
-        self.alert_cache_expiry = 10
+        try:
+            self.alert_cache_expiry = self.config.getfloat('NIDS', 'ALERT_CACHE_EXPIRY', fallback=10)
+            alert_cache_max = self.config.getint('NIDS', 'ALERT_CACHE_MAX_ENTRIES', fallback=100000)
+        except ValueError:
+            self.logger.logger.error("NetworkMonitor: قيم ALERT_CACHE_EXPIRY/ALERT_CACHE_MAX_ENTRIES في [NIDS] غير صالحة. استخدام القيم الافتراضية.")
+            self.alert_cache_expiry, alert_cache_max = 10, 100000
+        if self.alert_cache_expiry <= 0: self.alert_cache_expiry = 10
+        if alert_cache_max <= 0: alert_cache_max = 100000
+        # ذاكرة التنبيهات الحديثة (مفتاح التنبيه -> وقت التنبيه) لتجنب التكرار السريع
+        self.alert_cache = AlertDedupCache(self.alert_cache_expiry, alert_cache_max)
+
+        # جدول تتبع الاتصالات: تنبيه واحد عند بداية الاتصال (واختيارياً عند نهايته) بدلاً من ذاكرة التكرار لـ TCP/UDP
+        self.flow_table = None
+        self.flow_end_alerts = False
+        self._flow_stop = threading.Event()
+        self._flow_thread = None
+        try:
+            if self.config.getboolean('NIDS', 'FLOW_TRACKING', fallback=True):
+                self.flow_end_alerts = self.config.getboolean('NIDS', 'FLOW_END_ALERTS', fallback=False)
+                self.flow_table = FlowTable(
+                    idle_timeout=self.config.getfloat('NIDS', 'FLOW_IDLE_TIMEOUT', fallback=300),
+                    active_timeout=self.config.getfloat('NIDS', 'FLOW_ACTIVE_TIMEOUT', fallback=3600),
+                    closed_timeout=self.config.getfloat('NIDS', 'FLOW_CLOSED_TIMEOUT', fallback=10),
+                    max_flows=max(1, self.config.getint('NIDS', 'FLOW_MAX_ENTRIES', fallback=100000)),
+                    on_end=self._flow_ended)
+        except ValueError:
+            self.logger.logger.error("NetworkMonitor: قيم تتبع الاتصالات FLOW_* في [NIDS] غير صالحة. استخدام القيم الافتراضية.")
+            self.flow_table = FlowTable(on_end=self._flow_ended)
 
-        # إذا لم تكن Scapy متاحة، لا يمكن تهيئة مراقبة الشبكة
-        if not SCAPY_AVAILABLE:
+        # كاشف المسح وفيضان SYN (يعمل على كل المنافذ وليس فقط SUSPICIOUS_PORTS)
+        self.scan_detector = None
+        try:
+            if self.config.getboolean('NIDS', 'SCAN_DETECTION', fallback=True):
+                self.scan_detector = ScanDetector(
+                    window=max(1.0, self.config.getfloat('NIDS', 'SCAN_WINDOW', fallback=60)),
+                    port_threshold=self.config.getint('NIDS', 'SCAN_PORT_THRESHOLD', fallback=100),
+                    host_threshold=self.config.getint('NIDS', 'SCAN_HOST_THRESHOLD', fallback=50),
+                    syn_threshold=self.config.getint('NIDS', 'SYN_FLOOD_THRESHOLD', fallback=1000),
+                    sketch_width=max(1024, self.config.getint('NIDS', 'SCAN_SKETCH_WIDTH', fallback=16384)),
+                    on_alert=self._scan_alert, logger=self.logger.logger)
+        except ValueError:
+            self.logger.logger.error("NetworkMonitor: قيم كشف المسح SCAN_*/SYN_FLOOD_THRESHOLD في [NIDS] غير صالحة. استخدام القيم الافتراضية.")
+            self.scan_detector = ScanDetector(on_alert=self._scan_alert, logger=self.logger.logger)
+
+        # تعبير BPF المبني من قواعد المراقبة (يطبق داخل النواة لتمرير الحزم المرشحة فقط إلى بايثون)
+        self.bpf_filter = None
+        # مقبس الالتقاط المفتوح حالياً (لإعادة ربط المرشح عند تغيير القواعد)
+        self._capture_socket = None
+        # Event يشير إلى أن المرشح تغير ويجب إعادة فتح الالتقاط (عند تعذر إعادة الربط المباشر)
+        self._filter_changed = threading.Event()
+        self._restart_workers = False # تغيرت القواعد والعمليات العاملة تحمل النسخة السابقة منها
+
+        # محرك الالتقاط: 'scapy' (افتراضي) أو 'raw' (مقبس AF_PACKET مع تحليل مباشر للترويسات)
+        self.engine = self.config.get('NETWORK', 'ENGINE', fallback='scapy').strip().lower() or 'scapy'
+        if self.engine not in ('scapy', 'raw'):
+            self.logger.logger.error(f"NetworkMonitor: قيمة 'ENGINE' في [NETWORK] غير معروفة ({self.engine}). استخدام scapy.")
+            self.engine = 'scapy'
+        if self.engine == 'raw' and not RAW_CAPTURE_AVAILABLE:
+            self.logger.logger.warning("NetworkMonitor: محرك الالتقاط الخام (AF_PACKET) غير متاح على هذا النظام. العودة إلى scapy.")
+            self.engine = 'scapy'
+        # حجم حلقة الاستقبال لمحرك الالتقاط الخام (بالميجابايت)
+        try:
+            self.ring_size_mb = self.config.getint('NETWORK', 'RING_SIZE_MB', fallback=32)
+            if self.ring_size_mb <= 0: self.ring_size_mb = 32
+        except ValueError:
+            self.logger.logger.error("NetworkMonitor: قيمة 'RING_SIZE_MB' في [NETWORK] يجب أن تكون عدد صحيح موجب. استخدام القيمة الافتراضية 32.")
+            self.ring_size_mb = 32
+        # عدد العمليات العاملة لمعالجة الحزم على عدة أنوية (0 = المعالجة داخل خيط الالتقاط)
+        if workers is None:
+            try:
+                workers = self.config.getint('NETWORK', 'WORKERS', fallback=0)
+            except ValueError:
+                self.logger.logger.error("NetworkMonitor: قيمة 'WORKERS' في [NETWORK] يجب أن تكون عدد صحيح. المعالجة داخل خيط الالتقاط.")
+                workers = 0
+        if workers > 1 and self.engine != 'raw':
+            self.logger.logger.warning("NetworkMonitor: توزيع الحزم على عمليات عاملة يتطلب ENGINE = raw. المعالجة داخل خيط الالتقاط.")
+            workers = 0
+        elif workers > 1 and not PACKET_WORKERS_AVAILABLE:
+            self.logger.logger.warning("NetworkMonitor: العمليات العاملة غير مدعومة على هذا النظام (fork غير متاح). المعالجة داخل خيط الالتقاط.")
+            workers = 0
+        self.workers = workers if workers > 1 else 0
+        self.worker_pool = None # PacketWorkerPool عند تفعيل العمليات العاملة
+
+        # إذا لم تكن Scapy متاحة، لا يمكن تهيئة مراقبة الشبكة بمحرك scapy
+        if self.engine == 'scapy' and not SCAPY_AVAILABLE:
             self.logger.logger.error("NetworkMonitor: Scapy غير متاحة، لا يمكن تهيئة مراقبة الشبكة.")
             return
+        self.logger.logger.info(f"NetworkMonitor: محرك الالتقاط: {self.engine}")
 
-        # قراءة إعدادات الشبكة
-        self._configure()
+        # قراءة إعدادات الشبكة (لا حاجة لاختيار واجهة في وضع إعادة التشغيل)
+        self._configure(select_interface=not replay)
+        # بناء مرشح BPF من القواعد المقروءة
+        self.bpf_filter = self._build_bpf_filter()
 
         # تحقق نهائي مما إذا كانت المراقبة ممكنة بناءً على التهيئة
-        if not self.interface_name or (not self.suspicious_ports and not self._monitor_icmp_ping):
+        if not replay and not self.interface_name or (not self.suspicious_ports and not self._monitor_icmp_ping and self.scan_detector is None):
              self.logger.logger.warning("NetworkMonitor: لا توجد واجهة صالحة أو لا توجد قواعد مراقبة (منافذ مشبوهة/ICMP مفعل). سيتم تعطيل مراقبة الشبكة.")
              self.interface_name = None # تعطيل المراقبة فعلياً إذا لم يكن هناك ما يجب مراقبته
 
 
     # قراءة وتكوين إعدادات الشبكة من ملف الإعدادات
-    def _configure(self):
+    def _configure(self, select_interface=True):
         """يقرأ إعدادات واجهة الشبكة، المنافذ المشبوهة، والـ IP الموثوقة من ملف الإعدادات."""
         try:
             # قراءة إعدادات المنافذ المشبوهة
@@ -651,18 +4516,25 @@ class NetworkMonitor:
 
             # قراءة عناوين IP الموثوقة (Whitelist)
             ips_str = self.config.get('NETWORK', 'WHITELIST_IPS', fallback='')
-            self.whitelist_ips = {ip.strip() for ip in ips_str.split(',') if ip.strip()}
+            self._set_whitelist(ips_str.split(','))
             self.logger.logger.info(f"NetworkMonitor: عناوين IP الموثوقة: {self.whitelist_ips or 'لا يوجد'}")
 
+            if not select_interface:
+                return
+
             # قراءة واجهة الشبكة المحددة في الإعدادات
             config_interface = self.config.get('NETWORK', 'INTERFACE', fallback='').strip()
             available_interfaces = []
             try:
-                # الحصول على قائمة الواجهات المتاحة بواسطة Scapy
-                available_interfaces = get_if_list()
-                self.logger.logger.info(f"NetworkMonitor: واجهات الشبكة المتاحة بواسطة Scapy: {available_interfaces}")
+                if SCAPY_AVAILABLE:
+                    # الحصول على قائمة الواجهات المتاحة بواسطة Scapy
+                    available_interfaces = get_if_list()
+                else:
+                    # بدون Scapy (محرك الالتقاط الخام): قائمة الواجهات من النظام مباشرة
+                    available_interfaces = [name for _, name in socket.if_nameindex()]
+                self.logger.logger.info(f"NetworkMonitor: واجهات الشبكة المتاحة: {available_interfaces}")
             except Exception as e:
-                 self.logger.logger.error(f"NetworkMonitor: خطأ في جلب قائمة الواجهات بواسطة Scapy: {e}. قد تحتاج صلاحيات root.")
+                 self.logger.logger.error(f"NetworkMonitor: خطأ في جلب قائمة الواجهات: {e}. قد تحتاج صلاحيات root.")
 
 
             # اختيار الواجهة للمراقبة: المفضلة هي المحددة في الإعدادات، ثم الاكتشاف التلقائي
@@ -671,7 +4543,7 @@ class NetworkMonitor:
                 self.logger.logger.info(f"NetworkMonitor: استخدام الواجهة المحددة في الإعدادات: {self.interface_name}")
             elif available_interfaces: # محاولة اختيار واجهة مناسبة تلقائياً إذا كانت هناك واجهات متاحة
                  # تجنب واجهات loopback (مثل 'lo') وعناوين loopback ('127.0.0.1', '::1')
-                 default_iface = next((iface for iface in available_interfaces if 'lo' not in iface.lower() and 'loopback' not in iface.lower() and get_if_addr(iface) not in ['127.0.0.1', '::1']), None)
+                 default_iface = next((iface for iface in available_interfaces if 'lo' not in iface.lower() and 'loopback' not in iface.lower() and (not SCAPY_AVAILABLE or get_if_addr(iface) not in ['127.0.0.1', '::1'])), None)
 
                  if default_iface:
                      self.interface_name = default_iface
@@ -694,6 +4566,103 @@ class NetworkMonitor:
             self.interface_name = None # تعطيل المراقبة في حالة وجود خطأ فادح في التهيئة
 
 
+    # بناء فهرس القائمة الموثوقة مع التحذير من الإدخالات غير الصالحة
+    def _set_whitelist(self, entries):
+        self.whitelist_ips = IPPrefixSet(entries)
+        for entry in self.whitelist_ips.invalid:
+            self.logger.logger.warning(f"NetworkMonitor: تجاهل '{entry}' في WHITELIST_IPS (ليس عنوان IP أو شبكة CIDR صالحة).")
+
+    # بناء تعبير BPF من قواعد المراقبة الحالية
+    def _build_bpf_filter(self):
+        """يبني تعبير BPF من SUSPICIOUS_PORTS و MONITOR_ICMP_PING و WHITELIST_IPS. يعيد None إذا لم توجد قواعد."""
+        rules = []
+        # المنافذ المشبوهة (مصدر أو وجهة) لبروتوكولي TCP و UDP
+        ports = sorted(p for p in self.suspicious_ports if 0 <= p <= 65535)
+        if ports:
+            rules.append("((tcp or udp) and (" + " or ".join(f"port {p}" for p in ports) + "))")
+        # حزم ICMP Ping فقط (Echo Request/Reply) وليس كل أنواع ICMP
+        if self._monitor_icmp_ping:
+            rules.append("(icmp and (icmp[icmptype] == icmp-echo or icmp[icmptype] == icmp-echoreply))")
+            # ICMPv6 Echo Request/Reply (128/129) بدون ترويسات امتداد
+            rules.append("(icmp6 and (ip6[40] == 128 or ip6[40] == 129))")
+        # حزم TCP SYN بدون ACK على أي منفذ لكاشف المسح (IPv6 بدون ترويسات امتداد: أعلام TCP عند ip6[53])
+        if self.scan_detector is not None:
+            rules.append("(tcp and tcp[tcpflags] & (tcp-syn|tcp-ack) == tcp-syn)")
+            rules.append("(ip6 and ip6[6] == 6 and ip6[53] & 0x12 == 0x02)")
+        if not rules:
+            return None
+
+        bpf_expr = "(ip or ip6) and (" + " or ".join(rules) + ")"
+
+        # استثناء العناوين والشبكات الموثوقة داخل النواة (الإدخالات غير الصالحة مستبعدة مسبقاً في IPPrefixSet)
+        # القوائم الكبيرة تتجاوز حد تعليمات BPF في النواة فيفشل ربط المرشح كله، فتستثنى في مسار المعالجة بدلاً من ذلك
+        networks = self.whitelist_ips.networks
+        if len(networks) > self.BPF_WHITELIST_MAX_TERMS:
+            self.logger.logger.info(f"NetworkMonitor: WHITELIST_IPS تحتوي {len(networks)} شبكة (أكثر من {self.BPF_WHITELIST_MAX_TERMS})، يتم استثناؤها بعد الالتقاط وليس في مرشح BPF.")
+            return bpf_expr
+        terms = [f"host {n.network_address}" if n.num_addresses == 1 else f"net {n}" for n in networks]
+        if terms:
+            bpf_expr += " and not (" + " or ".join(terms) + ")"
+        return bpf_expr
+
+    # تحديث قواعد المراقبة أثناء التشغيل وإعادة بناء مرشح BPF
+    def update_rules(self, suspicious_ports=None, monitor_icmp_ping=None, whitelist_ips=None):
+        """يحدث قواعد المراقبة ويعيد بناء مرشح BPF وتطبيقه على الالتقاط الجاري."""
+        if suspicious_ports is not None:
+            self.suspicious_ports = {int(p) for p in suspicious_ports}
+        if monitor_icmp_ping is not None:
+            self._monitor_icmp_ping = bool(monitor_icmp_ping)
+        if whitelist_ips is not None:
+            self._set_whitelist(whitelist_ips)
+        self._apply_rules()
+
+    # إعادة قراءة قواعد المراقبة من الإعدادات (بعد إعادة قراءة ملف الإعدادات عند SIGHUP)
+    def reload_rules(self):
+        """يقرأ SUSPICIOUS_PORTS و MONITOR_ICMP_PING و WHITELIST_IPS من self.config من جديد ويطبقها."""
+        self._configure(select_interface=False)
+        self._apply_rules()
+
+    def _apply_rules(self):
+        """يعيد بناء مرشح BPF ويطبقه على الالتقاط الجاري. العمليات العاملة تعاد بالقواعد الجديدة."""
+        new_filter = self._build_bpf_filter()
+        if self.worker_pool is not None:
+            # قواعد العمليات العاملة نسخة من وقت إنشائها (fork)، لذا تعاد مع فتح الالتقاط من جديد
+            self.bpf_filter = new_filter
+            self.logger.logger.info(f"NetworkMonitor: تم تحديث القواعد، إعادة بدء العمليات العاملة. مرشح BPF: {self.bpf_filter or 'بدون مرشح'}")
+            self._restart_workers = True
+            self._filter_changed.set()
+            return
+        if new_filter == self.bpf_filter:
+            return
+        self.bpf_filter = new_filter
+        self.logger.logger.info(f"NetworkMonitor: تم تحديث مرشح BPF: {self.bpf_filter or 'بدون مرشح'}")
+
+        sock = self._capture_socket
+        if sock is None:
+            return # سيتم تطبيق المرشح الجديد عند بدء الالتقاط
+        # محاولة ربط المرشح الجديد مباشرة بالمقبس المفتوح (بدون فقدان حزم)
+        if attach_filter and self.bpf_filter and hasattr(sock, 'ins'):
+            try:
+                attach_filter(sock.ins, self.bpf_filter, self.interface_name)
+                return
+            except Exception as e:
+                self.logger.logger.warning(f"NetworkMonitor: فشل ربط مرشح BPF الجديد مباشرة: {e}. سيتم إعادة فتح الالتقاط.")
+        # خلاف ذلك نطلب من حلقة الالتقاط إعادة فتح المقبس بالمرشح الجديد
+        self._filter_changed.set()
+
+    # فتح مقبس الالتقاط مع تطبيق مرشح BPF (محرك scapy)
+    def _open_capture_socket(self):
+        """يفتح مقبس التقاط على الواجهة مع مرشح BPF. يعود للالتقاط بدون مرشح إذا تعذرت ترجمته."""
+        if self.bpf_filter:
+            try:
+                sock = scapy_conf.L2listen(iface=self.interface_name, filter=self.bpf_filter)
+                self.logger.logger.info(f"NetworkMonitor: تطبيق مرشح BPF داخل النواة: {self.bpf_filter}")
+                return sock
+            except Scapy_Exception as e:
+                # غالباً بسبب عدم توفر libpcap/tcpdump لترجمة المرشح
+                self.logger.logger.warning(f"NetworkMonitor: تعذر تطبيق مرشح BPF ({e}). سيتم الالتقاط بدون مرشح والتصفية في بايثون.")
+        return scapy_conf.L2listen(iface=self.interface_name)
+
     # التحقق من صلاحيات التشغيل (خاصة root على Linux)
     def _is_privileged(self):
         """يتحقق مما إذا كان السكربت يعمل بالصلاحيات اللازمة لالتقاط الشبكة."""
@@ -719,89 +4688,305 @@ class NetworkMonitor:
             return True # لا يمكن التحقق، نفترض أن المستخدم يتعامل مع الصلاحيات
 
 
-    # معالج حزم الشبكة
-    def _packet_handler(self, packet):
-        """تتم استدعاء هذه الدالة لكل حزمة يتم التقاطها."""
+    # استخراج معلومات الحزمة من كائن Scapy (محرك scapy)
+    def _scapy_packet_info(self, packet):
+        """يحول حزمة Scapy إلى PacketInfo. يعيد None إذا لم تكن حزمة IP/IPv6 تحمل TCP/UDP/ICMP."""
+        if IP and packet.haslayer(IP):
+            ip_layer = packet[IP]
+            # الأجزاء غير الأولى لا تحتوي على ترويسة الطبقة الرابعة (نفس سلوك المحلل الخام)
+            if ip_layer.frag:
+                return None
+        elif IPv6 and packet.haslayer(IPv6):
+            ip_layer = packet[IPv6]
+        else:
+            return None
+
+        layer = packet.getlayer(TCP)
+        if layer is not None:
+            return PacketInfo('TCP', ip_layer.src, ip_layer.dst, layer.sport, layer.dport, None, int(layer.flags), len(packet))
+        layer = packet.getlayer(UDP)
+        if layer is not None:
+            return PacketInfo('UDP', ip_layer.src, ip_layer.dst, layer.sport, layer.dport, None, None, len(packet))
+        if IP and ip_layer.__class__ is IP:
+            layer = packet.getlayer(ICMP)
+            if layer is not None:
+                return PacketInfo('ICMP', ip_layer.src, ip_layer.dst, None, None, layer.type, None, len(packet))
+        elif ICMPv6EchoRequest:
+            # أنواع ICMPv6 الأخرى لا تطلق تنبيهات، لذا يكفي فحص Echo Request/Reply
+            layer = packet.getlayer(ICMPv6EchoRequest) or packet.getlayer(ICMPv6EchoReply)
+            if layer is not None:
+                return PacketInfo('ICMPv6', ip_layer.src, ip_layer.dst, None, None, layer.type, None, len(packet))
+        return None
+
+    # معالج حزم الشبكة (محرك scapy)
+    def _packet_handler(self, packet, now=None):
+        """تتم استدعاء هذه الدالة لكل حزمة يتم التقاطها بواسطة Scapy."""
+        METRIC_NIDS_PACKETS.inc()
+        start = time.perf_counter()
         try:
-            # يجب أن تكون الحزمة من نوع IP للتحقق من المصدر والوجهة
-            if not IP or not packet.haslayer(IP):
-                 return
+            info = self._scapy_packet_info(packet)
+            if info is not None:
+                self._process_packet(info, now)
+            METRIC_NIDS_PACKET_SECONDS.observe(time.perf_counter() - start)
+        except Exception as e:
+            METRIC_NIDS_PACKET_ERRORS.inc()
+            # تسجيل أي خطأ يحدث أثناء معالجة حزمة معينة (معلومات الخطأ محدودة لتجنب الفيضان)
+            # exc_info=False لتجنب طباعة traceback الكامل لكل خطأ حزمة
+            self.logger.logger.error(f"NetworkMonitor: خطأ بمعالجة الحزمة: {e}", exc_info=False)
+
+    # تسجيل تنبيه شبكة
+    def _raise_alert(self, message, proto, alert_type='NIDS_ALERT'):
+        self.alerts_raised += 1
+        METRIC_NIDS_ALERTS.inc()
+        self.logger.log_alert(alert_type, message, 'NetworkMonitor', proto=proto)
+
+    # استدعاء من جدول الاتصالات عند انتهاء اتصال (أو تقرير دوري لاتصال طويل)
+    def _flow_ended(self, flow, reason):
+        if not self.flow_end_alerts:
+            return
+        port = flow.dst_port if flow.dst_port in self.suspicious_ports else flow.src_port
+        self._raise_alert(
+            f"انتهاء اتصال {flow.proto} على منفذ مشبوه ({port}): {flow.src_ip}:{flow.src_port} -> {flow.dst_ip}:{flow.dst_port} "
+            f"(المدة: {flow.last_seen - flow.first_seen:.1f} ث، الحزم: {flow.packets_fwd}/{flow.packets_rev}، "
+            f"البايتات: {flow.bytes_fwd}/{flow.bytes_rev}، الحالة: {flow.state}، السبب: {reason})",
+            flow.proto, 'NIDS_FLOW_END')
+
+    # استدعاء من كاشف المسح عند تجاوز أحد الحدود
+    def _scan_alert(self, kind, subject, estimate, threshold):
+        window = self.scan_detector.window
+        if kind == 'PORT_SCAN':
+            message = f"مسح منافذ محتمل من {subject}: ~{estimate} منفذ وجهة مختلف خلال {window:.0f} ث (الحد {threshold})"
+        elif kind == 'HOST_SCAN':
+            message = f"مسح عناوين محتمل من {subject}: ~{estimate} عنوان وجهة مختلف خلال {window:.0f} ث (الحد {threshold})"
+        elif kind == 'SYN_FLOOD':
+            message = f"فيضان SYN محتمل من {subject}: ~{estimate} حزمة SYN بدون ACK خلال {window:.0f} ث (الحد {threshold})"
+        else:
+            message = f"فيضان SYN محتمل نحو {subject}: ~{estimate} حزمة SYN بدون ACK خلال {window:.0f} ث (الحد {threshold})"
+        # مسح العناوين قد يكون بـ SYN أو Ping، لذا لا يحدد له بروتوكول
+        self._raise_alert(message, None if kind == 'HOST_SCAN' else 'TCP', f"NIDS_{kind}")
 
-            src_ip = packet[IP].src # عنوان IP المصدر
-            dst_ip = packet[IP].dst # عنوان IP الوجهة
+    # كشف المسح في العملية الرئيسية عند توزيع الحزم على عمليات عاملة (لحزم SYN و Echo Request فقط)
+    def _observe_scan_frame(self, ts, linktype, frame):
+        """نفس شروط _process_packet لكاشف المسح: القائمة الموثوقة، SYN بدون ACK، و Ping عند تفعيل مراقبة ICMP."""
+        try:
+            info = parse_link_frame(linktype, frame)
+            if info is None:
+                return
+            whitelist = self.whitelist_ips
+            if whitelist and (info.src_ip in whitelist or info.dst_ip in whitelist):
+                return
+            now = ts or time.monotonic() # توقيت 0 يعني حزمة حية
+            if info.proto == "TCP":
+                if info.tcp_flags & (TCP_SYN | TCP_ACK) == TCP_SYN:
+                    self.scan_detector.observe_syn(info.src_ip, info.dst_ip, info.dport, now)
+            elif info.icmp_type in (8, 128) and self._monitor_icmp_ping:
+                self.scan_detector.observe_ping(info.src_ip, info.dst_ip, now)
+        except Exception as e:
+            self.logger.logger.error(f"NetworkMonitor: خطأ بكشف المسح للحزمة: {e}", exc_info=False)
 
-            # تجاهل الحزم إذا كان أي من عنواني IP المصدر أو الوجهة في القائمة الموثوقة
-            if src_ip in self.whitelist_ips or dst_ip in self.whitelist_ips:
-                 return
+    # إنهاء الاتصالات الخاملة دورياً حتى في غياب الحزم (المراقبة الحية فقط)
+    def _flow_expiry_loop(self):
+        while not self._flow_stop.wait(1.0):
+            try:
+                self.flow_table.expire(time.monotonic())
+            except Exception as e:
+                self.logger.logger.error(f"NetworkMonitor: خطأ بإنهاء الاتصالات الخاملة: {e}", exc_info=True)
 
-            alert_message = None # رسالة التنبيه المراد تسجيلها
-            alert_key = None     # مفتاح لـ recent_alerts_cache لتتبع التنبيهات المكررة
-            proto = None         # بروتوكول الطبقة الرابعة (TCP/UDP/ICMP)
+    # تطبيق قواعد المراقبة على معلومات الحزمة (مشترك بين محركي الالتقاط)
+    def _process_packet(self, info, now=None):
+        """يطبق قواعد القائمة الموثوقة والمنافذ المشبوهة و ICMP على PacketInfo ويسجل التنبيه عند الحاجة.
 
-            # --- التحقق من المنافذ المشبوهة لبروتوكولات TCP و UDP ---
-            if (TCP and packet.haslayer(TCP)) or (UDP and packet.haslayer(UDP)):
-                # تحديد البروتوكول والطبقة
-                if packet.haslayer(TCP):
-                    proto = "TCP"
-                    layer = packet[TCP]
-                else:
-                    proto = "UDP"
-                    layer = packet[UDP]
+        now: توقيت الحزمة لذاكرة إزالة التكرار وجدول الاتصالات (توقيت ملف pcap في وضع إعادة التشغيل، والساعة الحالية إذا كان None).
+        """
+        src_ip = info.src_ip # عنوان IP المصدر
+        dst_ip = info.dst_ip # عنوان IP الوجهة
 
-                src_port = layer.sport # منفذ المصدر
-                dst_port = layer.dport # منفذ الوجهة
+        # تجاهل الحزم إذا كان أي من عنواني IP المصدر أو الوجهة ضمن القائمة الموثوقة (عنوان أو شبكة CIDR)
+        whitelist = self.whitelist_ips
+        if whitelist and (src_ip in whitelist or dst_ip in whitelist):
+             return
 
-                # التحقق مما إذا كان أي من المنفذين في قائمة المنافذ المشبوهة
-                if src_port in self.suspicious_ports or dst_port in self.suspicious_ports:
+        proto = info.proto   # بروتوكول الطبقة الرابعة (TCP/UDP/ICMP)
+
+        # --- التحقق من المنافذ المشبوهة لبروتوكولات TCP و UDP ---
+        if proto == "TCP" or proto == "UDP":
+            src_port = info.sport # منفذ المصدر
+            dst_port = info.dport # منفذ الوجهة
+
+            # محاولات الاتصال الجديدة (SYN بدون ACK) لكاشف المسح وفيضان SYN
+            if self.scan_detector is not None and proto == "TCP" and info.tcp_flags & (TCP_SYN | TCP_ACK) == TCP_SYN:
+                self.scan_detector.observe_syn(src_ip, dst_ip, dst_port, time.monotonic() if now is None else now)
+
+            # التحقق مما إذا كان أي من المنفذين في قائمة المنافذ المشبوهة
+            if src_port in self.suspicious_ports or dst_port in self.suspicious_ports:
+                # مفتاح مدمج (tuple) لهذا التنبيه في الذاكرة المؤقتة، ولا تبنى الرسالة إلا لتنبيه جديد
+                alert_key = (proto, src_ip, src_port, dst_ip, dst_port)
+                alert_message = None
+                if self.flow_table is not None:
+                    # تنبيه واحد لكل اتصال: بقية حزم الاتصال (في الاتجاهين) تحتسب في التجميع بمفتاح اتصالها
+                    flow, is_new = self.flow_table.update(info, time.monotonic() if now is None else now)
+                    alert_key = (proto, flow.src_ip, flow.src_port, flow.dst_ip, flow.dst_port)
+                else:
+                    is_new = self.alert_cache.check_and_add(alert_key, now)
+                if is_new:
                     # تحديد المنفذ المشبوه الذي تم العثور عليه في الحزمة
                     suspicious_port_found = dst_port if dst_port in self.suspicious_ports else src_port
-                    # بناء رسالة التنبيه
+                    # بناء رسالة التنبيه وتسجيلها
                     alert_message = (f"اتصال {proto} على منفذ مشبوه ({suspicious_port_found}): "
                                      f"{src_ip}:{src_port} -> {dst_ip}:{dst_port}")
-                    # بناء مفتاح فريد لهذا التنبيه للذاكرة المؤقتة
-                    alert_key = f"{proto}-{src_ip}:{src_port}-{dst_ip}:{dst_port}"
-
-            # --- التحقق من حزم ICMP Ping إذا كانت المراقبة مفعلة ---
-            elif self._monitor_icmp_ping and ICMP and packet.haslayer(ICMP):
-                 icmp_type = packet[ICMP].type # نوع ICMP
-                 # ICMP Type 8 هو Echo Request (طلب Ping)
-                 # ICMP Type 0 هو Echo Reply (رد Ping)
-                 if icmp_type == 8 or icmp_type == 0:
-                      proto = "ICMP"
-                      # تحديد وصف نوع ICMP
-                      icmp_desc = "Echo Request" if icmp_type == 8 else "Echo Reply"
-                      # بناء رسالة التنبيه
-                      alert_message = (f"كشف حزمة ICMP Ping ({icmp_desc}, Type: {icmp_type}) "
+                    self._raise_alert(alert_message, proto)
+                # احتساب كل حدوث (بما فيه المكرر المحذوف) في التجميع
+                if self.aggregator:
+                    self.aggregator.record(alert_key, 'NIDS_ALERT', 'NetworkMonitor', proto, alert_message)
+
+        # --- التحقق من حزم ICMP Ping إذا كانت المراقبة مفعلة ---
+        elif (proto == "ICMP" or proto == "ICMPv6") and self._monitor_icmp_ping:
+             icmp_type = info.icmp_type # نوع ICMP
+             # ICMP Type 8 / ICMPv6 Type 128 هو Echo Request (طلب Ping)
+             # ICMP Type 0 / ICMPv6 Type 129 هو Echo Reply (رد Ping)
+             icmp_desc = ICMP_ECHO_TYPES.get((proto, icmp_type))
+             # طلبات Ping لكشف مسح العناوين
+             if self.scan_detector is not None and (icmp_type == 8 or icmp_type == 128):
+                 self.scan_detector.observe_ping(src_ip, dst_ip, time.monotonic() if now is None else now)
+             if icmp_desc:
+                  alert_key = (proto, icmp_type, src_ip, dst_ip)
+                  alert_message = None
+                  if self.alert_cache.check_and_add(alert_key, now):
+                      # بناء رسالة التنبيه وتسجيلها
+                      alert_message = (f"كشف حزمة {proto} Ping ({icmp_desc}, Type: {icmp_type}) "
                                        f"من {src_ip} إلى {dst_ip}")
-                      # بناء مفتاح فريد لهذا التنبيه لـ ICMP (لا توجد منافذ)
-                      alert_key = f"ICMP-{icmp_type}-{src_ip}-{dst_ip}"
-
-
-            # --- تسجيل التنبيه إذا تم توليده ولم يتم تسجيله مؤخراً ---
-            if alert_message and alert_key:
-                now = time.time() # الوقت الحالي (timestamp)
-
-                # استخدام القفل لحماية الوصول إلى ذاكرة التنبيهات المؤقتة
-                with self.recent_alerts_lock:
-                    # تنظيف الإدخالات القديمة في الذاكرة المؤقتة التي تجاوزت مدة الانتهاء
-                    expired_keys = [k for k, ts in self.recent_alerts_cache.items() if now - ts > self.alert_cache_expiry]
-                    for k in expired_keys:
-                        del self.recent_alerts_cache[k]
-
-                    # إذا لم يكن مفتاح التنبيه موجوداً في الذاكرة المؤقتة (أي لم يتم التنبيه عليه مؤخراً)
-                    if alert_key not in self.recent_alerts_cache:
-                        # سجل التنبيه باستخدام دالة log_alert
-                        self.logger.log_alert('NIDS_ALERT', alert_message, 'NetworkMonitor', proto=proto)
-                        # إضافة التنبيه الحالي إلى الذاكرة المؤقتة مع وقته الحالي
-                        self.recent_alerts_cache[alert_key] = now
-
-        except Exception as e:
-            # تسجيل أي خطأ يحدث أثناء معالجة حزمة معينة (معلومات الخطأ محدودة لتجنب الفيضان)
-            # exc_info=False لتجنب طباعة traceback الكامل لكل خطأ حزمة
-            self.logger.logger.error(f"NetworkMonitor: خطأ بمعالجة الحزمة: {e}", exc_info=False)
-
+                      self._raise_alert(alert_message, proto)
+                  if self.aggregator:
+                      self.aggregator.record(alert_key, 'NIDS_ALERT', 'NetworkMonitor', proto, alert_message)
+
+
+    # إعادة تشغيل ملف pcap عبر نفس مسار المعالجة والتنبيهات
+    def replay_pcap(self, pcap_path, speed='max'):
+        """يمرر حزم ملف pcap عبر معالج الحزم نفسه ويعيد إحصائيات الأداء.
+
+        speed='max' بأقصى سرعة، و 'realtime' مع احترام الفواصل الزمنية الأصلية بين الحزم.
+        تعتمد إزالة التكرار على توقيت الحزم في الملف، لذا تتطابق أعداد التنبيهات بين المحركين وبين السرعتين.
+        """
+        histogram = LatencyHistogram()
+        packets = 0
+        alerts_before = self.alerts_raised
+        perf_counter_ns = time.perf_counter_ns
+        realtime = (speed == 'realtime')
+        first_ts = None
+        pool = None
+        worker_alerts = 0
+        if self.workers:
+            # زمن المعالجة يقاس داخل العمليات العاملة ويدمج عند الإيقاف
+            pool = self._new_worker_pool(replay=True)
+        wall_start = time.perf_counter()
+
+        if pool is not None:
+            for ts, linktype, data in iter_pcap(pcap_path):
+                if realtime:
+                    first_ts = ts if first_ts is None else first_ts
+                    delay = (ts - first_ts) - (time.perf_counter() - wall_start)
+                    if delay > 0: time.sleep(delay)
+                pool.dispatch(ts, linktype, data, block=True)
+            totals = pool.stop() # ينتظر تفريغ كل الحلقات
+            histogram = totals['histogram']
+            packets = totals['packets']
+            worker_alerts = totals['alerts']
+        elif self.engine == 'raw':
+            # قراءة تدريجية وتحليل مباشر للترويسات (بدون Scapy)
+            for ts, linktype, data in iter_pcap(pcap_path):
+                if realtime:
+                    first_ts = ts if first_ts is None else first_ts
+                    delay = (ts - first_ts) - (time.perf_counter() - wall_start)
+                    if delay > 0: time.sleep(delay)
+                started = perf_counter_ns()
+                try:
+                    info = parse_link_frame(linktype, data)
+                    if info is not None:
+                        self._process_packet(info, ts)
+                except Exception as e:
+                    self.logger.logger.error(f"NetworkMonitor: خطأ بمعالجة الحزمة: {e}", exc_info=False)
+                histogram.add(perf_counter_ns() - started)
+                packets += 1
+        else:
+            from scapy.utils import PcapReader # قراءة تدريجية (تدعم pcapng أيضاً)
+            with PcapReader(pcap_path) as reader:
+                for packet in reader:
+                    ts = float(packet.time)
+                    if realtime:
+                        first_ts = ts if first_ts is None else first_ts
+                        delay = (ts - first_ts) - (time.perf_counter() - wall_start)
+                        if delay > 0: time.sleep(delay)
+                    started = perf_counter_ns()
+                    self._packet_handler(packet, ts)
+                    histogram.add(perf_counter_ns() - started)
+                    packets += 1
+
+        if self.flow_table is not None:
+            self.flow_table.flush()
+        elapsed = time.perf_counter() - wall_start
+        return {
+            'engine': self.engine,
+            'workers': self.workers,
+            'packets': packets,
+            'elapsed': elapsed,
+            'pps': packets / elapsed if elapsed > 0 else 0.0,
+            'alerts': self.alerts_raised - alerts_before + worker_alerts,
+            'latency_us': {pct: histogram.percentile(pct) / 1000.0 for pct in (50, 90, 99, 99.9)},
+            'latency_max_us': histogram.max_ns / 1000.0,
+            'latency_mean_us': (histogram.sum_ns / histogram.total / 1000.0) if histogram.total else 0.0,
+        }
+
+    # التقاط الحزم باستخدام Scapy (محرك scapy)
+    def _run_scapy_capture(self):
+        """يلتقط الحزم عبر sniff من Scapy حتى إيقاف المراقبة أو تغير المرشح."""
+        self._capture_socket = self._open_capture_socket()
+        try:
+            # دالة sniff من Scapy تقوم بالتقاط الحزم بشكل غير توقفي (Non-blocking) إذا تم تحديد stop_filter
+            sniff(
+                opened_socket=self._capture_socket, # مقبس الالتقاط المفتوح على الواجهة مع مرشح BPF
+                prn=self._packet_handler, # الدالة التي سيتم استدعاؤها لكل حزمة
+                store=0, # لا تقم بتخزين الحزم في الذاكرة (لتجنب استهلاك الذاكرة)
+                # دالة تتوقف عندها sniff (عندما تكون running Event غير مضبوطة أو تغير المرشح)
+                stop_filter=lambda p: not self.running.is_set() or self._filter_changed.is_set()
+            )
+        finally:
+            sock, self._capture_socket = self._capture_socket, None
+            sock.close()
+
+    # التقاط الحزم عبر مقبس AF_PACKET وتحليل الترويسات مباشرة (محرك raw)
+    def _run_raw_capture(self):
+        """يلتقط الإطارات الخام ويحللها بدون Scapy حتى إيقاف المراقبة أو تغير المرشح."""
+        capture = RawPacketCapture(self.interface_name, self.ring_size_mb, self.logger.logger)
+        if capture.set_filter(self.bpf_filter):
+            self.logger.logger.info(f"NetworkMonitor: تطبيق مرشح BPF داخل النواة: {self.bpf_filter}")
+        self._capture_socket = capture
+        keep_running = lambda: self.running.is_set() and not self._filter_changed.is_set()
+        # في وضع العمليات العاملة يقتصر خيط الالتقاط على تجزئة التدفق ونسخ الإطار إلى حلقة العملية
+        dispatch = self.worker_pool.dispatch if self.worker_pool else None
+        # ربط المقاييس بمتغيرات محلية (الحلقة الأكثر سخونة في النظام)
+        count_packet, observe_packet = METRIC_NIDS_PACKETS.inc, METRIC_NIDS_PACKET_SECONDS.observe
+        perf_counter = time.perf_counter
+        try:
+            for frame in capture.frames(keep_running):
+                count_packet()
+                try:
+                    if dispatch is not None:
+                        # زمن المعالجة يقاس داخل العمليات العاملة ويدمج في /metrics، يكفي العد هنا
+                        dispatch(0.0, LINKTYPE_ETHERNET, frame)
+                        continue
+                    start = perf_counter()
+                    info = parse_ethernet_frame(frame)
+                    if info is not None:
+                        self._process_packet(info)
+                    observe_packet(perf_counter() - start)
+                except Exception as e:
+                    METRIC_NIDS_PACKET_ERRORS.inc()
+                    self.logger.logger.error(f"NetworkMonitor: خطأ بمعالجة الحزمة: {e}", exc_info=False)
+        finally:
+            self._capture_socket = None
+            capture.close()
 
-    # حلقة التقاط الحزم باستخدام Scapy
+    # حلقة التقاط الحزم
     def _sniff_loop(self):
         """الحلقة الرئيسية التي تقوم بالتقاط الحزم."""
         # تحقق مرة أخرى من أن الواجهة صالحة قبل بدء التقاط
@@ -812,13 +4997,19 @@ class NetworkMonitor:
 
         self.logger.logger.info(f"NetworkMonitor: بدء التقاط الحزم على الواجهة '{self.interface_name}'...")
         try:
-            # دالة sniff من Scapy تقوم بالتقاط الحزم بشكل غير توقفي (Non-blocking) إذا تم تحديد stop_filter
-            sniff(
-                iface=self.interface_name, # واجهة الشبكة التي سيتم التقاط الحزم منها
-                prn=self._packet_handler, # الدالة التي سيتم استدعاؤها لكل حزمة
-                store=0, # لا تقم بتخزين الحزم في الذاكرة (لتجنب استهلاك الذاكرة)
-                stop_filter=lambda p: not self.running.is_set() # دالة تتوقف عندها sniff (عندما تكون running Event غير مضبوطة)
-            )
+            # تعاد الحلقة فقط إذا تغير المرشح ولم يكن بالإمكان ربطه بالمقبس المفتوح مباشرة
+            while self.running.is_set():
+                self._filter_changed.clear()
+                if self.engine == 'raw':
+                    self._run_raw_capture()
+                else:
+                    self._run_scapy_capture()
+                if not self._filter_changed.is_set():
+                    break
+                if self._restart_workers and self.worker_pool is not None:
+                    self._restart_workers = False
+                    self.worker_pool.stop()
+                    self.worker_pool = self._new_worker_pool()
             # إذا وصلت نقطة التنفيذ إلى هنا، فهذا يعني أن sniff توقفت.
             # إذا كانت running Event لا تزال مضبوطة، فهذا يعني أنها توقفت بشكل غير متوقع.
             if self.running.is_set():
@@ -837,8 +5028,8 @@ class NetworkMonitor:
 
     # بدء خيط مراقبة الشبكة
     def start(self):
-        """يبدأ خيط التقاط الحزم إذا كانت Scapy متاحة والإعدادات صحيحة."""
-        if not SCAPY_AVAILABLE:
+        """يبدأ خيط التقاط الحزم إذا كان محرك الالتقاط متاحاً والإعدادات صحيحة."""
+        if self.engine == 'scapy' and not SCAPY_AVAILABLE:
              self.logger.logger.error("NetworkMonitor: لا يمكن البدء، Scapy غير متاحة.")
              return
         # يتم فحص interface_name وقواعد المراقبة في __init__، إذا كانت غير صالحة، فالمراقبة معطلة فعلياً.
@@ -854,11 +5045,26 @@ class NetworkMonitor:
 
         # بدء الخيط فقط إذا لم يكن يعمل بالفعل
         if self.monitor_thread is None or not self.monitor_thread.is_alive():
+            if self.workers and self.worker_pool is None:
+                self.worker_pool = self._new_worker_pool()
             self.running.set() # ضبط Event لبدء الحلقة
             # إنشاء الخيط وتحديد الدالة الهدف واسم الخيط وجعله Daemon
             self.monitor_thread = threading.Thread(target=self._sniff_loop, name="NetworkMonitorThread", daemon=True)
             self.monitor_thread.start() # بدء الخيط
             self.logger.logger.info("NetworkMonitor: تم بدء خيط مراقبة الشبكة.")
+            # في وضع العمليات العاملة تنهي كل عملية اتصالاتها الخاملة بنفسها
+            if self.flow_table is not None and not self.worker_pool:
+                self._flow_stop.clear()
+                self._flow_thread = threading.Thread(target=self._flow_expiry_loop, name="FlowExpiryThread", daemon=True)
+                self._flow_thread.start()
+
+    # إنشاء مجموعة العمليات العاملة بقواعد المراقبة الحالية
+    def _new_worker_pool(self, replay=False):
+        pool = PacketWorkerPool(self.logger, self.config, self.workers, replay=replay,
+                                rules=(self.suspicious_ports, self._monitor_icmp_ping, self.whitelist_ips),
+                                scan_observer=self._observe_scan_frame if self.scan_detector is not None else None)
+        pool.start()
+        return pool
 
     # إيقاف خيط مراقبة الشبكة
     def stop(self):
@@ -873,10 +5079,116 @@ class NetworkMonitor:
             else:
                 self.logger.logger.warning("NetworkMonitor: خيط مراقبة الشبكة لم يتوقف ضمن المهلة المحددة.")
         self.monitor_thread = None # إعادة تعيين الكائن بعد الإيقاف
+        if self._flow_thread:
+            self._flow_stop.set()
+            self._flow_thread.join(timeout=5.0)
+            self._flow_thread = None
+        if self.flow_table is not None:
+            self.flow_table.flush() # تقارير نهاية الاتصالات المفتوحة
+        if self.worker_pool:
+            self.worker_pool.stop()
+            self.worker_pool = None
+
+
+# --- إعادة تشغيل ملف pcap عبر مسار NIDS كاملاً وقياس الأداء (بدون root أو واجهة شبكة) ---
+def run_pcap_replay(pcap_path, speed='max', workers=None):
+    """يمرر ملف pcap عبر NetworkMonitor و IDSLogger والتجميع، ثم يطبع الإنتاجية وزمن المعالجة وعدد التنبيهات."""
+    if not Path(pcap_path).is_file():
+        print(f"ملف pcap غير موجود: {pcap_path}")
+        return None
+    engine = config.get('NETWORK', 'ENGINE', fallback='scapy').strip().lower()
+    if engine != 'raw' and not SCAPY_AVAILABLE:
+        print("مكتبة Scapy غير متاحة. استخدم ENGINE = raw في قسم [NETWORK] لإعادة التشغيل بدونها.")
+        return None
+
+    replay_logger = IDSLogger()
+    # بأقصى سرعة تنتج الحزم التنبيهات أسرع من الكتابة، فيبطئ الطابور الممتلئ إعادة التشغيل بدلاً من إهمالها
+    replay_logger.block_when_full = True
+    aggregator = None
+    try:
+        rollup_window = config.getfloat('DATABASE', 'ROLLUP_WINDOW', fallback=60)
+        rollup_max_keys = config.getint('DATABASE', 'ROLLUP_MAX_KEYS', fallback=50000)
+    except ValueError:
+        rollup_window, rollup_max_keys = 60, 50000
+    if rollup_window > 0:
+        aggregator = AlertAggregator(replay_logger, rollup_window, max(1, rollup_max_keys))
+        aggregator.start()
+    try:
+        monitor = NetworkMonitor(replay_logger, config, aggregator=aggregator, replay=True, workers=workers)
+        stats = monitor.replay_pcap(pcap_path, speed)
+    finally:
+        if aggregator:
+            aggregator.stop()
+        replay_logger.close()
+    queue_stats = replay_logger.get_queue_stats()
+    stats['dropped'] = queue_stats['dropped']
+
+    latency = stats['latency_us']
+    print(f"إعادة تشغيل {pcap_path} (محرك {stats['engine']}، سرعة {speed}، عمليات عاملة: {stats['workers'] or 'لا يوجد'}):")
+    print(f"  الحزم: {stats['packets']:,} خلال {stats['elapsed']:.3f} ث ({stats['pps']:,.0f} حزمة/ث)")
+    print(f"  زمن المعالجة لكل حزمة (ميكروثانية): p50={latency[50]:.1f} p90={latency[90]:.1f} "
+          f"p99={latency[99]:.1f} p99.9={latency[99.9]:.1f} max={stats['latency_max_us']:.1f} "
+          f"متوسط={stats['latency_mean_us']:.1f}")
+    print(f"  التنبيهات: {stats['alerts']:,} (المكتوب في قاعدة البيانات: {queue_stats['written']:,}، المهمل: {stats['dropped']:,})")
+    if stats['dropped']:
+        print("  تحذير: أهملت تنبيهات، فنتيجة إعادة التشغيل غير مكتملة.")
+    return stats
 
 
 # --- إعدادات المصادقة وواجهة الويب (Flask) ---
 
+# ذاكرة مؤقتة للتحقق الناجح من كلمة المرور (تجزئة pbkdf2 بمليون تكرار تستغرق مئات الميلي ثانية لكل طلب)
+class CredentialCache:
+    """يحفظ لكل مستخدم HMAC-SHA256 لبيانات الدخول الناجحة بمفتاح عشوائي خاص بالعملية (لا تحفظ كلمة المرور نفسها)
+    لمدة ttl ثانية. المقارنة بـ hmac.compare_digest (زمن ثابت)، والحجم محدود بـ max_size مستخدم.
+    التجزئة المخزنة لا تتغير ولا تضعف؛ تغيير PASSWORD في الإعدادات يلغي المدخل، والمحاولات الفاشلة لا تحفظ.
+    """
+
+    def __init__(self, ttl=300, max_size=64):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._key = os.urandom(32)
+        self._entries = OrderedDict() # المستخدم -> (التجزئة المخزنة، HMAC لبيانات الدخول، وقت الانتهاء)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _digest(self, username, password):
+        return hmac.new(self._key, f"{username}\0{password}".encode('utf-8'), hashlib.sha256).digest()
+
+    def check(self, username, password, stored_hash):
+        """يعيد True إذا تم التحقق من نفس بيانات الدخول خلال ttl ولم تتغير التجزئة المخزنة."""
+        if self.ttl <= 0:
+            return False
+        digest = self._digest(username, password)
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is not None and entry[2] < time.monotonic():
+                del self._entries[username]
+                entry = None
+        if entry is not None and entry[0] == stored_hash and hmac.compare_digest(entry[1], digest):
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def add(self, username, password, stored_hash):
+        if self.ttl <= 0:
+            return
+        entry = (stored_hash, self._digest(username, password), time.monotonic() + self.ttl)
+        with self._lock:
+            self._entries[username] = entry
+            self._entries.move_to_end(username)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+try:
+    credential_cache = CredentialCache(config.getfloat('WEB', 'AUTH_CACHE_TTL', fallback=300))
+except ValueError:
+    logging.getLogger('IDS').error("قيمة AUTH_CACHE_TTL في [WEB] يجب أن تكون رقماً. استخدام القيمة الافتراضية (300).")
+    credential_cache = CredentialCache(300)
+
 # دالة للتحقق من اسم المستخدم وكلمة المرور للمصادقة الأساسية
 @auth.verify_password         
 def verify_password(username, password):
@@ -888,11 +5200,18 @@ def verify_password(username, password):
 
         # التحقق من اسم المستخدم
         if username == stored_username:
-            # التحقق مما إذا كانت كلمة المرور المخزنة هي تجزئة (Hash)
-            if stored_pw.startswith(('pbkdf2-sha256$', 'scrypt$')):
+            # التحقق مما إذا كانت كلمة المرور المخزنة هي تجزئة (Hash) بصيغة werkzeug (مثل pbkdf2:sha256:1000000$...)
+            if stored_pw.startswith(('pbkdf2:', 'scrypt:')):
+                password = password or ''
+                # تحقق ناجح حديث لنفس بيانات الدخول: تخطي إعادة حساب التجزئة
+                if credential_cache.check(username, password, stored_pw):
+                    return True
                 try:
                     # استخدام check_password_hash للمقارنة الآمنة مع التجزئة
-                    return check_password_hash(stored_pw, password)
+                    valid = check_password_hash(stored_pw, password)
+                    if valid:
+                        credential_cache.add(username, password, stored_pw)
+                    return valid
                 except Exception as e:
                     current_logger.error(f"خطأ بتحقق تجزئة كلمة المرور: {e}")
                     return False # فشل التحقق بسبب خطأ في التجزئة
@@ -914,6 +5233,20 @@ def auth_error():
     # يعيد استجابة 401 Unauthorized ليطلب المتصفح بيانات المصادقة
     return "Unauthorized Access", 401
 
+# قياس زمن وعدد طلبات الويب (التسمية بـ endpoint وليس المسار الكامل حتى يبقى عدد السلاسل محدوداً)
+@app.before_request
+def _start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def _record_request_metrics(response):
+    start = g.pop('request_start', None)
+    if start is not None:
+        endpoint = request.endpoint or 'unknown'
+        METRIC_HTTP_SECONDS.labels(endpoint).observe(time.perf_counter() - start)
+        METRIC_HTTP_REQUESTS.labels(endpoint, str(response.status_code)).inc()
+    return response
+
 # المسار الرئيسي (الصفحة الرئيسية) لواجهة الويب
 @app.route('/')
 @auth.login_required # يتطلب مصادقة للوصول إلى هذا المسار
@@ -924,35 +5257,323 @@ def dashboard():
     except Exception as e:
          logging.getLogger('IDS').error(f"خطأ بعرض قالب لوحة التحكم: {e}", exc_info=True)
          return "خطأ داخلي بالخادم عند تحميل لوحة التحكم.", 500
+# حدود عدد التنبيهات في كل صفحة من /api/alerts
+ALERTS_DEFAULT_LIMIT = 50
+ALERTS_MAX_LIMIT = 1000
+
+
+class AlertQueryError(ValueError):
+    """معامل غير صالح في طلب /api/alerts (يعاد كاستجابة 400)."""
+
+
+def _alert_time_param(args, name):
+    """يحول معامل وقت (YYYY-MM-DD HH:MM:SS أو ISO 8601) إلى صيغة عمود timestamp. None إذا لم يحدد.
+
+    عمود timestamp بالتوقيت المحلي للخادم، فالوقت مع منطقة زمنية (+03:00 أو Z) يحول إلى التوقيت المحلي أولاً،
+    والوقت بدونها يعتبر محلياً.
+    """
+    value = args.get(name, '').strip()
+    if not value:
+        return None
+    if value[-1:] in ('Z', 'z'):
+        value = value[:-1] + '+00:00' # fromisoformat لا تقبل Z قبل Python 3.11
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise AlertQueryError(f"قيمة '{name}' يجب أن تكون وقتاً بصيغة YYYY-MM-DD HH:MM:SS")
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone() # إلى التوقيت المحلي
+    return parsed.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _alert_id_param(args, name):
+    value = args.get(name, '').strip()
+    if not value:
+        return None
+    if not value.isdigit():
+        raise AlertQueryError(f"قيمة '{name}' يجب أن تكون عدداً صحيحاً غير سالب")
+    return int(value)
+
+
+def query_alerts(conn, args):
+    """ينفذ استعلام التنبيهات بترقيم المفاتيح (keyset) على id بدلاً من OFFSET.
+
+    since_id: التنبيهات الأحدث من id (للاستطلاع، الأقدم أولاً ضمن الحد حتى لا تفوت صفوف)،
+    before_id: الصفحة الأقدم من id. type/source/proto تطابق تامة، from/to نطاق زمني.
+    فهارس الأعمدة المفردة تحتوي rowid ضمنياً، فـ "type = ? AND id < ? ORDER BY id DESC" مسح نطاق فهرس مباشر.
+    النطاق الزمني يحول أولاً إلى حدود id (id يتزايد مع وقت الإدراج) بقراءة واحدة من فهرس timestamp.
+    يعيد (الصفوف من الأحدث للأقدم، الحد، هل الترتيب تصاعدي).
+    """
+    limit = _alert_id_param(args, 'limit')
+    limit = ALERTS_DEFAULT_LIMIT if limit is None else min(max(limit, 1), ALERTS_MAX_LIMIT)
+    since_id = _alert_id_param(args, 'since_id')
+    before_id = _alert_id_param(args, 'before_id')
+    time_from = _alert_time_param(args, 'from')
+    time_to = _alert_time_param(args, 'to')
+
+    where, params = [], []
+    for column in ('type', 'source', 'proto'):
+        value = args.get(column)
+        if value:
+            where.append(f"{column} = ?")
+            params.append(value)
+    if since_id is not None:
+        where.append("id > ?")
+        params.append(since_id)
+    if before_id is not None:
+        where.append("id < ?")
+        params.append(before_id)
+    cur = conn.cursor()
+    try:
+        if time_from is not None:
+            row = cur.execute("SELECT id FROM alerts WHERE timestamp >= ? ORDER BY timestamp, id LIMIT 1", (time_from,)).fetchone()
+            if row is None:
+                return [], limit, False
+            where.append("id >= ? AND timestamp >= ?")
+            params += [row[0], time_from]
+        if time_to is not None:
+            row = cur.execute("SELECT id FROM alerts WHERE timestamp <= ? ORDER BY timestamp DESC, id DESC LIMIT 1", (time_to,)).fetchone()
+            if row is None:
+                return [], limit, False
+            where.append("id <= ? AND timestamp <= ?")
+            params += [row[0], time_to]
+        ascending = since_id is not None and before_id is None
+        sql = (f"SELECT id, type, source, message, timestamp, proto FROM alerts"
+               f"{' WHERE ' + ' AND '.join(where) if where else ''} ORDER BY id {'ASC' if ascending else 'DESC'} LIMIT ?")
+        rows = [dict(row) for row in cur.execute(sql, params + [limit])]
+    finally:
+        cur.close()
+    if ascending:
+        rows.reverse()
+    return rows, limit, ascending
+
+
 # الواجهة البرمجية (API) لجلب التنبيهات
 @app.route('/api/alerts')
 @auth.login_required # يتطلب مصادقة للوصول إلى هذا المسار أيضاً
 def get_alerts():
-    alerts_list = [] # قائمة لتخزين التنبيهات قبل إرسالها كـ JSON
+    """يعيد قائمة التنبيهات (الأحدث أولاً). ترويسات الترقيم:
+    X-Next-Before-Id للصفحة الأقدم التالية، X-Next-Since-Id للاستطلاع التالي، X-Has-More عند وجود صفوف جديدة أخرى.
+    ETag مبني على المعاملات ونطاق المعرفات المعادة (التنبيهات لا تعدل بعد إدراجها)، فالاستطلاع بدون جديد يعيد 304.
+    """
     current_logger = ids_logger.logger if 'ids_logger' in globals() and ids_logger else logging.getLogger('IDS') # الحصول على logger
 
     try:
-        conn = ids_logger.conn # الحصول على اتصال قاعدة البيانات
-        conn.row_factory = sqlite3.Row # لتمكين الوصول إلى الصفوف كقاموس
-        cur = conn.cursor() # الحصول على مؤشر قاعدة البيانات
-
-        # تنفيذ استعلام لجلب آخر 50 تنبيهاً (مع عمود البروتوكول)
-        cur.execute("SELECT id, type, source, message, strftime('%Y-%m-%d %H:%M:%S', timestamp) as timestamp, proto FROM alerts ORDER BY id DESC LIMIT 50")
-        # تحويل الصفوف المسترجعة إلى قائمة من القواميس
-        alerts_list = [dict(row) for row in cur.fetchall()]
-        cur.close() # إغلاق المؤشر
-
+        conn = ids_logger.get_read_connection() # اتصال قراءة فقط خاص بخيط الويب الحالي
+        alerts_list, limit, ascending = query_alerts(conn, request.args)
+    except AlertQueryError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
          current_logger.error(f"خطأ بجلب التنبيهات من قاعدة البيانات: {e}", exc_info=True)
          # إعادة استجابة خطأ بصيغة JSON
          return jsonify({"error": "خطأ باسترداد التنبيهات من قاعدة البيانات"}), 500
 
-    # إعادة قائمة التنبيهات بصيغة JSON
-    return jsonify(alerts_list)
+    ids = [alert['id'] for alert in alerts_list]
+    response = jsonify(alerts_list)
+    since_id = request.args.get('since_id', '').strip()
+    if ids:
+        response.headers['X-Next-Since-Id'] = str(max(ids))
+    elif since_id:
+        response.headers['X-Next-Since-Id'] = since_id
+    if len(ids) == limit:
+        if ascending:
+            response.headers['X-Has-More'] = '1'
+        else:
+            response.headers['X-Next-Before-Id'] = str(min(ids))
+    # إعادة التحقق في كل مرة (الاستجابة خاصة بالمستخدم المصادق)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    signature = repr((sorted(request.args.items(multi=True)), ids[:1], ids[-1:], len(ids)))
+    response.set_etag(hashlib.sha1(signature.encode('utf-8')).hexdigest())
+    return response.make_conditional(request)
+
+
+# أقصى عدد فترات يعيدها /api/stats في استعلام واحد (مثلاً 24 ساعة بالدقيقة = 1440)
+STATS_MAX_BUCKETS = 5000
+# المدة الافتراضية لكل دقة عند عدم تحديد from (بالثواني)
+STATS_DEFAULT_SPAN = {60: 24 * 3600, 3600: 30 * 86400, 86400: 365 * 86400}
+
+
+def query_stats(conn, args):
+    """يقرأ عدادات alert_stats للنطاق المطلوب: سلسلة زمنية لكل نوع، المجموع لكل نوع، وأكثر المصادر تنبيهاً.
+
+    المفتاح الأساسي (resolution, bucket, ...) يجعل الاستعلام مسح نطاق واحد تكلفته بعدد الفترات × المفاتيح المميزة،
+    مهما كان عدد التنبيهات الخام.
+    """
+    resolution_name = args.get('resolution', 'minute').strip().lower() or 'minute'
+    resolution = IDSLogger.STATS_RESOLUTIONS.get(resolution_name)
+    if resolution is None:
+        raise AlertQueryError(f"قيمة 'resolution' يجب أن تكون واحدة من: {', '.join(IDSLogger.STATS_RESOLUTIONS)}")
+    time_from = _alert_time_param(args, 'from')
+    time_to = _alert_time_param(args, 'to')
+    end = int(datetime.strptime(time_to, '%Y-%m-%d %H:%M:%S').timestamp()) if time_to else int(time.time())
+    start = int(datetime.strptime(time_from, '%Y-%m-%d %H:%M:%S').timestamp()) if time_from else end - STATS_DEFAULT_SPAN[resolution]
+    if (end - start) // resolution > STATS_MAX_BUCKETS:
+        raise AlertQueryError(f"النطاق الزمني يتجاوز {STATS_MAX_BUCKETS} فترة بدقة {resolution_name}. استخدم دقة أكبر.")
+    top = _alert_id_param(args, 'top')
+    top = 10 if top is None else min(max(top, 1), 100)
+
+    # الفترة التي تحتوي start تدخل أيضاً (بدايتها قبل start)
+    where, params = ["resolution = ?", "bucket > ?", "bucket <= ?"], [resolution, start - resolution, end]
+    for column in ('type', 'source', 'proto'):
+        value = args.get(column)
+        if value:
+            where.append(f"{column} = ?")
+            params.append(value)
+    condition = ' AND '.join(where)
+    series, totals = {}, {}
+    cur = conn.cursor()
+    try:
+        for bucket, alert_type, count in cur.execute(
+                f"SELECT bucket, type, SUM(count) FROM alert_stats WHERE {condition} GROUP BY bucket, type ORDER BY bucket", params):
+            series.setdefault(alert_type, []).append([bucket, count])
+            totals[alert_type] = totals.get(alert_type, 0) + count
+        top_sources = [{'source': source, 'count': count} for source, count in cur.execute(
+            f"SELECT source, SUM(count) AS total FROM alert_stats WHERE {condition} GROUP BY source ORDER BY total DESC LIMIT ?",
+            params + [top])]
+    finally:
+        cur.close()
+    return {
+        'resolution': resolution_name,
+        'bucket_seconds': resolution,
+        'bucket_alignment': 'utc', # بداية كل فترة = epoch - epoch % bucket_seconds (فترة اليوم تبدأ 00:00 UTC)
+        'from': start,
+        'to': end,
+        'series': series, # النوع -> [[بداية الفترة (epoch)، العدد], ...] (الفترات بدون تنبيهات محذوفة)
+        'totals': totals,
+        'top_sources': top_sources,
+    }
+
+
+# الواجهة البرمجية (API) لإحصائيات التنبيهات
+@app.route('/api/stats')
+@auth.login_required
+def get_stats():
+    """المعاملات: resolution (minute/hour/day)، from/to، type/source/proto، top (عدد المصادر الأعلى).
+
+    الفترات في series أزمنة epoch محاذاة على UTC (الحقل bucket_alignment)، وليس على التوقيت المحلي للخادم.
+    """
+    current_logger = ids_logger.logger if 'ids_logger' in globals() and ids_logger else logging.getLogger('IDS')
+    try:
+        stats = query_stats(ids_logger.get_read_connection(), request.args)
+    except AlertQueryError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        current_logger.error(f"خطأ بجلب إحصائيات التنبيهات: {e}", exc_info=True)
+        return jsonify({"error": "خطأ باسترداد إحصائيات التنبيهات من قاعدة البيانات"}), 500
+    response = jsonify(stats)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.set_etag(hashlib.sha1(response.get_data()).hexdigest())
+    return response.make_conditional(request)
+
+
+# البث المباشر للتنبيهات (Server-Sent Events)
+@app.route('/api/alerts/stream')
+@auth.login_required # المصادقة مرة واحدة عند فتح الاتصال، وليس لكل تحديث كما في الاستطلاع
+def stream_alerts():
+    """يبث التنبيهات الجديدة فور كتابتها من AlertBroadcaster (لا استعلامات لقاعدة البيانات لكل مشاهد).
+
+    Last-Event-ID (ترسله EventSource تلقائياً عند إعادة الاتصال، أو المعامل last_event_id) يستأنف من قاعدة البيانات
+    حتى STREAM_BACKFILL_MAX تنبيه ثم يكمل بالبث المباشر دون تكرار. عند تجاوز الحد يرسل حدث gap.
+    """
+    broadcaster = globals().get('alert_broadcaster')
+    if broadcaster is None:
+        return jsonify({"error": "البث المباشر للتنبيهات غير مفعل"}), 503
+    last_event_id = (request.headers.get('Last-Event-ID') or request.args.get('last_event_id', '')).strip()
+    if last_event_id and not last_event_id.isdigit():
+        return jsonify({"error": "قيمة Last-Event-ID يجب أن تكون معرف تنبيه"}), 400
+
+    # الاشتراك قبل قراءة قاعدة البيانات: ما يكتب أثناء الاستئناف ينتظر في المخزن ويحذف المكرر منه بالمعرف
+    subscriber = broadcaster.try_subscribe()
+    if subscriber is None:
+        # كل اتصال بث يشغل خيطاً من خيوط الخادم، فيحد عددها لترك خيوط لبقية الطلبات
+        response = jsonify({"error": "تم بلوغ الحد الأقصى لاتصالات البث المباشر"})
+        response.headers['Retry-After'] = '30'
+        return response, 503
+
+    def generate():
+        last_id = int(last_event_id) if last_event_id else None
+        yield "retry: 3000\n\n"
+        if last_id is not None:
+            conn = ids_logger.get_read_connection()
+            sent = 0
+            while True:
+                if sent >= broadcaster.backfill_max:
+                    yield f"event: gap\ndata: {json.dumps({'after_id': last_id})}\n\n"
+                    break
+                limit = min(ALERTS_MAX_LIMIT, broadcaster.backfill_max - sent)
+                rows, _limit, _ascending = query_alerts(conn, {'since_id': str(last_id), 'limit': str(limit)})
+                if rows:
+                    rows.reverse() # الأقدم أولاً
+                    yield ''.join(AlertBroadcaster.format_event(alert) for alert in rows)
+                    last_id = rows[-1]['id']
+                    sent += len(rows)
+                if len(rows) < limit:
+                    break
+        while True:
+            frames = broadcaster.wait(subscriber, broadcaster.heartbeat)
+            if frames is None:
+                return # مشترك بطيء فصل أو إيقاف النظام: المتصفح يعيد الاتصال بـ Last-Event-ID
+            if not frames:
+                yield ": keep-alive\n\n" # يكشف الاتصالات المغلقة ويمنع مهلة الخوادم الوسيطة
+                continue
+            if last_id is not None:
+                frames = [frame for frame in frames if frame[0] > last_id]
+                if not frames:
+                    continue
+            last_id = frames[-1][0]
+            yield ''.join(frame for _alert_id, frame in frames)
+
+    response = Response(generate(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # الإلغاء عند إغلاق الاستجابة من الخادم، حتى لو أغلق العميل الاتصال قبل بدء المولد
+    response.call_on_close(lambda: broadcaster.unsubscribe(subscriber))
+    return response
+
+
+# مقاييس الأداء بصيغة Prometheus النصية
+@app.route('/metrics')
+@auth.login_required
+def get_metrics():
+    """تجمع خلايا كل الخيوط عند الطلب فقط، فلا تكلف المسارات الساخنة أي قفل."""
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8',
+                    headers={'Cache-Control': 'no-cache'})
 
 
 # --- نقطة البداية الرئيسية لتشغيل السكربت ---
 if __name__ == '__main__':
+    # خيارات سطر الأوامر (أوضاع القياس تعمل ثم تنهي البرنامج دون بدء المراقبة)
+    arg_parser = argparse.ArgumentParser(description="نظام كشف التسلل (IDS)")
+    arg_parser.add_argument('--bench-db', action='store_true',
+                            help="قياس إنتاجية القراءة/الكتابة المتزامنة لقاعدة البيانات قبل وبعد WAL والفهارس ثم الخروج")
+    arg_parser.add_argument('--bench-scan', nargs='*', metavar='PATH',
+                            help="قياس سرعة فحص سلامة الملفات (ملف/ث، ميجابايت/ث) للمسارات المحددة (أو SENSITIVE_FILES) ثم الخروج")
+    arg_parser.add_argument('--bench-authlog', nargs='?', const='', metavar='PATH',
+                            help="قياس سرعة تحليل سجل المصادقة (الملف المحدد أو سجل تجريبي) ثم الخروج")
+    arg_parser.add_argument('--replay', metavar='PCAP',
+                            help="تمرير ملف pcap عبر مراقب الشبكة ومسار التنبيهات وطباعة إحصائيات الأداء ثم الخروج")
+    arg_parser.add_argument('--speed', choices=('max', 'realtime'), default='max',
+                            help="سرعة إعادة التشغيل: max بأقصى سرعة، realtime باحترام توقيت الحزم الأصلي")
+    arg_parser.add_argument('--workers', type=int, default=None,
+                            help="عدد العمليات العاملة لإعادة التشغيل (يتجاوز [NETWORK] WORKERS، يتطلب ENGINE = raw)")
+    args = arg_parser.parse_args()
+    if args.bench_db:
+        run_db_benchmark()
+        sys.exit(0)
+    if args.bench_scan is not None:
+        try:
+            hash_workers = config.getint('HIDS', 'HASH_WORKERS', fallback=0)
+        except ValueError:
+            logging.getLogger('IDS').error("قيمة HASH_WORKERS في [HIDS] يجب أن تكون رقماً. استخدام القيمة الافتراضية.")
+            hash_workers = 0
+        run_scan_benchmark(args.bench_scan, workers=hash_workers or None)
+        sys.exit(0)
+    if args.bench_authlog is not None:
+        run_authlog_benchmark(args.bench_authlog or None)
+        sys.exit(0)
+    if args.replay:
+        replay_stats = run_pcap_replay(args.replay, args.speed, args.workers)
+        sys.exit(0 if replay_stats is not None and not replay_stats['dropped'] else 1)
+
     # التحقق من صلاحيات root مبكراً على لينكس لتقديم تحذير واضح
     if platform.system() == 'Linux':
         if os.geteuid() != 0:
@@ -990,7 +5611,11 @@ if __name__ == '__main__':
     # عرض حالة مكونات HIDS و NIDS بناءً على الإعدادات وتوفر Scapy
     logger.info(f"الملفات المراقبة (HIDS): {AppConfig.SENSITIVE_FILES or 'لا يوجد'}")
     logger.info(f"العمليات المشبوهة المراقبة (HIDS): {config.get('HIDS','SUSPICIOUS_PROCS', fallback='لا يوجد')}")
-    if SCAPY_AVAILABLE:
+    # مراقبة الشبكة ممكنة بمحرك scapy إذا كانت المكتبة متاحة، أو بمحرك الالتقاط الخام على Linux
+    nids_engine = config.get('NETWORK', 'ENGINE', fallback='scapy').strip().lower()
+    nids_available = SCAPY_AVAILABLE or (nids_engine == 'raw' and RAW_CAPTURE_AVAILABLE)
+    if nids_available:
+        logger.info(f"محرك التقاط الحزم (NIDS): {nids_engine or 'scapy'}")
         logger.info(f"المنافذ المشبوهة للمراقبة (NIDS): {config.get('NIDS','SUSPICIOUS_PORTS', fallback='لا يوجد')}")
         logger.info(f"مراقبة ICMP Ping (NIDS): {'مفعل' if config.getboolean('NIDS', 'MONITOR_ICMP_PING', fallback=False) else 'معطل'}")
         logger.info(f"واجهة الشبكة المحددة (NIDS): {config.get('NETWORK','INTERFACE', fallback='تلقائي')}")
@@ -1009,20 +5634,77 @@ if __name__ == '__main__':
     # بدء مراقب العمليات (HIDS)
     process_monitor = ProcessMonitor(ids_logger, config)
     process_monitor.start()
+    # بدء تتبع سجل المصادقة (HIDS)
+    auth_log_monitor = AuthLogMonitor(ids_logger, config)
+    auth_log_monitor.start()
+    # بث التنبيهات المكتوبة مباشرة إلى /api/alerts/stream
+    alert_broadcaster = AlertBroadcaster(config)
+    ids_logger.broadcaster = alert_broadcaster
+    # مقاييس تقرأ من العدادات الموجودة في المكونات عند طلب /metrics
+    metrics.register_callback('ids_alert_queue_depth', "التنبيهات بانتظار الكتابة في قاعدة البيانات", 'gauge',
+                              lambda: ids_logger.get_queue_stats()['queue_depth'])
+    metrics.register_callback('ids_alerts_written_total', "التنبيهات المكتوبة في قاعدة البيانات", 'counter',
+                              lambda: ids_logger.get_queue_stats()['written'])
+    metrics.register_callback('ids_alerts_dropped_total', "التنبيهات المهملة بسبب امتلاء الطابور أو الإغلاق", 'counter',
+                              lambda: ids_logger.get_queue_stats()['dropped'])
+    metrics.register_callback('ids_file_events_total', "أحداث الملفات الواردة من المراقب", 'counter',
+                              lambda: file_monitor.events_received)
+    metrics.register_callback('ids_file_verifications_total', "عمليات التحقق بعد دمج الأحداث", 'counter',
+                              lambda: file_monitor.verifications)
+    metrics.register_callback('ids_authlog_lines_total', "أسطر سجل المصادقة المحللة", 'counter',
+                              lambda: auth_log_monitor.lines)
+    metrics.register_callback('ids_sse_clients', "اتصالات البث المباشر المفتوحة", 'gauge',
+                              lambda: alert_broadcaster.client_count)
+    metrics.register_callback('ids_auth_cache_hits_total', "عمليات دخول تحقق منها من ذاكرة بيانات الدخول", 'counter',
+                              lambda: credential_cache.hits)
+    metrics.register_callback('ids_auth_cache_misses_total', "عمليات دخول احتاجت التحقق الكامل من التجزئة", 'counter',
+                              lambda: credential_cache.misses)
+    # مرحلة تجميع التنبيهات المكررة (ROLLUP_WINDOW = 0 لتعطيلها)
+    alert_aggregator = None
+    try:
+        rollup_window = config.getfloat('DATABASE', 'ROLLUP_WINDOW', fallback=60)
+        rollup_max_keys = config.getint('DATABASE', 'ROLLUP_MAX_KEYS', fallback=50000)
+    except ValueError:
+        logger.error("قيم ROLLUP_WINDOW/ROLLUP_MAX_KEYS في [DATABASE] غير صالحة. استخدام القيم الافتراضية.")
+        rollup_window, rollup_max_keys = 60, 50000
+    if rollup_window > 0:
+        alert_aggregator = AlertAggregator(ids_logger, rollup_window, max(1, rollup_max_keys))
+        alert_aggregator.start()
     # بدء مراقب الشبكة (NIDS) إذا كانت Scapy متاحة وتم تهيئتها
     network_monitor = None
-    if SCAPY_AVAILABLE:
+    if nids_available:
         # يتم التحقق من الواجهة وقواعد المراقبة والصلاحيات داخل NetworkMonitor.__init__ و start()
-        network_monitor = NetworkMonitor(ids_logger, config)
+        network_monitor = NetworkMonitor(ids_logger, config, aggregator=alert_aggregator)
         network_monitor.start()
     else:
         # تسجيل تحذير إذا لم يتم تفعيل NIDS بسبب Scapy
         ids_logger.log_alert("SYSTEM_WARNING", "مراقبة الشبكة (NIDS) معطلة بسبب عدم توفر Scapy.", "IDS_Core")
 
+    # إعادة قراءة قواعد NIDS (المنافذ، ICMP، القائمة الموثوقة) من ملف الإعدادات عند SIGHUP (kill -HUP <pid>)
+    def reload_network_rules():
+        try:
+            config.read(config_path)
+        except configparser.Error as e:
+            logger.error(f"تعذر إعادة قراءة ملف الإعدادات '{config_path}': {e}. الإبقاء على القواعد الحالية.")
+            return
+        logger.info(f"إعادة تحميل قواعد مراقبة الشبكة من {os.path.abspath(config_path)}")
+        network_monitor.reload_rules()
+
+    if network_monitor is not None and hasattr(signal, 'SIGHUP'):
+        # العمل في خيط منفصل وليس داخل معالج الإشارة (قد يقاطع الخيط الرئيسي وهو يحمل قفل التسجيل)
+        signal.signal(signal.SIGHUP, lambda signum, frame: threading.Thread(
+            target=reload_network_rules, name="ConfigReloadThread", daemon=True).start())
+
 
     # --- بدء خادم الويب ---
     web_host = config.get('WEB', 'HOST', fallback='127.0.0.1')
     web_port = config.getint('WEB', 'PORT', fallback=5000)
+    try:
+        web_threads = config.getint('WEB', 'THREADS', fallback=16)
+        if web_threads <= 0: raise ValueError
+    except ValueError:
+        logger.error("قيمة THREADS في [WEB] يجب أن تكون عدداً صحيحاً موجباً. استخدام القيمة الافتراضية (16).")
+        web_threads = 16
 
     logger.info(f"بدء خادم الويب على http://{web_host}:{web_port}")
     logger.info("اضغط Ctrl+C لإيقاف النظام.")
@@ -1033,7 +5715,7 @@ if __name__ == '__main__':
         try:
             from waitress import serve
             # تشغيل خادم Waitress في خيط منفصل
-            server_thread = threading.Thread(target=serve, args=(app,), kwargs={'host': web_host, 'port': web_port, 'threads': 8, '_quiet': True}, name="WebServerThread", daemon=True)
+            server_thread = threading.Thread(target=serve, args=(app,), kwargs={'host': web_host, 'port': web_port, 'threads': web_threads, '_quiet': True}, name="WebServerThread", daemon=True)
             server_thread.start()
             logger.info("تم تشغيل خادم Waitress.")
         except ImportError:
@@ -1071,16 +5753,20 @@ if __name__ == '__main__':
         # إيقاف مراقب العمليات
         if process_monitor:
             process_monitor.stop()
+        if auth_log_monitor:
+            auth_log_monitor.stop()
         # إيقاف مراقب الملفات (يحتاج للانضمام إلى خيط watchdog)
         if file_monitor and monitor_observer: # تأكد من أنه تم بدء المراقب بنجاح
              file_monitor.stop()
-        # إغلاق اتصال قاعدة البيانات
-        if ids_logger and hasattr(ids_logger, 'conn') and ids_logger.conn:
-            try:
-                ids_logger.conn.close()
-                logger.info("تم إغلاق اتصال قاعدة البيانات.")
-            except Exception as e:
-                logger.error(f"خطأ بإغلاق قاعدة البيانات: {e}")
+        # إنهاء اتصالات البث المباشر المفتوحة
+        if alert_broadcaster:
+            alert_broadcaster.close()
+        # كتابة نافذة التجميع الأخيرة قبل إغلاق المسجل
+        if alert_aggregator:
+            alert_aggregator.stop()
+        # تفريغ طابور التنبيهات وإغلاق اتصال قاعدة البيانات
+        if ids_logger:
+            ids_logger.close()
         logger.info("---------------------------------------------------")
         logger.info("            تم إيقاف نظام كشف التسلل.             ")
         logger.info("---------------------------------------------------")
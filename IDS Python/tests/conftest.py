@@ -0,0 +1,107 @@
+import base64
+import logging
+import os
+import shutil
+import socket
+import struct
+import sys
+from pathlib import Path
+
+import pytest
+
+SRC_DIR = Path(__file__).resolve().parent.parent
+FIXTURES = Path(__file__).resolve().parent / 'fixtures'
+NIDS_SAMPLE_PCAP = FIXTURES / 'nids_sample.pcap'
+# القائمة الموثوقة المستخدمة مع nids_sample.pcap (انظر fixtures/make_nids_sample.py)
+SAMPLE_WHITELIST = '192.0.2.10, 2001:db8:ff::/48'
+
+
+@pytest.fixture(scope='session')
+def ids(tmp_path_factory):
+    """يستورد ids.py بنسخة من ids_config.ini (يقرأ الإعدادات من المجلد الحالي عند الاستيراد)،
+    ويوجه قاعدة البيانات والسجل إلى مجلد مؤقت بدلاً من مجلد السكربت."""
+    workdir = tmp_path_factory.mktemp('ids')
+    shutil.copy(SRC_DIR / 'ids_config.ini', workdir)
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    sys.path.insert(0, str(SRC_DIR))
+    try:
+        import ids as module
+    finally:
+        os.chdir(cwd)
+    module.config.set('DATABASE', 'PATH', str(workdir / 'ids.db'))
+    module.config.set('LOGGING', 'PATH', str(workdir / 'ids.log'))
+    return module
+
+
+@pytest.fixture
+def nids_config(ids, tmp_path):
+    """إعدادات NIDS لملف nids_sample.pcap، تعاد إلى قيمها الأصلية بعد الاختبار."""
+    config = ids.config
+    saved = {section: dict(config.items(section, raw=True)) for section in ('NIDS', 'NETWORK', 'DATABASE')}
+    config.set('NETWORK', 'WHITELIST_IPS', SAMPLE_WHITELIST)
+    config.set('NETWORK', 'ENGINE', 'raw')
+    config.set('NETWORK', 'WORKERS', '0')
+    config.set('DATABASE', 'PATH', str(tmp_path / 'ids.db'))
+    yield config
+    for section, values in saved.items():
+        for key in list(config[section]):
+            if key not in values:
+                config.remove_option(section, key)
+        for key, value in values.items():
+            config.set(section, key, value)
+
+
+
+@pytest.fixture
+def web_api(ids, nids_config):
+    """عميل اختبار Flask مع IDSLogger حقيقي (قاعدة بيانات مؤقتة) وبيانات دخول نصية admin/secret."""
+    saved = dict(ids.config.items('WEB', raw=True))
+    ids.config.set('WEB', 'USERNAME', 'admin')
+    ids.config.set('WEB', 'PASSWORD', 'secret')
+    logger = ids.IDSLogger()
+    ids.ids_logger = logger
+    client = ids.app.test_client()
+    client.auth = {'Authorization': 'Basic ' + base64.b64encode(b'admin:secret').decode('ascii')}
+    client.logger = logger
+    try:
+        yield client
+    finally:
+        del ids.ids_logger
+        logger.close()
+        for key, value in saved.items():
+            ids.config.set('WEB', key, value)
+
+class AlertRecorder:
+    """بديل IDSLogger يحفظ التنبيهات في قائمة بترتيب إطلاقها (بدون قاعدة بيانات)."""
+
+    def __init__(self):
+        self.logger = logging.getLogger('IDS')
+        self.alerts = []
+        self.rollups = []
+
+    def log_alert(self, alert_type, message, source="System", proto=None):
+        self.alerts.append((alert_type, message, proto))
+
+    def log_rollups(self, rows, timeout=5.0):
+        self.rollups.extend(rows)
+        return True
+
+
+def tcp_frame(src, dst, sport, dport, flags, payload=b''):
+    """إطار Ethernet/IPv4/TCP بسيط (بدون checksum، لا يتحقق منه المحلل)."""
+    tcp = struct.pack('!HHIIBBHHH', sport, dport, 0, 0, 5 << 4, flags, 65535, 0, 0) + payload
+    ip = struct.pack('!BBHHHBBH4s4s', 0x45, 0, 20 + len(tcp), 0, 0, 64, 6, 0,
+                     socket.inet_aton(src), socket.inet_aton(dst))
+    return b'\x02\x00\x00\x00\x00\x02\x02\x00\x00\x00\x00\x01\x08\x00' + ip + tcp
+
+
+def write_pcap(path, frames, start=1700000000.0, step=0.001):
+    """يكتب الإطارات في ملف pcap كلاسيكي (Ethernet) بفاصل زمني ثابت."""
+    with open(path, 'wb') as f:
+        f.write(struct.pack('<IHHiIII', 0xa1b2c3d4, 2, 4, 0, 0, 65535, 1))
+        for i, frame in enumerate(frames):
+            ts = start + i * step
+            f.write(struct.pack('<IIII', int(ts), int(round((ts % 1) * 1e6)), len(frame), len(frame)))
+            f.write(frame)
+    return path
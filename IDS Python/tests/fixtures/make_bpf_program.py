@@ -0,0 +1,42 @@
+# ترجمة تعبير BPF بـ libpcap وحفظ البرنامج الناتج في nids_sample_bpf.json (يتطلب libpcap):
+#   python make_bpf_program.py "<التعبير>"
+# التعبير هو NetworkMonitor.bpf_filter لإعدادات nids_sample.pcap (يطبعه test_bpf_filter عند عدم التطابق).
+# البرنامج محفوظ في المستودع حتى تعمل الاختبارات بدون libpcap، ويعاد توليده فقط عند تغير التعبير.
+import ctypes
+import ctypes.util
+import json
+import sys
+from pathlib import Path
+
+DLT_EN10MB = 1
+SNAPLEN = 65535
+
+
+class BpfInsn(ctypes.Structure):
+    _fields_ = [('code', ctypes.c_uint16), ('jt', ctypes.c_uint8), ('jf', ctypes.c_uint8), ('k', ctypes.c_uint32)]
+
+
+class BpfProgram(ctypes.Structure):
+    _fields_ = [('bf_len', ctypes.c_uint), ('bf_insns', ctypes.POINTER(BpfInsn))]
+
+
+def compile_expression(expression):
+    lib = ctypes.CDLL(ctypes.util.find_library('pcap') or 'libpcap.so')
+    lib.pcap_open_dead.restype = ctypes.c_void_p
+    lib.pcap_geterr.restype = ctypes.c_char_p
+    lib.pcap_geterr.argtypes = [ctypes.c_void_p]
+    lib.pcap_compile.argtypes = [ctypes.c_void_p, ctypes.POINTER(BpfProgram), ctypes.c_char_p, ctypes.c_int, ctypes.c_uint32]
+    handle = lib.pcap_open_dead(DLT_EN10MB, SNAPLEN)
+    program = BpfProgram()
+    if lib.pcap_compile(handle, ctypes.byref(program), expression.encode(), 1, 0xFFFFFFFF) != 0:
+        sys.exit(f"pcap_compile: {lib.pcap_geterr(handle).decode()}")
+    return [[i.code, i.jt, i.jf, i.k] for i in program.bf_insns[:program.bf_len]]
+
+
+if __name__ == '__main__':
+    expression = sys.argv[1]
+    program = compile_expression(expression)
+    # تعليمة واحدة في كل سطر: [code, jt, jf, k]
+    lines = ',\n'.join(f'  {json.dumps(insn)}' for insn in program)
+    Path(__file__).with_name('nids_sample_bpf.json').write_text(
+        f'{{"expression": {json.dumps(expression)},\n "linktype": {DLT_EN10MB},\n "program": [\n{lines}\n ]}}\n')
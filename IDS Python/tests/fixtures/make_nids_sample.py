@@ -0,0 +1,53 @@
+# توليد ملف nids_sample.pcap المشترك لاختبارات NIDS (يتطلب Scapy): python make_nids_sample.py
+# الملف الناتج محفوظ في المستودع، ولا حاجة لتشغيل هذا السكربت إلا عند تغيير محتواه.
+from pathlib import Path
+
+from scapy.all import Dot1Q, Ether, ICMP, IP, IPv6, ICMPv6EchoReply, ICMPv6EchoRequest, Raw, TCP, UDP, wrpcap
+
+SERVER4, SERVER6 = "10.0.0.1", "2001:db8::1"
+ETH = Ether(src="02:00:00:00:00:01", dst="02:00:00:00:00:02")
+
+
+def tcp_session(ip, src, dst, sport, dport, data_packets, vlan=None):
+    """مصافحة TCP ثم حزم بيانات في الاتجاهين ثم إغلاق بـ FIN."""
+    l2 = ETH / Dot1Q(vlan=vlan) if vlan else ETH
+    fwd = lambda flags, load=b"": l2 / ip(src=src, dst=dst) / TCP(sport=sport, dport=dport, flags=flags) / Raw(load)
+    rev = lambda flags, load=b"": l2 / ip(src=dst, dst=src) / TCP(sport=dport, dport=sport, flags=flags) / Raw(load)
+    packets = [fwd("S"), rev("SA"), fwd("A")]
+    for i in range(data_packets):
+        packets.append((fwd if i % 2 == 0 else rev)("PA", b"x" * 64))
+    packets += [fwd("FA"), rev("FA"), fwd("A")]
+    return packets
+
+
+def build():
+    packets = []
+    # حركة عادية لا تطلق تنبيهات (أغلب الملف): HTTP و UDP على منافذ غير مشبوهة، ورسائل ICMP غير Ping
+    packets += tcp_session(IP, "10.0.0.20", SERVER4, 40000, 80, 400)
+    packets += [ETH / IP(src="10.0.0.21", dst=SERVER4) / UDP(sport=5000, dport=5001) / Raw(b"u" * 32) for _ in range(100)]
+    packets += [ETH / IP(src=SERVER4, dst="10.0.0.21") / ICMP(type=3, code=3) for _ in range(5)]
+    packets += [ETH / IPv6(src="2001:db8::8", dst=SERVER6) / UDP(sport=6000, dport=6001) for _ in range(20)]
+    # IPv4: جلسة SSH، استعلام DNS ورده، Ping ورده
+    packets += tcp_session(IP, "10.0.0.5", SERVER4, 50022, 22, 40)
+    packets += [ETH / IP(src="10.0.0.6", dst=SERVER4) / UDP(sport=53000, dport=53),
+                ETH / IP(src=SERVER4, dst="10.0.0.6") / UDP(sport=53, dport=53000)]
+    packets += [ETH / IP(src="10.0.0.7", dst=SERVER4) / ICMP(type=8), ETH / IP(src=SERVER4, dst="10.0.0.7") / ICMP(type=0)]
+    # IPv6: جلسة RDP و Ping ورده
+    packets += tcp_session(IPv6, "2001:db8::5", SERVER6, 51000, 3389, 10)
+    packets += [ETH / IPv6(src="2001:db8::7", dst=SERVER6) / ICMPv6EchoRequest(),
+                ETH / IPv6(src=SERVER6, dst="2001:db8::7") / ICMPv6EchoReply()]
+    # إطارات VLAN (802.1Q): جلسة Telnet
+    packets += tcp_session(IP, "10.0.0.30", SERVER4, 52000, 23, 6, vlan=100)
+    # مصادر في القائمة الموثوقة (192.0.2.10 و 2001:db8:ff::/48): لا تنبيهات
+    packets += tcp_session(IP, "192.0.2.10", SERVER4, 53500, 22, 6)
+    packets += [ETH / IPv6(src="2001:db8:ff::1", dst=SERVER6) / ICMPv6EchoRequest()]
+    # مسح منافذ: SYN من مصدر واحد إلى 150 منفذاً مختلفاً (الحد الافتراضي 100)
+    packets += [ETH / IP(src="10.0.0.99", dst=SERVER4) / TCP(sport=60000, dport=1000 + i, flags="S") for i in range(150)]
+
+    for i, packet in enumerate(packets):
+        packet.time = 1700000000 + i * 0.001
+    return packets
+
+
+if __name__ == '__main__':
+    wrpcap(str(Path(__file__).with_name('nids_sample.pcap')), build(), linktype=1)
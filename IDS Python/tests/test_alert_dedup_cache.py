@@ -0,0 +1,36 @@
+def test_duplicate_within_expiry_and_new_after_it(ids):
+    cache = ids.AlertDedupCache(expiry=10, max_entries=100)
+    key = ('TCP', '10.0.0.5', 50022, '10.0.0.1', 22)
+    assert cache.check_and_add(key, now=100.0)
+    assert not cache.check_and_add(key, now=105.0)
+    assert not cache.check_and_add(key, now=110.0)
+    # بعد انتهاء المدة يحذف الإدخال عند أول وصول لنفس الجزء، ويعود المفتاح تنبيهاً جديداً
+    assert cache.check_and_add(key, now=110.5)
+    assert len(cache) == 1
+
+
+def test_expired_entries_are_purged_from_shard_head(ids):
+    cache = ids.AlertDedupCache(expiry=10, max_entries=100, shards=1)
+    for i in range(50):
+        cache.check_and_add(('ICMP', i), now=float(i))
+    cache.check_and_add('new', now=55.0) # الإدخالات قبل 45 منتهية
+    assert len(cache) == 6
+
+
+def test_oldest_entry_evicted_at_max_entries(ids):
+    cache = ids.AlertDedupCache(expiry=3600, max_entries=3, shards=1)
+    for key in 'abcd':
+        assert cache.check_and_add(key, now=1.0)
+    assert len(cache) == 3 and cache.evicted == 1
+    assert not cache.check_and_add('d', now=2.0)
+    # 'a' الأقدم استبعد قبل انتهاء مدته، فيعامل كجديد
+    assert cache.check_and_add('a', now=2.0)
+    assert cache.evicted == 2
+
+
+def test_memory_bound_holds_across_shards(ids):
+    cache = ids.AlertDedupCache(expiry=3600, max_entries=1000, shards=16)
+    for i in range(20000):
+        cache.check_and_add(('UDP', f'10.{i >> 8 & 255}.{i & 255}.1', i), now=1.0)
+    assert len(cache) <= 1000
+    assert cache.evicted == 20000 - len(cache)
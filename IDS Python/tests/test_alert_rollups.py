@@ -0,0 +1,50 @@
+import sqlite3
+
+from conftest import AlertRecorder
+
+
+def test_rollup_row_counts_duplicates_with_first_and_last_seen(ids, nids_config):
+    logger = ids.IDSLogger()
+    aggregator = ids.AlertAggregator(logger, window=60)
+    key = ('TCP', '10.0.0.5', 50022, '10.0.0.1', 22)
+    base = 1700000000.0
+    try:
+        aggregator.record(key, 'NIDS_ALERT', 'NetworkMonitor', 'TCP', 'أول تنبيه', now=base)
+        for i in range(1, 5):
+            aggregator.record(key, 'NIDS_ALERT', 'NetworkMonitor', 'TCP', None, now=base + 7 * i)
+        aggregator.record(('ICMP', 8, '10.0.0.7', '10.0.0.1'), 'NIDS_ALERT', 'NetworkMonitor', 'ICMP', 'ping', now=base + 3)
+        aggregator.flush()
+    finally:
+        logger.close()
+
+    fmt = lambda ts: ids.datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+    conn = sqlite3.connect(nids_config.get('DATABASE', 'PATH'))
+    rows = conn.execute("SELECT alert_key, message, first_seen, last_seen, count FROM alert_rollups ORDER BY count DESC").fetchall()
+    assert rows == [
+        ('TCP|10.0.0.5|50022|10.0.0.1|22', 'أول تنبيه', fmt(base), fmt(base + 28), 5),
+        ('ICMP|8|10.0.0.7|10.0.0.1', 'ping', fmt(base + 3), fmt(base + 3), 1),
+    ]
+    summaries = conn.execute("SELECT message FROM alerts WHERE type = 'ALERT_SUMMARY'").fetchall()
+    assert len(summaries) == 1 and 'منها 4 مكرر محذوف' in summaries[0][0]
+
+
+def test_window_without_duplicates_writes_no_summary(ids):
+    recorder = AlertRecorder()
+    aggregator = ids.AlertAggregator(recorder, window=60)
+    aggregator.record('a', 'NIDS_ALERT', 'NetworkMonitor', 'TCP', 'a')
+    aggregator.record('b', 'NIDS_ALERT', 'NetworkMonitor', 'TCP', 'b')
+    aggregator.flush()
+    assert [row[9] for row in recorder.rollups] == [1, 1]
+    assert recorder.alerts == []
+
+
+def test_keys_past_max_keys_are_counted_as_overflow(ids):
+    recorder = AlertRecorder()
+    aggregator = ids.AlertAggregator(recorder, window=60, max_keys=2)
+    for key in 'abcab':
+        aggregator.record(key, 'NIDS_ALERT', 'NetworkMonitor')
+    aggregator.record('d', 'NIDS_ALERT', 'NetworkMonitor')
+    assert aggregator.overflow == 2
+    aggregator.flush()
+    assert len(recorder.rollups) == 2
+    assert 'تجاوز حد المفاتيح (2)' in recorder.alerts[0][1]
@@ -0,0 +1,133 @@
+import os
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+
+def write_alerts(ids, rows, monkeypatch):
+    """يكتب صفوف (type, source, message, timestamp, proto) بـ log_alert (نفس مسار العدادات الحي) بأوقات محددة."""
+    clock = {}
+
+    class FixedDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return clock['now']
+
+    writer = ids.IDSLogger()
+    writer.block_when_full = True
+    with monkeypatch.context() as patch:
+        patch.setattr(ids, 'datetime', FixedDatetime)
+        for alert_type, source, message, timestamp, proto in rows:
+            clock['now'] = datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S')
+            writer.log_alert(alert_type, message, source, proto)
+    writer.close()
+
+
+@pytest.fixture
+def local_tz():
+    """منطقة زمنية بفرق نصف ساعة عن UTC، فتختلف فيها المحاذاة المحلية عن محاذاة UTC للساعة واليوم."""
+    saved = os.environ.get('TZ')
+    os.environ['TZ'] = 'Asia/Kolkata'
+    time.tzset()
+    try:
+        yield
+    finally:
+        if saved is None:
+            del os.environ['TZ']
+        else:
+            os.environ['TZ'] = saved
+        time.tzset()
+
+
+@pytest.fixture
+def base():
+    """بداية ساعة محلية قبل ساعتين (ضمن مدة الاحتفاظ بعدادات الدقيقة)."""
+    return (datetime.now() - timedelta(hours=2)).replace(minute=0, second=0, microsecond=0)
+
+
+def fmt(dt):
+    return dt.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def test_buckets_align_on_utc_epoch_live_and_backfill(ids, nids_config, local_tz, base, monkeypatch):
+    rows = [('NIDS_ALERT', 'NetworkMonitor', 'm', fmt(base + timedelta(minutes=7 * i, seconds=i)), 'TCP')
+            for i in range(20)]
+    write_alerts(ids, rows, monkeypatch)
+    conn = sqlite3.connect(nids_config.get('DATABASE', 'PATH'))
+    live = sorted(conn.execute("SELECT resolution, bucket, count FROM alert_stats"))
+    for resolution, bucket, _count in live:
+        assert bucket % resolution == 0
+    # 'Asia/Kolkata' = UTC+05:30: بداية الساعة المحلية ليست بداية فترة ساعة
+    assert int(base.timestamp()) % 3600 == 1800
+    assert sum(count for resolution, _bucket, count in live if resolution == 86400) == 20
+
+    # قاعدة بيانات قديمة بدون عدادات: البناء عند البدء يعطي نفس الفترات
+    with conn:
+        conn.execute("DELETE FROM alert_stats")
+    conn.close()
+    ids.IDSLogger().close()
+    conn = sqlite3.connect(nids_config.get('DATABASE', 'PATH'))
+    assert sorted(conn.execute("SELECT resolution, bucket, count FROM alert_stats")) == live
+    conn.close()
+
+
+@pytest.fixture
+def stats_api(ids, web_api, base, monkeypatch):
+    rows = []
+    for i in range(120): # ساعتان، تنبيه كل دقيقة
+        ts = fmt(base + timedelta(minutes=i, seconds=30))
+        rows.append(('NIDS_ALERT', f'10.0.0.{i % 4}', 'm', ts, 'TCP'))
+        if i % 10 == 0:
+            rows.append(('HIDS_ALERT', 'FileIntegrityMonitor', 'f', ts, None))
+    write_alerts(ids, rows, monkeypatch)
+    web_api.base = base
+    return web_api
+
+
+def get_stats(client, **params):
+    return client.get('/api/stats', query_string=params, headers=client.auth)
+
+
+def test_series_and_totals(stats_api):
+    start = int(stats_api.base.timestamp())
+    body = get_stats(stats_api, resolution='minute', **{'from': fmt(stats_api.base),
+                                                          'to': fmt(stats_api.base + timedelta(minutes=119))}).get_json()
+    assert body['bucket_seconds'] == 60 and body['bucket_alignment'] == 'utc'
+    assert body['totals'] == {'NIDS_ALERT': 120, 'HIDS_ALERT': 12}
+    assert body['series']['NIDS_ALERT'][:2] == [[start, 1], [start + 60, 1]]
+    assert len(body['series']['NIDS_ALERT']) == 120
+    assert [point[0] for point in body['series']['HIDS_ALERT']][:2] == [start, start + 600]
+
+    hourly = get_stats(stats_api, resolution='hour', type='NIDS_ALERT', **{'from': fmt(stats_api.base),
+                                                                          'to': fmt(stats_api.base + timedelta(minutes=119))}).get_json()
+    assert sum(count for _bucket, count in hourly['series']['NIDS_ALERT']) == 120
+    assert all(bucket % 3600 == 0 for bucket, _count in hourly['series']['NIDS_ALERT'])
+    assert list(hourly['totals']) == ['NIDS_ALERT']
+
+
+def test_top_sources(stats_api):
+    body = get_stats(stats_api, resolution='hour', top=3, **{'from': fmt(stats_api.base)}).get_json()
+    assert [row['count'] for row in body['top_sources']] == [30, 30, 30]
+    assert {row['source'] for row in body['top_sources']} <= {f'10.0.0.{i}' for i in range(4)} # لا FileIntegrityMonitor (12)
+    tcp = get_stats(stats_api, resolution='day', proto='TCP', top=10, **{'from': fmt(stats_api.base)}).get_json()
+    assert sorted(row['source'] for row in tcp['top_sources']) == [f'10.0.0.{i}' for i in range(4)]
+
+
+@pytest.mark.parametrize('params', [
+    {'resolution': 'minute', 'from': '2026-01-01 00:00:00', 'to': '2026-01-05 00:00:00'}, # 5760 فترة
+    {'resolution': 'week'},
+    {'resolution': 'hour', 'top': 'many'},
+    {'resolution': 'hour', 'from': 'yesterday'},
+])
+def test_bad_parameters_return_400(stats_api, params):
+    response = get_stats(stats_api, **params)
+    assert response.status_code == 400 and 'error' in response.get_json()
+
+
+def test_unchanged_stats_return_304(stats_api):
+    params = {'resolution': 'hour', 'from': fmt(stats_api.base), 'to': fmt(stats_api.base + timedelta(hours=2))}
+    first = get_stats(stats_api, **params)
+    again = stats_api.get('/api/stats', query_string=params, headers={**stats_api.auth, 'If-None-Match': first.headers['ETag']})
+    assert again.status_code == 304
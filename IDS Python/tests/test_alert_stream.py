@@ -0,0 +1,128 @@
+import threading
+
+import pytest
+
+from test_alerts_api import insert_alerts
+
+
+@pytest.fixture
+def stream(ids, web_api):
+    broadcaster = ids.AlertBroadcaster(ids.config)
+    broadcaster.heartbeat = 0.05
+    ids.alert_broadcaster = broadcaster
+    web_api.logger.broadcaster = broadcaster
+    web_api.broadcaster = broadcaster
+    try:
+        yield web_api
+    finally:
+        del ids.alert_broadcaster
+        broadcaster.close()
+
+
+def open_stream(client, last_event_id=None):
+    headers = dict(client.auth)
+    if last_event_id is not None:
+        headers['Last-Event-ID'] = str(last_event_id)
+    return client.get('/api/alerts/stream', headers=headers, buffered=False)
+
+
+def event_ids(chunk):
+    return [int(line[4:]) for line in chunk.decode('utf-8').split('\n') if line.startswith('id: ')]
+
+
+def alert(alert_id):
+    return {'id': alert_id, 'type': 'NIDS_ALERT', 'source': 'test', 'message': f'alert {alert_id}',
+            'timestamp': '2026-10-18 10:00:00', 'proto': 'TCP'}
+
+
+def test_last_event_id_backfills_then_dedups_live_frames(stream):
+    insert_alerts(stream, [('NIDS_ALERT', 'test', f'alert {i}', '2026-10-18 10:00:00', 'TCP') for i in range(1, 6)])
+    response = open_stream(stream, last_event_id=2)
+    chunks = response.iter_encoded()
+    try:
+        assert next(chunks) == b'retry: 3000\n\n'
+        assert event_ids(next(chunks)) == [3, 4, 5]
+        # 5 كتب أثناء الاستئناف فوصل عبر البث أيضاً: لا يعاد إرساله
+        stream.broadcaster.publish([alert(5), alert(6)])
+        assert event_ids(next(chunks)) == [6]
+        assert next(chunks) == b': keep-alive\n\n'
+    finally:
+        response.close()
+    assert stream.broadcaster.client_count == 0
+
+
+def test_backfill_beyond_limit_sends_gap_event(stream):
+    stream.broadcaster.backfill_max = 2
+    insert_alerts(stream, [('NIDS_ALERT', 'test', f'alert {i}', '2026-10-18 10:00:00', 'TCP') for i in range(1, 6)])
+    response = open_stream(stream, last_event_id=0)
+    chunks = response.iter_encoded()
+    try:
+        next(chunks)
+        assert event_ids(next(chunks)) == [1, 2]
+        assert next(chunks) == b'event: gap\ndata: {"after_id": 2}\n\n'
+    finally:
+        response.close()
+
+
+def test_alerts_written_by_logger_reach_stream(stream):
+    response = open_stream(stream)
+    chunks = response.iter_encoded()
+    try:
+        next(chunks)
+        stream.logger.log_alert('HIDS_ALERT', 'مباشر', 'test')
+        frame = next(chunk for chunk in chunks if chunk != b': keep-alive\n\n')
+        assert event_ids(frame) == [1] and 'مباشر' in frame.decode('utf-8')
+    finally:
+        response.close()
+
+
+def test_slow_consumer_is_dropped(stream):
+    stream.broadcaster.buffer_size = 3
+    response = open_stream(stream)
+    chunks = response.iter_encoded()
+    try:
+        next(chunks)
+        stream.broadcaster.publish([alert(1), alert(2)])
+        stream.broadcaster.publish([alert(3), alert(4)]) # لم يقرأ شيئاً: المخزن يتجاوز 3
+        assert stream.broadcaster.dropped_clients == 1
+        assert stream.broadcaster.client_count == 0
+        # المولد ينتهي فيعيد المتصفح الاتصال بـ Last-Event-ID
+        assert list(chunks) == []
+    finally:
+        response.close()
+
+
+def test_client_limit_and_release_on_close(stream):
+    stream.broadcaster.max_clients = 1
+    first = open_stream(stream)
+    second = open_stream(stream)
+    assert second.status_code == 503 and second.headers['Retry-After'] == '30'
+    # إغلاق الاستجابة قبل قراءة أي شيء (المولد لم يبدأ) يحرر المكان
+    first.close()
+    assert stream.broadcaster.client_count == 0
+    third = open_stream(stream)
+    assert third.status_code == 200
+    third.close()
+
+
+def test_try_subscribe_never_exceeds_max_clients(ids):
+    broadcaster = ids.AlertBroadcaster(ids.config)
+    broadcaster.max_clients = 8
+    results = []
+    barrier = threading.Barrier(32)
+
+    def worker():
+        barrier.wait()
+        results.append(broadcaster.try_subscribe())
+
+    threads = [threading.Thread(target=worker) for _ in range(32)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sum(subscriber is not None for subscriber in results) == 8
+    assert broadcaster.client_count == 8
+
+
+def test_bad_last_event_id_returns_400(stream):
+    assert open_stream(stream, last_event_id='abc').status_code == 400
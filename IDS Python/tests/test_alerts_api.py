@@ -0,0 +1,84 @@
+import sqlite3
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+
+def insert_alerts(client, rows):
+    """يدرج صفوف (type, source, message, timestamp, proto) مباشرة بأوقات محددة."""
+    conn = sqlite3.connect(client.logger.db_path)
+    with conn:
+        conn.executemany("INSERT INTO alerts (type, source, message, timestamp, proto) VALUES (?, ?, ?, ?, ?)", rows)
+    conn.close()
+
+
+@pytest.fixture
+def api(web_api):
+    insert_alerts(web_api, [('NIDS_ALERT' if i % 2 else 'HIDS_ALERT', 'test', f'alert {i}',
+                             f'2026-10-18 10:{i:02d}:00', 'TCP' if i % 2 else None) for i in range(1, 11)])
+    return web_api
+
+
+def get(client, query='', **headers):
+    return client.get(f'/api/alerts{query}', headers={**client.auth, **headers})
+
+
+def ids_of(response):
+    return [alert['id'] for alert in response.get_json()]
+
+
+def test_requires_auth(api):
+    assert api.get('/api/alerts').status_code == 401
+
+
+def test_before_id_pages_newest_first(api):
+    first = get(api, '?limit=4')
+    assert ids_of(first) == [10, 9, 8, 7]
+    assert first.headers['X-Next-Before-Id'] == '7' and first.headers['X-Next-Since-Id'] == '10'
+    second = get(api, '?limit=4&before_id=7')
+    assert ids_of(second) == [6, 5, 4, 3]
+    last = get(api, '?limit=4&before_id=3')
+    assert ids_of(last) == [2, 1]
+    assert 'X-Next-Before-Id' not in last.headers # صفحة ناقصة: لا صفحات أقدم
+
+
+def test_since_id_returns_oldest_new_rows_first_page(api):
+    page = get(api, '?since_id=4&limit=3')
+    # الأقدم ضمن الحد حتى لا تفوت صفوف، والنتيجة معروضة من الأحدث للأقدم
+    assert ids_of(page) == [7, 6, 5]
+    assert page.headers['X-Next-Since-Id'] == '7' and page.headers['X-Has-More'] == '1'
+    rest = get(api, '?since_id=7&limit=3')
+    assert ids_of(rest) == [10, 9, 8]
+    empty = get(api, '?since_id=10&limit=3')
+    assert ids_of(empty) == [] and empty.headers['X-Next-Since-Id'] == '10'
+    assert 'X-Has-More' not in empty.headers
+
+
+def test_filters_and_time_range(api):
+    assert ids_of(get(api, '?type=NIDS_ALERT&limit=3')) == [9, 7, 5]
+    assert ids_of(get(api, '?proto=TCP&before_id=5')) == [3, 1]
+    assert ids_of(get(api, '?from=2026-10-18 10:03:00&to=2026-10-18T10:05:00')) == [5, 4, 3]
+    assert ids_of(get(api, '?from=2026-10-18 11:00:00')) == []
+
+
+def test_timezone_aware_times_are_converted_to_local(api):
+    local = datetime(2026, 10, 18, 10, 4).astimezone() # الأوقات المخزنة محلية
+    for value in (local.astimezone(timezone(timedelta(hours=3))).isoformat(),
+                  local.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')):
+        assert ids_of(get(api, f'?from={value.replace("+", "%2B")}&limit=100')) == [10, 9, 8, 7, 6, 5, 4]
+
+
+def test_unchanged_poll_returns_304(api):
+    first = get(api, '?since_id=10')
+    assert first.status_code == 200 and first.headers['ETag']
+    assert get(api, '?since_id=10', **{'If-None-Match': first.headers['ETag']}).status_code == 304
+    insert_alerts(api, [('HIDS_ALERT', 'test', 'new', '2026-10-18 10:11:00', None)])
+    changed = get(api, '?since_id=10', **{'If-None-Match': first.headers['ETag']})
+    assert changed.status_code == 200 and ids_of(changed) == [11]
+
+
+@pytest.mark.parametrize('query', ['?limit=abc', '?limit=-1', '?since_id=x', '?before_id=1.5',
+                                   '?from=yesterday', '?to=2026-13-01'])
+def test_bad_parameters_return_400(api, query):
+    response = get(api, query)
+    assert response.status_code == 400 and 'error' in response.get_json()
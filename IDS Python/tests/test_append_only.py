@@ -0,0 +1,92 @@
+import hashlib
+import os
+
+import pytest
+
+from conftest import AlertRecorder
+
+
+@pytest.fixture
+def append_log(ids, tmp_path, monkeypatch):
+    """FileMonitor يراقب ملف سجل واحداً بوضع الإضافة فقط."""
+    log = tmp_path / 'auth.log'
+    log.write_bytes(b''.join(b'line %06d\n' % i for i in range(20000)))
+    monkeypatch.setattr(ids.AppConfig, 'SENSITIVE_FILES', [str(log)])
+    monkeypatch.setattr(ids.AppConfig, 'APPEND_ONLY_FILES', [str(log)])
+    monkeypatch.setitem(ids.config['HIDS'], 'PERSIST_BASELINES', 'no')
+    sink = AlertRecorder()
+    return log, sink, ids.FileMonitor(sink)
+
+
+def messages(sink):
+    return [message for _alert_type, message, _proto in sink.alerts]
+
+
+def test_appends_hash_only_new_bytes_without_alert(append_log):
+    log, sink, monitor = append_log
+    for i in range(5):
+        with log.open('ab') as f:
+            f.write(b'appended %d\n' % i)
+        monitor._check_append_only(log)
+    assert sink.alerts == []
+    state = monitor.append_states[str(log)]
+    assert state.offset == log.stat().st_size
+    # التجزئة المتتابعة تساوي تجزئة الملف كاملاً
+    assert monitor.file_hashes[str(log)] == hashlib.sha256(log.read_bytes()).hexdigest()
+
+
+def test_truncation_is_reported(append_log):
+    log, sink, monitor = append_log
+    with log.open('r+b') as f:
+        f.truncate(1000)
+    monitor._check_append_only(log)
+    assert len(sink.alerts) == 1 and 'اقتطاع' in messages(sink)[0]
+    # الحالة أعيد بناؤها من المحتوى الحالي، فالإضافة التالية لا تنبه
+    with log.open('ab') as f:
+        f.write(b'next\n')
+    monitor._check_append_only(log)
+    assert len(sink.alerts) == 1
+
+
+@pytest.mark.parametrize('offset', [10, -10])
+def test_rewrite_in_head_or_tail_window_is_reported(append_log, offset):
+    log, sink, monitor = append_log
+    with log.open('r+b') as f:
+        f.seek(offset, os.SEEK_SET if offset >= 0 else os.SEEK_END)
+        f.write(b'EDITED')
+    monitor._check_append_only(log)
+    assert len(sink.alerts) == 1 and 'إعادة كتابة' in messages(sink)[0]
+
+
+def test_replaced_inode_and_mode_change_are_reported(append_log, tmp_path):
+    log, sink, monitor = append_log
+    os.chmod(log, 0o666)
+    monitor._check_append_only(log)
+    assert len(sink.alerts) == 1 and 'صلاحيات' in messages(sink)[0]
+
+    replacement = tmp_path / 'auth.log.new'
+    replacement.write_bytes(log.read_bytes() + b'forged\n')
+    os.replace(replacement, log)
+    monitor._check_append_only(log)
+    assert len(sink.alerts) == 2 and 'inode' in messages(sink)[1]
+
+
+def test_full_scan_detects_rewrite_in_middle_of_file(append_log, ids, monkeypatch):
+    log, sink, monitor = append_log
+    monkeypatch.setitem(ids.config['HIDS'], 'FULL_SCAN_IO_LIMIT_MB', '0')
+    # الإضافة مسموحة: لا تنبيه من الحدث ولا من الفحص الدوري
+    with log.open('ab') as f:
+        f.write(b'appended\n')
+    monitor._check_append_only(log)
+    assert monitor.full_scan()['mismatches'] == 0
+
+    # تعديل في وسط الملف بنفس الطول: نافذتا البداية والنهاية لا تتغيران
+    with log.open('r+b') as f:
+        f.seek(100000)
+        f.write(b'EDITED')
+    monitor._check_append_only(log)
+    assert sink.alerts == []
+    assert monitor.full_scan()['mismatches'] == 1
+    assert len(sink.alerts) == 1 and 'auth.log' in messages(sink)[0]
+    # الحالة أعيد بناؤها من المحتوى الحالي
+    assert monitor.full_scan()['mismatches'] == 0
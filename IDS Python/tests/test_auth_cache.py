@@ -0,0 +1,66 @@
+import time
+
+import pytest
+from werkzeug.security import generate_password_hash
+
+
+@pytest.fixture
+def auth(ids, monkeypatch):
+    """verify_password بتجزئة werkzeug حقيقية (تكرارات قليلة) مع عد استدعاءات check_password_hash."""
+    saved = dict(ids.config.items('WEB', raw=True))
+    ids.config.set('WEB', 'USERNAME', 'admin')
+    ids.config.set('WEB', 'PASSWORD', generate_password_hash('secret', method='pbkdf2:sha256:1000'))
+    monkeypatch.setattr(ids, 'credential_cache', ids.CredentialCache(300))
+    calls = []
+    real_check = ids.check_password_hash
+
+    def counting_check(stored, password):
+        calls.append(password)
+        return real_check(stored, password)
+
+    monkeypatch.setattr(ids, 'check_password_hash', counting_check)
+    try:
+        yield calls
+    finally:
+        for key, value in saved.items():
+            ids.config.set('WEB', key, value)
+
+
+def test_successful_login_is_cached(ids, auth):
+    assert ids.verify_password('admin', 'secret')
+    assert ids.verify_password('admin', 'secret')
+    assert ids.verify_password('admin', 'secret')
+    assert auth == ['secret'] # تجزئة واحدة فقط
+    assert (ids.credential_cache.hits, ids.credential_cache.misses) == (2, 1)
+
+
+def test_failures_are_not_cached(ids, auth):
+    assert ids.verify_password('admin', 'secret')
+    for _ in range(3):
+        assert not ids.verify_password('admin', 'wrong')
+    assert auth == ['secret', 'wrong', 'wrong', 'wrong']
+    assert not ids.verify_password('root', 'secret') # اسم مستخدم خاطئ لا يصل للتجزئة
+    assert len(auth) == 4
+
+
+def test_password_change_invalidates_cache(ids, auth):
+    assert ids.verify_password('admin', 'secret')
+    ids.config.set('WEB', 'PASSWORD', generate_password_hash('new-secret', method='pbkdf2:sha256:1000'))
+    assert not ids.verify_password('admin', 'secret')
+    assert ids.verify_password('admin', 'new-secret')
+    assert auth == ['secret', 'secret', 'new-secret']
+
+
+def test_entry_expires_after_ttl(ids, auth, monkeypatch):
+    monkeypatch.setattr(ids, 'credential_cache', ids.CredentialCache(0.05))
+    assert ids.verify_password('admin', 'secret')
+    time.sleep(0.1)
+    assert ids.verify_password('admin', 'secret')
+    assert auth == ['secret', 'secret']
+
+
+def test_cache_disabled_with_zero_ttl(ids, auth, monkeypatch):
+    monkeypatch.setattr(ids, 'credential_cache', ids.CredentialCache(0))
+    assert ids.verify_password('admin', 'secret')
+    assert ids.verify_password('admin', 'secret')
+    assert len(auth) == 2
@@ -0,0 +1,99 @@
+import os
+
+import pytest
+
+from conftest import AlertRecorder
+
+
+def failed(second, ip='203.0.113.5', user='root'):
+    return f"2026-10-18T10:{second // 60:02d}:{second % 60:02d} host sshd[100]: Failed password for {user} from {ip} port 50000 ssh2"
+
+
+@pytest.fixture
+def monitor(ids, tmp_path):
+    monitor = ids.AuthLogMonitor(AlertRecorder(), ids.config)
+    monitor.path = str(tmp_path / 'auth.log')
+    assert (monitor.window, monitor.failure_threshold, monitor.invalid_threshold) == (60, 5, 3)
+    return monitor
+
+
+def messages(monitor):
+    return [message for _type, message, _proto in monitor.logger.alerts]
+
+
+def test_brute_force_fires_at_threshold_within_window(monitor):
+    monitor.process_lines([failed(s) for s in range(4)])
+    assert messages(monitor) == []
+    monitor.process_lines([failed(4)])
+    assert len(messages(monitor)) == 1 and 'هجوم تخمين كلمات مرور SSH من 203.0.113.5' in messages(monitor)[0]
+    # تنبيه واحد لكل نافذة مهما استمر الهجوم
+    monitor.process_lines([failed(s) for s in range(5, 30)])
+    assert len(messages(monitor)) == 1
+
+
+def test_failures_spread_beyond_window_do_not_fire(monitor):
+    monitor.process_lines([failed(s * 20) for s in range(10)]) # 5 محاولات تمتد 80 ثانية
+    assert messages(monitor) == []
+
+
+def test_repeated_message_counts_and_invalid_users(monitor):
+    monitor.process_lines(["2026-10-18T10:00:00 host sshd[100]: message repeated 4 times: "
+                           "[ Failed password for root from 198.51.100.7 port 22 ssh2]"])
+    assert messages(monitor) == []
+    monitor.process_lines([failed(1, ip='198.51.100.7')])
+    assert len(messages(monitor)) == 1
+    monitor.process_lines([f"2026-10-18T10:00:0{s} host sshd[101]: Invalid user admin{s} from 192.0.2.9 port 4000"
+                           for s in range(3)])
+    assert 'محاولات SSH بأسماء مستخدمين غير موجودة من 192.0.2.9' in messages(monitor)[-1]
+    monitor.process_lines(["2026-10-18T10:00:05 host sshd[102]: Accepted password for root from 198.51.100.7 port 22 ssh2"])
+    assert 'دخول SSH ناجح من 198.51.100.7 بعد هجوم' in messages(monitor)[-1]
+
+
+def test_sudo_failures_and_not_in_sudoers(monitor):
+    monitor.process_lines(["2026-10-18T10:00:00 host sudo:     eve : 2 incorrect password attempts ; TTY=pts/0"])
+    assert messages(monitor) == []
+    monitor.process_lines(["2026-10-18T10:00:10 host sudo:     eve : 1 incorrect password attempt ; TTY=pts/0",
+                           "2026-10-18T10:00:11 host sudo:     bob : user NOT in sudoers ; TTY=pts/1"])
+    assert len(messages(monitor)) == 2
+    assert 'للمستخدم eve' in messages(monitor)[0] and 'bob' in messages(monitor)[1]
+
+
+def test_attack_survives_logrotate_inode_change(monitor):
+    with open(monitor.path, 'w') as f:
+        f.write('\n'.join(failed(s) for s in range(2)) + '\n')
+    monitor._open(from_end=False)
+    monitor._drain()
+    # logrotate: نقل الملف، والكاتب (rsyslog) يضيف سطراً إلى القديم قبل إعادة الفتح
+    os.rename(monitor.path, monitor.path + '.1')
+    with open(monitor.path + '.1', 'a') as f:
+        f.write(failed(2) + '\n')
+    with open(monitor.path, 'w') as f:
+        f.write('\n'.join(failed(s) for s in range(3, 5)) + '\n')
+    try:
+        monitor._drain()
+    finally:
+        monitor._close()
+    assert monitor.rotations == 1 and monitor.lines == 5
+    assert len(messages(monitor)) == 1
+
+
+def test_copytruncate_reads_from_start(monitor):
+    with open(monitor.path, 'w') as f:
+        f.write('\n'.join(failed(s) for s in range(3)) + '\n')
+    monitor._open(from_end=False)
+    monitor._drain()
+    with open(monitor.path, 'w') as f: # اقتطاع ثم كتابة أقل مما قرئ سابقاً
+        f.write('\n'.join(failed(s) for s in range(3, 5)) + '\n')
+    try:
+        monitor._drain()
+    finally:
+        monitor._close()
+    assert monitor.rotations == 1 and len(messages(monitor)) == 1
+
+
+def test_sources_bounded_by_max_sources(monitor):
+    monitor.max_sources = 100
+    monitor.process_lines([failed(i % 60, ip=f'10.0.{i >> 8 & 255}.{i & 255}') for i in range(5000)])
+    assert len(monitor.sources) == 100
+    assert monitor.evicted == 4900
+    assert list(monitor.sources)[-1] == ('ssh', '10.0.19.135') # الأحدث نشاطاً يبقى
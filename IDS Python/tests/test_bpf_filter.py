@@ -0,0 +1,139 @@
+import json
+import struct
+
+from conftest import FIXTURES, NIDS_SAMPLE_PCAP, AlertRecorder, tcp_frame
+
+ETH_P_8021Q = 0x8100
+# برنامج BPF الذي تترجمه libpcap لمرشح إعدادات nids_sample.pcap (انظر fixtures/make_bpf_program.py)
+SAMPLE_BPF = FIXTURES / 'nids_sample_bpf.json'
+
+
+def run_bpf(program, packet):
+    """منفذ BPF الكلاسيكي (نفس دلالات المرشح في النواة). يعيد طول ما يمرر من الحزمة، و 0 للرفض."""
+    a = x = pc = 0
+    mem = [0] * 16
+    length = len(packet)
+
+    def load(offset, size):
+        if offset < 0 or offset + size > length:
+            return None
+        return int.from_bytes(packet[offset:offset + size], 'big')
+
+    while True:
+        code, jt, jf, k = program[pc]
+        pc += 1
+        cls = code & 0x07
+        if cls in (0x00, 0x01): # LD / LDX
+            mode, size = code & 0xE0, {0x00: 4, 0x08: 2, 0x10: 1}[code & 0x18]
+            if mode == 0x00: value = k
+            elif mode == 0x20: value = load(k, size)
+            elif mode == 0x40: value = load(x + k, size)
+            elif mode == 0x60: value = mem[k]
+            elif mode == 0x80: value = length
+            else: # MSH: 4 * (packet[k] & 0x0f)
+                value = load(k, 1)
+                value = None if value is None else (value & 0x0F) * 4
+            if value is None:
+                return 0 # قراءة خارج حدود الحزمة ترفضها
+            if cls == 0x00: a = value
+            else: x = value
+        elif cls == 0x02: mem[k] = a
+        elif cls == 0x03: mem[k] = x
+        elif cls == 0x04: # ALU
+            op, operand = code & 0xF0, (x if code & 0x08 else k)
+            if op == 0x80: a = -a
+            elif op in (0x30, 0x90) and operand == 0: return 0
+            else:
+                a = {0x00: lambda: a + operand, 0x10: lambda: a - operand, 0x20: lambda: a * operand,
+                     0x30: lambda: a // operand, 0x40: lambda: a | operand, 0x50: lambda: a & operand,
+                     0x60: lambda: a << operand, 0x70: lambda: a >> operand, 0x90: lambda: a % operand,
+                     0xA0: lambda: a ^ operand}[op]()
+            a &= 0xFFFFFFFF
+        elif cls == 0x05: # JMP
+            op, operand = code & 0xF0, (x if code & 0x08 else k)
+            if op == 0x00:
+                pc += k
+                continue
+            taken = {0x10: a == operand, 0x20: a > operand, 0x30: a >= operand, 0x40: bool(a & operand)}[op]
+            pc += jt if taken else jf
+        elif cls == 0x06: # RET
+            return a if code & 0x18 == 0x10 else k
+        else: # MISC: TAX / TXA
+            if code & 0xF8 == 0x00: x = a
+            else: a = x
+
+
+def sample_filter(expression):
+    """يعيد دالة تطبق البرنامج المحفوظ على إطار Ethernet، بعد التأكد من أنه مترجم من نفس التعبير."""
+    compiled = json.loads(SAMPLE_BPF.read_text())
+    assert compiled['expression'] == expression, (
+        f"مرشح BPF تغير، أعد توليد البرنامج: python tests/fixtures/make_bpf_program.py \"{expression}\"")
+    program = [tuple(insn) for insn in compiled['program']]
+    return lambda frame: run_bpf(program, frame) != 0
+
+
+def replay(ids, config, packet_filter=None):
+    """يمرر nids_sample.pcap عبر _packet_handler (ما يمرره المرشح فقط إن وجد). يعيد (التنبيهات، عدد الحزم المعالجة)."""
+    from scapy.utils import PcapReader
+    sink = AlertRecorder()
+    monitor = ids.NetworkMonitor(sink, config)
+    handled = 0
+    with PcapReader(str(NIDS_SAMPLE_PCAP)) as reader:
+        for packet in reader:
+            frame = bytes(packet)
+            # وسم VLAN يزال من الإطار في الالتقاط الحي قبل تطبيق المرشح في النواة، أما في الملف فيبقى داخله
+            if struct.unpack_from('!H', frame, 12)[0] == ETH_P_8021Q:
+                continue
+            if packet_filter is not None and not packet_filter(frame):
+                continue
+            handled += 1
+            monitor._packet_handler(packet)
+    return sink.alerts, handled, monitor.bpf_filter
+
+
+def test_bpf_filter_keeps_alerts_with_fraction_of_packets(ids, nids_config):
+    unfiltered_alerts, all_packets, expression = replay(ids, nids_config)
+    filtered_alerts, filtered_packets, _ = replay(ids, nids_config, sample_filter(expression))
+
+    assert unfiltered_alerts, "الملف يجب أن يطلق تنبيهات"
+    assert filtered_alerts == unfiltered_alerts
+    assert filtered_packets < all_packets / 2
+
+
+def test_bpf_filter_excludes_whitelist_in_kernel(ids, nids_config):
+    from scapy.all import IP, IPv6, PcapReader
+    monitor = ids.NetworkMonitor(AlertRecorder(), nids_config)
+    matches = sample_filter(monitor.bpf_filter)
+    whitelisted = set()
+    with PcapReader(str(NIDS_SAMPLE_PCAP)) as reader:
+        for packet in reader:
+            layer = IP if packet.haslayer(IP) else IPv6 if packet.haslayer(IPv6) else None
+            if layer and packet[layer].src in ('192.0.2.10', '2001:db8:ff::1'):
+                whitelisted.add(packet[layer].src)
+                assert not matches(bytes(packet))
+    assert whitelisted == {'192.0.2.10', '2001:db8:ff::1'}
+
+
+def test_reload_rules_rebuilds_filter(ids, nids_config):
+    monitor = ids.NetworkMonitor(AlertRecorder(), nids_config)
+    assert 'port 22 ' in monitor.bpf_filter
+    nids_config.set('NIDS', 'SUSPICIOUS_PORTS', '4444')
+    nids_config.set('NETWORK', 'WHITELIST_IPS', '198.51.100.7')
+    monitor.reload_rules()
+    assert monitor.suspicious_ports == {4444}
+    assert 'port 4444' in monitor.bpf_filter and 'port 22 ' not in monitor.bpf_filter
+    assert 'host 198.51.100.7' in monitor.bpf_filter
+
+
+def test_large_whitelist_stays_out_of_bpf_filter(ids, nids_config):
+    networks = [f"10.{i // 256}.{i % 256}.0/24" for i in range(0, 2000, 2)]
+    nids_config.set('NETWORK', 'WHITELIST_IPS', ', '.join(networks))
+    sink = AlertRecorder()
+    monitor = ids.NetworkMonitor(sink, nids_config, replay=True, workers=0)
+    assert len(monitor.whitelist_ips.networks) > monitor.BPF_WHITELIST_MAX_TERMS
+    assert ' net ' not in monitor.bpf_filter and 'not (' not in monitor.bpf_filter
+    # الاستثناء يبقى فعالاً في مسار المعالجة
+    monitor._process_packet(ids.parse_link_frame(1, tcp_frame('10.0.4.9', '172.16.0.1', 40000, 22, 0x02)), 0.0)
+    assert sink.alerts == []
+    monitor._process_packet(ids.parse_link_frame(1, tcp_frame('10.0.5.9', '172.16.0.1', 40000, 22, 0x02)), 0.0)
+    assert len(sink.alerts) == 1
@@ -0,0 +1,41 @@
+import pytest
+
+from conftest import NIDS_SAMPLE_PCAP, AlertRecorder
+
+
+def replay_alerts(ids, config, engine):
+    """يمرر nids_sample.pcap عبر مسار المحرك: تحليل Scapy، أو تحليل الترويسات المباشر في المحرك الخام."""
+    from scapy.utils import PcapReader
+    config.set('NETWORK', 'ENGINE', engine)
+    sink = AlertRecorder()
+    monitor = ids.NetworkMonitor(sink, config)
+    assert monitor.engine == engine
+    with PcapReader(str(NIDS_SAMPLE_PCAP)) as reader:
+        for packet in reader:
+            if engine == 'scapy':
+                monitor._packet_handler(packet)
+            else:
+                info = ids.parse_ethernet_frame(bytes(packet))
+                if info is not None:
+                    monitor._process_packet(info)
+    return sink.alerts
+
+
+def test_raw_and_scapy_engines_raise_same_alerts(ids, nids_config):
+    if not ids.SCAPY_AVAILABLE:
+        pytest.skip("Scapy غير متاحة")
+    if not ids.RAW_CAPTURE_AVAILABLE:
+        pytest.skip("محرك الالتقاط الخام غير متاح على هذا النظام")
+    scapy_alerts = replay_alerts(ids, nids_config, 'scapy')
+    raw_alerts = replay_alerts(ids, nids_config, 'raw')
+    assert raw_alerts == scapy_alerts
+
+    messages = [message for _type, message, _proto in raw_alerts]
+    # IPv4 (TCP و UDP)، IPv6، ICMP و ICMPv6 Echo، إطار VLAN، ومسح المنافذ
+    for expected in ('10.0.0.5:50022 -> 10.0.0.1:22', '10.0.0.6:53000 -> 10.0.0.1:53',
+                     '2001:db8::5:51000 -> 2001:db8::1:3389', 'ICMP Ping (Echo Request, Type: 8) من 10.0.0.7',
+                     'ICMPv6 Ping (Echo Request, Type: 128) من 2001:db8::7', '10.0.0.30:52000 -> 10.0.0.1:23',
+                     'مسح منافذ محتمل من 10.0.0.99'):
+        assert any(expected in message for message in messages), expected
+    # المصادر الموثوقة لا تطلق تنبيهات
+    assert not any('192.0.2.10' in message or '2001:db8:ff::' in message for message in messages)
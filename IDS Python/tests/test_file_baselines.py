@@ -0,0 +1,73 @@
+import os
+import sqlite3
+
+import pytest
+
+
+@pytest.fixture
+def hids_files(ids, tmp_path, monkeypatch):
+    """ملفات حساسة (منها سجل بوضع الإضافة) مع قاعدة بيانات مؤقتة لخطوط الأساس."""
+    files = {name: tmp_path / name for name in ('passwd', 'shadow', 'sudoers', 'auth.log')}
+    for name, path in files.items():
+        path.write_bytes(b'%s original\n' % name.encode() * 1000)
+    monkeypatch.setattr(ids.AppConfig, 'SENSITIVE_FILES', [str(path) for path in files.values()])
+    monkeypatch.setattr(ids.AppConfig, 'APPEND_ONLY_FILES', [str(files['auth.log'])])
+    monkeypatch.setitem(ids.config['HIDS'], 'PERSIST_BASELINES', 'yes')
+    monkeypatch.setitem(ids.config['DATABASE'], 'PATH', str(tmp_path / 'ids.db'))
+    return files
+
+
+def start_monitor(ids, monkeypatch):
+    """يشغل FileMonitor بمسجل حقيقي (خطوط الأساس تمر عبر طابور الكتابة). يعيد (الملفات المجزأة، تنبيهات HIDS، المراقب)."""
+    hashed = []
+    calculate = ids.FileMonitor._calculate_hash
+    monkeypatch.setattr(ids.FileMonitor, '_calculate_hash', lambda self, path, *args: hashed.append(path.name) or calculate(self, path, *args))
+    logger = ids.IDSLogger()
+    try:
+        monitor = ids.FileMonitor(logger)
+    finally:
+        logger.close()
+    conn = sqlite3.connect(ids.config.get('DATABASE', 'PATH'))
+    alerts = [message for (message,) in conn.execute("SELECT message FROM alerts WHERE type = 'HIDS_ALERT' ORDER BY id")]
+    conn.execute("DELETE FROM alerts")
+    conn.commit()
+    conn.close()
+    return sorted(hashed), alerts, monitor
+
+
+def test_unchanged_files_are_not_rehashed_on_restart(ids, hids_files, monkeypatch):
+    hashed, alerts, _monitor = start_monitor(ids, monkeypatch)
+    assert hashed == ['passwd', 'shadow', 'sudoers'] and alerts == []
+
+    hashed, alerts, monitor = start_monitor(ids, monkeypatch)
+    assert hashed == [] and alerts == []
+    assert monitor.unchanged_at_start == 4
+    assert monitor.file_hashes[str(hids_files['passwd'])] == monitor._calculate_hash(hids_files['passwd'])
+
+
+def test_offline_changes_are_reported_on_restart(ids, hids_files, monkeypatch):
+    start_monitor(ids, monkeypatch)
+    hids_files['passwd'].write_bytes(b'evil:x:0:0\n')
+    hids_files['shadow'].unlink()
+    os.utime(hids_files['sudoers']) # touch فقط: نفس المحتوى
+    with hids_files['auth.log'].open('ab') as f:
+        f.write(b'appended while down\n') # الإضافة إلى السجل مسموحة
+
+    hashed, alerts, _monitor = start_monitor(ids, monkeypatch)
+    assert hashed == ['passwd', 'sudoers']
+    assert len(alerts) == 2
+    assert any('أثناء توقف النظام' in message and 'passwd' in message and 'المحتوى' in message for message in alerts)
+    assert any('حذف ملف حساس أثناء توقف النظام' in message and 'shadow' in message for message in alerts)
+
+    # الحالة الجديدة أصبحت خط الأساس: إعادة التشغيل التالية لا تنبه ولا تعيد التجزئة
+    hashed, alerts, _monitor = start_monitor(ids, monkeypatch)
+    assert hashed == [] and alerts == []
+
+
+def test_offline_rewrite_of_append_only_prefix_is_reported(ids, hids_files, monkeypatch):
+    start_monitor(ids, monkeypatch)
+    with hids_files['auth.log'].open('r+b') as f:
+        f.write(b'FORGED')
+
+    _hashed, alerts, _monitor = start_monitor(ids, monkeypatch)
+    assert len(alerts) == 1 and 'auth.log' in alerts[0]
@@ -0,0 +1,79 @@
+import time
+
+import pytest
+
+from conftest import AlertRecorder
+
+
+@pytest.fixture
+def event_monitor(ids, tmp_path, monkeypatch):
+    """FileMonitor بخيط التحقق فقط (الأحداث تمرر مباشرة إلى _handle_event بدلاً من مراقب حقيقي)."""
+    target = tmp_path / 'passwd'
+    target.write_text('root:x:0:0\n')
+    monkeypatch.setattr(ids.AppConfig, 'SENSITIVE_FILES', [str(target)])
+    monkeypatch.setattr(ids.AppConfig, 'APPEND_ONLY_FILES', [])
+    for key, value in (('PERSIST_BASELINES', 'no'), ('FULL_SCAN_INTERVAL', '0'),
+                       ('EVENT_QUIET_PERIOD', '0.2'), ('EVENT_MAX_DELAY', '1')):
+        monkeypatch.setitem(ids.config['HIDS'], key, value)
+    sink = AlertRecorder()
+    monitor = ids.FileMonitor(sink)
+    hashed = []
+    calculate = ids.FileMonitor._calculate_hash
+    monkeypatch.setattr(monitor, '_calculate_hash', lambda path, *args: hashed.append(path) or calculate(monitor, path, *args))
+    monitor._start_event_thread()
+    yield target, sink, monitor, hashed
+    monitor.stop()
+
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "انتهت المهلة"
+        time.sleep(0.02)
+
+
+def test_burst_collapses_into_one_verification(event_monitor):
+    target, sink, monitor, hashed = event_monitor
+    path = str(target)
+    # حفظ بأسلوب vim: حذف، إنشاء، ثم كتابات متتالية
+    target.unlink()
+    monitor._handle_event('deleted', path)
+    target.write_text('')
+    monitor._handle_event('created', path)
+    with target.open('a') as f:
+        for i in range(50):
+            f.write(f'user{i}:x:{1000 + i}:{1000 + i}\n')
+            f.flush()
+            monitor._handle_event('modified', path)
+
+    wait_for(lambda: monitor.verifications == 1)
+    time.sleep(0.4)
+    assert monitor.events_received == 52
+    assert monitor.verifications == 1
+    assert hashed == [target]
+    assert len(sink.alerts) == 1 and 'passwd' in sink.alerts[0][1]
+
+
+def test_temp_file_created_and_removed_in_window_is_ignored(event_monitor, tmp_path):
+    _target, sink, monitor, hashed = event_monitor
+    temp = tmp_path / '.passwd.swp'
+    temp.write_text('x')
+    monitor._handle_event('created', str(temp))
+    temp.unlink()
+    monitor._handle_event('deleted', str(temp))
+
+    wait_for(lambda: monitor.verifications == 1)
+    assert hashed == [] and sink.alerts == []
+
+
+def test_busy_file_is_verified_after_max_delay(event_monitor):
+    target, _sink, monitor, _hashed = event_monitor
+    started = time.monotonic()
+    # أحداث كل 50 ملي ثانية فلا تصل فترة الهدوء (0.2 ث) أبداً
+    while monitor.verifications == 0:
+        assert time.monotonic() - started < 3, "لم يتم التحقق بعد EVENT_MAX_DELAY"
+        with target.open('a') as f:
+            f.write('x\n')
+        monitor._handle_event('modified', str(target))
+        time.sleep(0.05)
+    assert time.monotonic() - started >= 0.9
@@ -0,0 +1,37 @@
+import sqlite3
+
+from conftest import tcp_frame, write_pcap
+
+SYN, FIN, PSH, ACK = 0x02, 0x01, 0x08, 0x10
+
+
+def ssh_session(packets):
+    """جلسة SSH كاملة من packets حزمة: مصافحة، بيانات في الاتجاهين، ثم إغلاق بـ FIN."""
+    client, server = ('10.0.0.5', 50022), ('10.0.0.1', 22)
+    fwd = lambda flags: tcp_frame(client[0], server[0], client[1], server[1], flags, b'x' * 48)
+    rev = lambda flags: tcp_frame(server[0], client[0], server[1], client[1], flags, b'y' * 48)
+    frames = [fwd(SYN), rev(SYN | ACK), fwd(ACK)]
+    frames += [(fwd if i % 2 == 0 else rev)(PSH | ACK) for i in range(packets - 6)]
+    frames += [fwd(FIN | ACK), rev(FIN | ACK), fwd(ACK)]
+    return frames
+
+
+def test_flow_session_alerts_once_and_rolls_up_every_packet(ids, nids_config, tmp_path):
+    nids_config.set('NIDS', 'FLOW_TRACKING', 'yes')
+    pcap = write_pcap(tmp_path / 'ssh.pcap', ssh_session(200))
+    logger = ids.IDSLogger()
+    aggregator = ids.AlertAggregator(logger, window=60)
+    aggregator.start()
+    try:
+        monitor = ids.NetworkMonitor(logger, nids_config, aggregator=aggregator, replay=True, workers=0)
+        stats = monitor.replay_pcap(str(pcap))
+    finally:
+        aggregator.stop()
+        logger.close()
+
+    assert stats['packets'] == 200
+    conn = sqlite3.connect(nids_config.get('DATABASE', 'PATH'))
+    alerts = conn.execute("SELECT message FROM alerts WHERE type = 'NIDS_ALERT'").fetchall()
+    assert alerts == [('اتصال TCP على منفذ مشبوه (22): 10.0.0.5:50022 -> 10.0.0.1:22',)]
+    rollups = conn.execute("SELECT alert_key, message, count FROM alert_rollups WHERE type = 'NIDS_ALERT'").fetchall()
+    assert rollups == [('TCP|10.0.0.5|50022|10.0.0.1|22', alerts[0][0], 200)]
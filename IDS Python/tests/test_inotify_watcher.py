@@ -0,0 +1,58 @@
+import os
+import queue
+
+import pytest
+
+
+@pytest.fixture
+def watcher(ids, tmp_path):
+    if not ids.InotifyWatcher.available():
+        pytest.skip("inotify غير متاح على هذا النظام")
+    target = tmp_path / 'passwd'
+    target.write_text('root:x:0:0\n')
+    events = queue.Queue()
+    watcher = ids.InotifyWatcher([str(target)], lambda event_type, path: events.put((event_type, path)))
+    try:
+        watcher.start()
+    except OSError as e:
+        pytest.skip(f"تعذر بدء inotify: {e}")
+    yield target, events
+    watcher.stop()
+    watcher.join(timeout=5)
+
+
+def next_event(events):
+    return events.get(timeout=5)
+
+
+def test_modify_replace_delete_and_recreate(watcher, tmp_path):
+    target, events = watcher
+    path = str(target)
+
+    (tmp_path / 'unrelated.log').write_text('x') # ملف غير مراقب في نفس المجلد
+    with open(target, 'a') as f:
+        f.write('user:x:1000:1000\n')
+    assert next_event(events) == ('modified', path)
+
+    # استبدال ذري: كتابة ملف مؤقت ثم rename فوق الملف المراقب
+    tmp = tmp_path / 'passwd.tmp'
+    tmp.write_text('root:x:0:0\n')
+    os.replace(tmp, target)
+    assert next_event(events) == ('modified', path)
+    # المراقبة أعيدت على الـ inode الجديد
+    with open(target, 'a') as f:
+        f.write('evil:x:0:0\n')
+    assert next_event(events) == ('modified', path)
+
+    target.unlink()
+    assert next_event(events) == ('deleted', path)
+    target.write_text('root:x:0:0\n')
+    assert next_event(events) == ('created', path)
+    # كتابة المحتوى بعد الإنشاء قد تصل كتعديل، ولا شيء غير ذلك
+    remaining = set()
+    while True:
+        try:
+            remaining.add(events.get(timeout=0.3))
+        except queue.Empty:
+            break
+    assert remaining <= {('modified', path)}
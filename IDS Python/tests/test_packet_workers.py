@@ -0,0 +1,64 @@
+import pytest
+
+from conftest import NIDS_SAMPLE_PCAP, AlertRecorder
+
+
+@pytest.mark.parametrize('workers', [2, 4])
+def test_workers_raise_same_alerts_as_inline(ids, nids_config, workers):
+    if not ids.PACKET_WORKERS_AVAILABLE or not ids.RAW_CAPTURE_AVAILABLE:
+        pytest.skip("العمليات العاملة تتطلب fork ومحرك الالتقاط الخام")
+    inline = AlertRecorder()
+    ids.NetworkMonitor(inline, nids_config, replay=True, workers=0).replay_pcap(str(NIDS_SAMPLE_PCAP))
+    sharded = AlertRecorder()
+    stats = ids.NetworkMonitor(sharded, nids_config, replay=True, workers=workers).replay_pcap(str(NIDS_SAMPLE_PCAP))
+
+    assert stats['workers'] == workers
+    assert stats['packets'] > 0
+    # العمليات العاملة تملك مرحلة تجميع خاصة بها (ALERT_SUMMARY)، فتقارن تنبيهات الشبكة فقط
+    nids_alerts = sorted(alert for alert in sharded.alerts if alert[0].startswith('NIDS_'))
+    assert nids_alerts == sorted(inline.alerts)
+    # منافذ المسح موزعة على كل العمليات، ومع ذلك تنبيه واحد بالحد المضبوط في الإعدادات
+    scans = [message for alert_type, message, _proto in sharded.alerts if alert_type == 'NIDS_PORT_SCAN']
+    assert len(scans) == 1
+    assert '10.0.0.99' in scans[0] and '(الحد 100)' in scans[0]
+
+
+def test_workers_use_rules_updated_after_start(ids, nids_config):
+    if not ids.PACKET_WORKERS_AVAILABLE or not ids.RAW_CAPTURE_AVAILABLE:
+        pytest.skip("العمليات العاملة تتطلب fork ومحرك الالتقاط الخام")
+    inline = AlertRecorder()
+    monitor = ids.NetworkMonitor(inline, nids_config, replay=True, workers=0)
+    monitor.update_rules(suspicious_ports=[22], monitor_icmp_ping=False)
+    monitor.replay_pcap(str(NIDS_SAMPLE_PCAP))
+    sharded = AlertRecorder()
+    monitor = ids.NetworkMonitor(sharded, nids_config, replay=True, workers=2)
+    # قواعد تختلف عن الإعدادات: العمليات العاملة تأخذها من المراقب الرئيسي وليس من ملف الإعدادات
+    monitor.update_rules(suspicious_ports=[22], monitor_icmp_ping=False)
+    monitor.replay_pcap(str(NIDS_SAMPLE_PCAP))
+
+    port_alerts = [message for alert_type, message, _proto in inline.alerts if alert_type == 'NIDS_ALERT']
+    assert port_alerts and all('منفذ مشبوه (22)' in message for message in port_alerts)
+    assert sorted(alert for alert in sharded.alerts if alert[0].startswith('NIDS_')) == sorted(inline.alerts)
+
+
+def metric_value(ids, sample):
+    for line in ids.metrics.render().splitlines():
+        if line.startswith(sample + ' '):
+            return float(line.rsplit(' ', 1)[1])
+    return 0.0
+
+
+def test_worker_metrics_reach_parent_registry(ids, nids_config):
+    if not ids.PACKET_WORKERS_AVAILABLE or not ids.RAW_CAPTURE_AVAILABLE:
+        pytest.skip("العمليات العاملة تتطلب fork ومحرك الالتقاط الخام")
+    alerts_before = metric_value(ids, 'ids_nids_alerts_total')
+    packets_before = metric_value(ids, 'ids_nids_packet_duration_seconds_count')
+    sink = AlertRecorder()
+    stats = ids.NetworkMonitor(sink, nids_config, replay=True, workers=2).replay_pcap(str(NIDS_SAMPLE_PCAP))
+
+    # تنبيهات العمليات العاملة وتنبيه المسح من العملية الرئيسية، وزمن كل حزمة عالجتها العمليات
+    nids_alerts = sum(1 for alert_type, _message, _proto in sink.alerts if alert_type.startswith('NIDS_'))
+    assert metric_value(ids, 'ids_nids_alerts_total') - alerts_before == nids_alerts
+    assert metric_value(ids, 'ids_nids_packet_duration_seconds_count') - packets_before == stats['packets']
+    # المجاميع تبقى بعد انتهاء العمليات
+    assert not ids.metrics._remote
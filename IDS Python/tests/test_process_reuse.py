@@ -0,0 +1,85 @@
+import contextlib
+
+import pytest
+
+from conftest import AlertRecorder
+
+
+class FakeProc:
+    """مجلد /proc وهمي: PID -> (رقم inode، الاسم، وقت البدء)."""
+
+    def __init__(self, procs):
+        self.procs = procs
+        self.stat_reads = 0
+
+    def scandir(self, path):
+        entries = [FakeEntry(str(pid), inode) for pid, (inode, _name, _start) in self.procs.items()]
+        return contextlib.nullcontext(entries)
+
+    def read_stat(self, pid):
+        self.stat_reads += 1
+        info = self.procs.get(pid)
+        return None if info is None else (info[1], info[2])
+
+
+class FakeEntry:
+    def __init__(self, name, inode):
+        self.name = name
+        self._inode = inode
+
+    def inode(self):
+        return self._inode
+
+
+@pytest.fixture
+def monitor(ids, monkeypatch):
+    saved = dict(ids.config.items('HIDS', raw=True))
+    ids.config.set('HIDS', 'SUSPICIOUS_PROCS', 'nc,xmrig')
+    ids.config.set('HIDS', 'WHITELIST_PROCS', '')
+    monitor = ids.ProcessMonitor(AlertRecorder(), ids.config)
+    for key in ('SUSPICIOUS_PROCS', 'WHITELIST_PROCS'):
+        ids.config.set('HIDS', key, saved[key.lower()])
+    monitor.matcher = ids.ProcessMatcher(['nc', 'xmrig']) # أسماء فقط: لا قراءة لـ cmdline أو exe من /proc الحقيقي
+    monitor.use_proc_fs = True
+    monitor._username = lambda pid: 'tester'
+    proc = FakeProc({1: (100, 'init', 1), 4242: (500, 'nc', 1000), 4243: (501, 'bash', 1001)})
+    monkeypatch.setattr(ids.os, 'scandir', proc.scandir)
+    monkeypatch.setattr(monitor, '_read_stat', proc.read_stat)
+    monitor.proc = proc
+    return monitor
+
+
+def alerted(monitor):
+    return [message.split(' — ')[0] for _type, message, _proto in monitor.logger.alerts]
+
+
+def test_known_processes_are_not_reread_or_realerted(monitor):
+    monitor._check_processes()
+    assert alerted(monitor) == ["عملية مشبوهة: nc (PID:4242, User:tester)"]
+    reads = monitor.proc.stat_reads
+    monitor._check_processes()
+    assert monitor.proc.stat_reads == reads # نفس inode: لا قراءة لـ stat
+    assert len(monitor.logger.alerts) == 1
+
+
+def test_reused_pid_is_reclassified(monitor):
+    monitor._check_processes()
+    # انتهت nc واستخدم رقمها لعملية جديدة (inode ووقت بدء مختلفان)
+    monitor.proc.procs[4242] = (502, 'xmrig', 2000)
+    monitor._check_processes()
+    assert alerted(monitor) == ["عملية مشبوهة: nc (PID:4242, User:tester)",
+                                                     "عملية مشبوهة: xmrig (PID:4242, User:tester)"]
+    assert monitor.alerted_procs == {(4242, 2000)}
+
+
+def test_reused_pid_with_same_name_alerts_again(monitor):
+    monitor._check_processes()
+    monitor.proc.procs[4242] = (503, 'nc', 3000)
+    monitor._check_processes()
+    assert len(monitor.logger.alerts) == 2
+    # عملية موثوقة أخذت نفس الرقم: لا تنبيه، وتزال العملية القديمة من قائمة التنبيهات
+    monitor.proc.procs[4242] = (504, 'bash', 4000)
+    monitor._check_processes()
+    assert len(monitor.logger.alerts) == 2
+    assert monitor.alerted_procs == set()
+
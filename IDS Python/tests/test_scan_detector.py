@@ -0,0 +1,69 @@
+import pytest
+
+
+def detector(ids, **kwargs):
+    alerts = []
+    scan = ids.ScanDetector(on_alert=lambda kind, subject, estimate, threshold: alerts.append((kind, subject, estimate)), **kwargs)
+    return scan, alerts
+
+
+def kinds(alerts):
+    return [kind for kind, _subject, _estimate in alerts]
+
+
+def test_port_scan_fires_at_threshold_not_below(ids):
+    scan, alerts = detector(ids, port_threshold=100)
+    for port in range(1, 100):
+        scan.observe_syn('10.0.0.99', '10.0.0.1', port, 1000.0)
+    assert 'PORT_SCAN' not in kinds(alerts)
+    scan.observe_syn('10.0.0.99', '10.0.0.1', 100, 1000.0)
+    assert ('PORT_SCAN', '10.0.0.99', 100) in alerts
+    # تنبيه واحد لكل مصدر في النافذة
+    scan.observe_syn('10.0.0.99', '10.0.0.1', 101, 1000.0)
+    assert kinds(alerts).count('PORT_SCAN') == 1
+
+
+@pytest.mark.parametrize('probe', ['syn', 'ping'])
+def test_host_scan_fires_at_threshold_not_below(ids, probe):
+    scan, alerts = detector(ids, host_threshold=50)
+    observe = ((lambda dst: scan.observe_syn('10.0.0.98', dst, 445, 1000.0)) if probe == 'syn'
+               else (lambda dst: scan.observe_ping('10.0.0.98', dst, 1000.0)))
+    for i in range(1, 50):
+        observe(f'10.1.0.{i}')
+    # تكرار نفس الوجهة لا يحتسب عنواناً جديداً
+    observe('10.1.0.1')
+    assert 'HOST_SCAN' not in kinds(alerts)
+    observe('10.1.0.50')
+    assert alerts == [('HOST_SCAN', '10.0.0.98', 50)]
+
+
+def test_syn_flood_fires_at_threshold_not_below(ids):
+    scan, alerts = detector(ids, syn_threshold=1000)
+    for _ in range(999):
+        scan.observe_syn('10.0.0.97', '10.0.0.1', 80, 1000.0)
+    assert alerts == []
+    scan.observe_syn('10.0.0.97', '10.0.0.1', 80, 1000.0)
+    assert sorted(alerts) == [('SYN_FLOOD', '10.0.0.97', 1000), ('SYN_FLOOD_TARGET', '10.0.0.1', 1000)]
+
+
+def test_sliding_window_counts_previous_window(ids):
+    scan, alerts = detector(ids, window=60, port_threshold=100)
+    for port in range(1, 81):
+        scan.observe_syn('10.0.0.99', '10.0.0.1', port, 1000.0)
+    # بعد ربع النافذة التالية تبقى 3/4 النافذة السابقة في التقدير: 60 + 40 = 100
+    for port in range(81, 121):
+        scan.observe_syn('10.0.0.99', '10.0.0.1', port, 1075.0)
+    assert kinds(alerts) == ['PORT_SCAN']
+
+
+def test_memory_is_constant_under_spoofed_sources(ids):
+    scan, alerts = detector(ids, window=60)
+    sizes = lambda: (scan.memory_bytes, len(scan._seen_ports.data), len(scan._seen_hosts.data),
+                     [len(sk.table) for sk in scan._ports + scan._hosts + scan._syns])
+    before = sizes()
+    # مليون SYN من مصادر مزورة مختلفة نحو خادم واحد، على مدى نافذتين (المصدر رقم بدلاً من نص العنوان، والتجزئة هي نفسها)
+    for i in range(1000000):
+        scan.observe_syn(i, '10.0.0.1', 80, 1000.0 + i * 0.0001)
+    assert sizes() == before
+    assert len(scan._alerted) <= scan.MAX_ALERTS_PER_WINDOW
+    assert ('SYN_FLOOD_TARGET', '10.0.0.1') in {(kind, subject) for kind, subject, _estimate in alerts}